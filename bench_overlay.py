@@ -0,0 +1,128 @@
+"""
+Overlay compositing benchmark.
+
+Compares the two OVERLAY_MODE paths of main.py on a synthetic news overlay
+(ticker band + logo + side panel):
+
+  cairo        videoconvert ! cairooverlay ! videoconvert
+  composition  overlaycomposition blending straight into I420
+
+Usage:
+  python bench_overlay.py [--frames 600] [--encode] [--animate]
+
+--encode adds the x264enc settings used on air, --animate changes the
+overlay every frame (worst case for the cached composition path).
+Reports fps and process CPU milliseconds per frame for 720p and 1080p.
+"""
+import argparse
+import resource
+import time
+
+import cairo
+
+from main import Gst, TileTracker, build_overlay_composition
+
+RESOLUTIONS = [(1280, 720), (1920, 1080)]
+MODES = ["cairo", "composition"]
+ENCODER = "x264enc bitrate=2500 tune=zerolatency speed-preset=ultrafast key-int-max=40 threads=3 ! "
+
+
+def make_overlay(width, height, offset=0):
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    ctx = cairo.Context(surface)
+    # Ticker band
+    band = height // 10
+    ctx.set_source_rgba(0.75, 0.22, 0.17, 0.95)
+    ctx.rectangle(0, height - band, width, band)
+    ctx.fill()
+    ctx.set_source_rgb(1, 1, 1)
+    ctx.set_font_size(band * 0.5)
+    ctx.move_to(width - (offset * 4) % (width * 2), height - band * 0.35)
+    ctx.show_text("BREAKING NEWS " * 8)
+    # Logo
+    ctx.set_source_rgba(0.95, 0.77, 0.06, 1)
+    ctx.rectangle(width - height // 6 - 20, 20, height // 6, height // 6)
+    ctx.fill()
+    # Side panel
+    ctx.set_source_rgba(0, 0, 0, 0.6)
+    ctx.rectangle(0, 0, width // 4, height - band)
+    ctx.fill()
+    surface.flush()
+    return surface
+
+
+def run(mode, width, height, frames, encode, animate):
+    tiles = TileTracker(width, height, cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height).get_stride())
+    state = {"surface": make_overlay(width, height), "frame": 0, "sequence": 0, "composition": None}
+    tiles.scan(state["surface"].get_data())
+
+    def next_overlay():
+        state["frame"] += 1
+        if animate:
+            state["surface"] = make_overlay(width, height, state["frame"])
+            tiles.scan(state["surface"].get_data())
+            state["sequence"] += 1
+
+    def on_draw(overlay, context, timestamp, duration):
+        next_overlay()
+        rects = tiles.coverage_rects
+        if rects is not None:
+            for rect in rects:
+                context.rectangle(*rect)
+            context.clip()
+        context.set_source_surface(state["surface"], 0, 0)
+        context.paint()
+
+    def on_composition_draw(overlay, sample):
+        next_overlay()
+        if state["composition"] is None or animate:
+            state["composition"] = build_overlay_composition(state["surface"], tiles.coverage_rects)
+        return state["composition"]
+
+    if mode == "composition":
+        stage = "overlaycomposition name=overlay ! "
+    else:
+        stage = "videoconvert ! cairooverlay name=overlay ! videoconvert ! video/x-raw,format=I420 ! "
+
+    pipeline = Gst.parse_launch(
+        f"videotestsrc num-buffers={frames} pattern=smpte ! "
+        f"video/x-raw,format=I420,width={width},height={height},framerate=30/1 ! "
+        f"{stage}{ENCODER if encode else ''}fakesink sync=false"
+    )
+    overlay = pipeline.get_by_name("overlay")
+    overlay.connect("draw", on_composition_draw if mode == "composition" else on_draw)
+
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    wall_start = time.perf_counter()
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    wall = time.perf_counter() - wall_start
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+    pipeline.set_state(Gst.State.NULL)
+
+    if msg and msg.type == Gst.MessageType.ERROR:
+        err, debug = msg.parse_error()
+        raise RuntimeError(f"{mode} {width}x{height}: {err} ({debug})")
+
+    cpu = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+    return frames / wall, cpu * 1000.0 / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark overlay compositing modes")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--encode", action="store_true", help="include x264enc in the pipeline")
+    parser.add_argument("--animate", action="store_true", help="change the overlay every frame")
+    args = parser.parse_args()
+
+    print(f"--- Overlay Benchmark ({args.frames} frames, encode={args.encode}, animate={args.animate}) ---")
+    print(f"{'resolution':<12}{'mode':<14}{'fps':>10}{'cpu ms/frame':>16}")
+    for width, height in RESOLUTIONS:
+        for mode in MODES:
+            fps, cpu_ms = run(mode, width, height, args.frames, args.encode, args.animate)
+            print(f"{f'{width}x{height}':<12}{mode:<14}{fps:>10.1f}{cpu_ms:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text, Enum
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text, Enum, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import datetime
@@ -55,6 +55,7 @@ class NewsItem(Base):
     
     is_active = Column(Boolean, default=True)
     priority = Column(Integer, default=0) # Higher = Show first
+    channel = Column(String, nullable=True) # None = every channel, else one channel name
     
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
@@ -120,6 +121,8 @@ class Program(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
     video_path = Column(String, nullable=False) # Local path or URL
+    clips = Column(Text, nullable=True) # JSON list of paths (rundown); None = just video_path
+    loop = Column(Boolean, default=True) # Repeat the rundown until end_time
     
     start_time = Column(DateTime, nullable=False)
     end_time = Column(DateTime, nullable=False)
@@ -180,3 +183,17 @@ def get_db():
 # Init DB
 def init_db():
     Base.metadata.create_all(bind=engine)
+    migrate_db()
+
+def migrate_db():
+    # create_all() does not add columns to existing tables
+    columns = {c["name"] for c in inspect(engine).get_columns("programs")}
+    with engine.begin() as conn:
+        if "clips" not in columns:
+            conn.execute(text("ALTER TABLE programs ADD COLUMN clips TEXT"))
+        if "loop" not in columns:
+            conn.execute(text("ALTER TABLE programs ADD COLUMN loop BOOLEAN DEFAULT 1"))
+    news_columns = {c["name"] for c in inspect(engine).get_columns("news_items")}
+    with engine.begin() as conn:
+        if "channel" not in news_columns:
+            conn.execute(text("ALTER TABLE news_items ADD COLUMN channel VARCHAR"))
@@ -2,10 +2,18 @@ import sys
 import os
 import signal
 import threading
+import collections
+import mmap
+import queue
+import socket
+import struct
+import subprocess
 import gi
 import cairo
 
 gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+gi.require_version('GstPbutils', '1.0')
 gi.require_version('Gtk', '3.0')
 gi.require_version('WebKit2', '4.0')
 
@@ -13,96 +21,1958 @@ print("DEBUG: main.py is starting...", flush=True)
 
 import time
 import json
+import zlib
+import hashlib
+import concurrent.futures
+import datetime
 import urllib.request
-from gi.repository import Gst, Gtk, GObject, WebKit2, GLib, Gdk
+from gi.repository import Gst, GstVideo, GstPbutils, Gtk, GObject, WebKit2, GLib, Gdk
 
 # Initialize GStreamer and GTK
 Gst.init(None)
 
 # Configuration
-WIDTH = 1280
-HEIGHT = 720
+# Output profile values are passed in by StreamManager (see OUTPUT_PROFILES in server.py)
+STREAM_PROFILE = os.environ.get('STREAM_PROFILE', 'default')
+WIDTH = int(os.environ.get('STREAM_WIDTH', 1280))
+HEIGHT = int(os.environ.get('STREAM_HEIGHT', 720))
 RTMP_URL = os.environ.get('RTMP_URL', 'rtmp://localhost/live/test')
-FRAMERATE = 15
+FRAMERATE = int(os.environ.get('STREAM_FRAMERATE', 15))
+VIDEO_BITRATE = int(os.environ.get('VIDEO_BITRATE', 2500)) # kbit/s
+KEYFRAME_INTERVAL = int(os.environ.get('KEYFRAME_INTERVAL', 40)) # frames
+X264_PRESET = os.environ.get('X264_PRESET', 'ultrafast')
+X264_THREADS = int(os.environ.get('X264_THREADS', 0)) or os.cpu_count() or 1
+AUDIO_BITRATE = int(os.environ.get('AUDIO_BITRATE', 128000)) # bit/s
+# Extra ladder outputs, JSON list of {name, width, height, video_bitrate, rtmp_url[, threads]}.
+# They share the single WebKit render and overlay blend of the main output.
+RENDITIONS = json.loads(os.environ.get('RENDITIONS') or '[]')
+TILE_SIZE = 64
+OVERLAY_RING_SIZE = 3
+# cairo: videoconvert ! cairooverlay ! videoconvert (ARGB round trip per frame)
+# composition: overlaycomposition blends cached ARGB rectangles straight into I420
+OVERLAY_MODE = os.environ.get('OVERLAY_MODE', 'cairo')
+# cairo's ARGB32 is native-endian premultiplied ARGB
+OVERLAY_VIDEO_FORMAT = GstVideo.VideoFormat.BGRA if sys.byteorder == 'little' else GstVideo.VideoFormat.ARGB
+# inline: WebKit renders inside this process
+# process: WebKit renders in a child process writing to a shared-memory ring
+OVERLAY_RENDERER = os.environ.get('OVERLAY_RENDERER', 'inline')
+RENDERER_CPUS = os.environ.get('RENDERER_CPUS') # e.g. "0" or "0,1"
+ENCODER_CPUS = os.environ.get('ENCODER_CPUS') # e.g. "1,2,3"
+RENDERER_STALL_TIMEOUT = 10 # seconds without a renderer heartbeat before a restart
+# Adaptive snapshot rate: full FRAMERATE while the overlay changes, then idle
+OVERLAY_IDLE_FPS = float(os.environ.get('OVERLAY_IDLE_FPS', 2))
+OVERLAY_IDLE_AFTER = 1.5 # seconds without a change before dropping to the idle rate
+# Programs are decoded this many seconds ahead of their start time
+PROGRAM_PREROLL = float(os.environ.get('PROGRAM_PREROLL', 10))
+SOURCE_LEAK_AFTER = 60 # seconds a removed bin may stay alive before it is reported as leaked
 
-class StreamOverlayApp:
-    def __init__(self):
-        self.mainloop = GLib.MainLoop()
-        
-        # --- shared state for overlay ---
-        self.surface_lock = threading.Lock()
-        self.current_surface = None
-        self.img_surface = None
-        self.img_ctx = None
-        self.last_heartbeat = time.time()
-        
-        # --- Program Schedule State ---
-        self.current_program_id = None
-        self.program_bin = None
-        self.api_base = "http://127.0.0.1:8123/api"
-        
+# Decoded audio (music bed, TTS clips) is kept as raw PCM in this format
+PCM_RATE = 44100
+PCM_CHANNELS = 2
+PCM_FRAME_BYTES = 2 * PCM_CHANNELS # S16LE
+PCM_CAPS = f'audio/x-raw,format=S16LE,layout=interleaved,rate={PCM_RATE},channels={PCM_CHANNELS}'
+PCM_CHUNK_FRAMES = 1024 # ~23 ms per appsrc buffer
+TTS_CACHE_BYTES = int(os.environ.get('TTS_CACHE_MB', 64)) * 1024 * 1024
+# Decoded music bed, whole playlist (PCM is ~10 MB per minute)
+MUSIC_CACHE_BYTES = int(os.environ.get('MUSIC_CACHE_MB', 300)) * 1024 * 1024
+# Music bed playlist (JSON list of files), set by StreamManager
+MUSIC_PLAYLIST = json.loads(os.environ.get('MUSIC_PLAYLIST') or 'null')
+# Layer cache: static chrome (logo, L-bar, header/footer bars) is rendered by a
+# second view and only re-rasterized when the config changes
+OVERLAY_LAYERS = os.environ.get('OVERLAY_LAYERS', '0') == '1'
+STATIC_RASTER_DELAY = 1000 # ms after a config change, lets CSS transitions settle
+# RTMP outputs: each gets a leaky queue of this many ms and reconnects on its own
+OUTPUT_QUEUE_MS = int(os.environ.get('OUTPUT_QUEUE_MS', 2000))
+OUTPUT_BACKOFF_MIN = 1 # seconds before the first reconnect, doubled per failure
+OUTPUT_BACKOFF_MAX = 60
+OUTPUT_STABLE_AFTER = 30 # seconds live before the backoff resets
+OUTPUT_STALL_TIMEOUT = 15 # seconds an output may refuse data while the tee is feeding it
+# Warm standby: StreamManager keeps a second process prerolled in PAUSED with
+# no RTMP outputs and sends "promote" when the live one fails
+STREAM_STANDBY = os.environ.get('STREAM_STANDBY', '0') == '1'
+# On-air recording: MPEG-TS segments remuxed from the encoded output
+RECORDING = os.environ.get('RECORDING', '0') == '1'
+RECORDINGS_DIR = os.environ.get('RECORDINGS_DIR', os.path.join('data', 'recordings'))
+RECORDING_SEGMENT = int(os.environ.get('RECORDING_SEGMENT', 60)) # seconds
+RECORDING_MAX_MB = int(os.environ.get('RECORDING_MAX_MB', 20480)) # oldest segments deleted beyond this
+RECORDING_RETRY = 30 # seconds before recording is re-attached after a write error
+# Admin preview: a small JPEG of the composite every PREVIEW_INTERVAL seconds (0 = off)
+PREVIEW_INTERVAL = float(os.environ.get('PREVIEW_INTERVAL', 2))
+PREVIEW_WIDTH = int(os.environ.get('PREVIEW_WIDTH', 480))
+PREVIEW_FILE = os.environ.get('PREVIEW_FILE', os.path.join('data', 'preview.jpg'))
+# The GLib loop only does GStreamer/GTK work; file and network I/O go to workers
+IO_WORKERS = 2
+LOOP_LAG_INTERVAL = 50 # ms between main-loop lag probes
+LOOP_STALL_MS = 250 # a callback held the loop this long, logged
+# Progress heartbeat: one JSON record per second to this fd (StreamManager's watchdog)
+HEARTBEAT_FD = os.environ.get('HEARTBEAT_FD')
+HEARTBEAT_INTERVAL = 1.0
+
+# Shared-memory overlay ring layout (OVERLAY_RENDERER=process)
+# header: magic, width, height, stride, slots, latest, reading, renderer pid, heartbeat, published, overlay fps
+SHM_MAGIC = b'EKOV'
+SHM_HEADER = struct.Struct('<4sIIIIiiIdQd')
+SHM_HEADER_SIZE = 64
+SHM_LATEST = 20
+SHM_READING = 24
+SHM_PID = 28
+SHM_HEARTBEAT = 32
+SHM_PUBLISHED = 40
+SHM_FPS = 48
+SHARED_RING_SIZE = 4
+# slot: sequence (0 while being written), flags, static rect count, dynamic
+# rect count, static layer generation, then static rects + dynamic rects
+SHM_SLOT_META = struct.Struct('<QIIIQ')
+SHM_RECT = struct.Struct('<HHHH')
+SHM_MAX_RECTS = 1024
+SHM_FLAG_FULL_FRAME = 1
+SHM_SLOT_META_SIZE = (SHM_SLOT_META.size + SHM_MAX_RECTS * SHM_RECT.size + 63) // 64 * 64
+
+def parse_cpus(value):
+    if not value:
+        return None
+    return {int(c) for c in value.split(',') if c.strip()}
+
+def rendition_problem(r):
+    """Why a rendition can't be encoded from the composite, or None."""
+    try:
+        width, height, bitrate = int(r["width"]), int(r["height"]), int(r["video_bitrate"])
+    except (KeyError, TypeError, ValueError):
+        return "needs integer width, height and video_bitrate"
+    if width <= 0 or height <= 0 or width % 2 or height % 2:
+        return f"{width}x{height} must be positive and even"
+    if width > WIDTH or height > HEIGHT:
+        return f"{width}x{height} is larger than the {WIDTH}x{HEIGHT} composite"
+    if not 100 <= bitrate <= 50000:
+        return f"video_bitrate {bitrate} is outside 100-50000 kbit/s"
+    if not str(r.get("rtmp_url", "")).startswith(("rtmp://", "rtmps://")):
+        return "rtmp_url must start with rtmp:// or rtmps://"
+    return None
+
+def usable_renditions(renditions):
+    # A rendition branch that fails negotiation errors back through vtee and
+    # stops the main output too, so bad ones are never built
+    usable = []
+    for i, r in enumerate(renditions):
+        problem = rendition_problem(r)
+        if problem:
+            print(f"Skipping rendition {r.get('name', i)}: {problem}")
+        else:
+            usable.append(r)
+    return usable
+
+RENDITIONS = usable_renditions(RENDITIONS)
+
+class TileTracker:
+    """Per-tile change detection for the overlay snapshot.
+
+    Each TILE_SIZE band of rows is hashed first; only bands whose CRC moved are
+    split into tiles. Tiles are also classified as visible (any non-zero pixel)
+    so the blend in on_draw can skip fully transparent areas.
+    """
+    def __init__(self, width, height, stride, tile=TILE_SIZE):
+        self.width = width
+        self.height = height
+        self.stride = stride
+        self.tile = tile
+        self.cols = (width + tile - 1) // tile
+        self.rows = (height + tile - 1) // tile
+        self.band_crcs = [None] * self.rows
+        self.tile_crcs = [[None] * self.cols for _ in range(self.rows)]
+        self.visible = [[True] * self.cols for _ in range(self.rows)]
+        self.zero_row = bytes(tile * 4)
+        self.zero_crcs = {}
+        self.coverage_rects = None # None = whole frame visible
+
+    def tile_rect(self, row, col):
+        x = col * self.tile
+        y = row * self.tile
+        return x, y, min(self.tile, self.width - x), min(self.tile, self.height - y)
+
+    def scan(self, data, region=None):
+        # Returns the (row, col) tiles that changed since the previous scan.
+        # region=(x, y, w, h) limits the scan to the rows WebKit reported damaged.
+        if region is None:
+            first_row, last_row = 0, self.rows - 1
+        else:
+            first_row = max(0, region[1] // self.tile)
+            last_row = min(self.rows - 1, (region[1] + region[3] - 1) // self.tile)
+
+        dirty = []
+        for row in range(first_row, last_row + 1):
+            y0 = row * self.tile
+            y1 = min(y0 + self.tile, self.height)
+            band_crc = zlib.crc32(data[y0 * self.stride:y1 * self.stride])
+            if band_crc == self.band_crcs[row]:
+                continue
+            self.band_crcs[row] = band_crc
+
+            for col in range(self.cols):
+                x, _, w, h = self.tile_rect(row, col)
+                x0 = x * 4
+                x1 = x0 + w * 4
+                crc = 0
+                for y in range(y0, y1):
+                    offset = y * self.stride
+                    crc = zlib.crc32(data[offset + x0:offset + x1], crc)
+                if crc == self.tile_crcs[row][col]:
+                    continue
+                self.tile_crcs[row][col] = crc
+                self.visible[row][col] = not self._is_blank(data, crc, x0, x1, y0, y1)
+                dirty.append((row, col))
+
+        if dirty:
+            self._rebuild_coverage()
+        return dirty
+
+    def _is_blank(self, data, crc, x0, x1, y0, y1):
+        # Premultiplied ARGB: fully transparent pixels are all-zero bytes.
+        # The CRC of an all-zero tile is a cheap pre-filter before the exact check.
+        key = (x1 - x0, y1 - y0)
+        if key not in self.zero_crcs:
+            zero_crc = 0
+            for _ in range(y1 - y0):
+                zero_crc = zlib.crc32(self.zero_row[:x1 - x0], zero_crc)
+            self.zero_crcs[key] = zero_crc
+        if crc != self.zero_crcs[key]:
+            return False
+        zero = self.zero_row[:x1 - x0]
+        for y in range(y0, y1):
+            offset = y * self.stride
+            if data[offset + x0:offset + x1] != zero:
+                return False
+        return True
+
+    def rects(self, tiles):
+        # Merge horizontally adjacent tiles of the same row into one rectangle
+        rects = []
+        for row, col in sorted(tiles):
+            x, y, w, h = self.tile_rect(row, col)
+            if rects:
+                px, py, pw, ph = rects[-1]
+                if py == y and px + pw == x:
+                    rects[-1] = (px, py, pw + w, ph)
+                    continue
+            rects.append((x, y, w, h))
+        return rects
+
+    def _rebuild_coverage(self):
+        visible = [(r, c) for r in range(self.rows) for c in range(self.cols) if self.visible[r][c]]
+        if len(visible) == self.rows * self.cols:
+            self.coverage_rects = None
+        else:
+            self.coverage_rects = self.rects(visible)
+
+def build_overlay_rectangles(surface, rects):
+    # Wrap the visible parts of a cairo ARGB32 surface as overlay rectangles.
+    # overlaycomposition caches each rectangle converted to the video format,
+    # so rectangles should only be rebuilt when their pixels change.
+    width = surface.get_width()
+    height = surface.get_height()
+    if rects is None:
+        rects = [(0, 0, width, height)]
+    data = surface.get_data()
+    stride = surface.get_stride()
+
+    rectangles = []
+    for x, y, w, h in rects:
+        start = y * stride + x * 4
+        if x == 0 and w * 4 == stride:
+            pixels = bytes(data[start:start + h * stride])
+        else:
+            pixels = b''.join(data[start + r * stride:start + r * stride + w * 4] for r in range(h))
+        buf = Gst.Buffer.new_wrapped(pixels)
+        GstVideo.buffer_add_video_meta(buf, GstVideo.VideoFrameFlags.NONE, OVERLAY_VIDEO_FORMAT, w, h)
+        rectangles.append(GstVideo.VideoOverlayRectangle.new_raw(
+            buf, x, y, w, h, GstVideo.VideoOverlayFormatFlags.PREMULTIPLIED_ALPHA))
+    return rectangles
+
+def compose_overlay_rectangles(rectangles):
+    composition = None
+    for rect in rectangles:
+        if composition is None:
+            composition = GstVideo.VideoOverlayComposition.new(rect)
+        else:
+            composition.add_rectangle(rect)
+    return composition
+
+def build_overlay_composition(surface, rects):
+    return compose_overlay_rectangles(build_overlay_rectangles(surface, rects))
+
+class OverlaySlot:
+    def __init__(self, index, width, height, surface=None):
+        self.index = index
+        self.surface = surface or cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        self.ctx = cairo.Context(self.surface)
+        self.ctx.set_operator(cairo.OPERATOR_SOURCE)
+        self.pending = set() # tiles changed since this slot was last written
+        self.coverage_rects = None
+        # Split of coverage_rects for composition mode: tiles holding only
+        # static layer pixels, and tiles the dynamic layer draws into
+        self.static_rects = []
+        self.dynamic_rects = None
+        self.static_generation = 0
+        self.sequence = 0
+
+class OverlayRing:
+    """Pre-allocated overlay surfaces handed from the GTK thread to the
+    GStreamer streaming thread without a shared lock.
+
+    The writer fills a slot taken from `free` and appends it to `mailbox`; the
+    reader pops the newest slot and returns the one it was blending. Each
+    deque append/pop is atomic, so every slot is removed by exactly one side,
+    but the two sides interleave: the writer's reclaim can run after the
+    reader has already taken the newest slot and leave an older one behind.
+    latest() therefore never goes back to a lower sequence than `front`.
+    """
+    def __init__(self, width, height, size=OVERLAY_RING_SIZE):
+        self.slots = [OverlaySlot(i, width, height) for i in range(size)]
+        self.free = collections.deque(self.slots)
+        self.mailbox = collections.deque()
+        self.front = None # owned by the streaming thread
+        self.needs_publish = False
+        self.sequence = 0
+        self.published = 0
+        self.dropped = 0 # published but replaced before on_draw saw them
+        self.repeated = 0 # on_draw found no newer frame and reused the last one
+        self.starved = 0 # writer found no free slot
+
+    def mark_dirty(self, tiles):
+        for slot in self.slots:
+            slot.pending.update(tiles)
+        self.needs_publish = True
+
+    def acquire(self):
+        # GTK thread
+        try:
+            return self.free.popleft()
+        except IndexError:
+            self.starved += 1
+            return None
+
+    def publish(self, slot):
+        # GTK thread
+        self.sequence += 1
+        slot.sequence = self.sequence
+        self.mailbox.append(slot)
+        self.published += 1
+        self.needs_publish = False
+        # Reclaim frames the streaming thread never picked up
+        while len(self.mailbox) > 1:
+            try:
+                stale = self.mailbox.popleft()
+            except IndexError:
+                break
+            self.free.append(stale)
+            self.dropped += 1
+
+    def latest(self):
+        # Streaming thread
+        try:
+            slot = self.mailbox.pop()
+        except IndexError:
+            if self.front is not None:
+                self.repeated += 1
+            return self.front
+        if self.front is not None and slot.sequence <= self.front.sequence:
+            # Left over from a reclaim that raced with our last pop
+            self.free.append(slot)
+            self.dropped += 1
+            self.repeated += 1
+            return self.front
+        if self.front is not None:
+            self.free.append(self.front)
+        self.front = slot
+        return slot
+
+    def stats(self):
+        return {
+            "published": self.published,
+            "dropped": self.dropped,
+            "repeated": self.repeated,
+            "starved": self.starved,
+            "sequence": self.front.sequence if self.front else 0
+        }
+
+def layer_url(url, layer):
+    # overlay.html renders only the requested layer (see its ?layer= handling)
+    separator = '&' if '?' in url else '?'
+    return f"{url}{separator}layer={layer}"
+
+class OverlayRenderer:
+    """Offscreen WebKit view snapshotted into an overlay ring.
+
+    Runs inside StreamOverlayApp (OVERLAY_RENDERER=inline, ring is an
+    OverlayRing) or alone in a child process (OVERLAY_RENDERER=process, ring is
+    a SharedOverlayWriter).
+    """
+    def __init__(self, ring):
+        self.ring = ring
+        self.loaded = False
+
+        # --- Dirty-region tracking ---
+        # snap_surface always holds the latest full WebKit snapshot; only tiles
+        # that changed are copied into the ring slots (what on_draw blends).
+        self.snap_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, WIDTH, HEIGHT)
+        self.snap_ctx = cairo.Context(self.snap_surface)
+        self.snap_ctx.set_operator(cairo.OPERATOR_SOURCE)
+        self.tiles = TileTracker(WIDTH, HEIGHT, self.snap_surface.get_stride())
+        self.damage = None
+        self.damage_tracking = False
+        self.snapshots_static = 0
+        self.snapshots_updated = 0
+
+        # --- Adaptive snapshot rate ---
+        self.active_until = 0 # full rate until then, idle rate afterwards
+        self.tick_source = None
+        self.tick_interval = 0
+        self.tick_times = collections.deque(maxlen=FRAMERATE * 5 + 1)
+
+        # Load overlay
+        overlay_url = os.environ.get('OVERLAY_URL')
+        if not overlay_url:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            html_path = os.path.join(current_dir, 'overlay.html')
+            overlay_url = f'file://{html_path}'
+
+        # --- Static layer cache (OVERLAY_LAYERS=1) ---
+        # static_surface holds the rasterized chrome; publish_overlay puts the
+        # dynamic snapshot on top of it.
+        self.static_surface = None
+        self.static_generation = 0
+        self.static_timer = None
+        self.static_rasters = 0
+        if OVERLAY_LAYERS:
+            self.static_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, WIDTH, HEIGHT)
+            self.static_ctx = cairo.Context(self.static_surface)
+            self.static_ctx.set_operator(cairo.OPERATOR_SOURCE)
+            self.static_tiles = TileTracker(WIDTH, HEIGHT, self.static_surface.get_stride())
+            self.static_window, self.static_view = self.create_view(layer_url(overlay_url, 'static'))
+            self.static_view.connect('load-changed', self.on_static_load_changed)
+            # overlay.html (static layer) posts overlayStaticChanged after applying config
+            content_manager = self.static_view.get_user_content_manager()
+            content_manager.connect('script-message-received::overlayStaticChanged',
+                                    lambda manager, result: self.schedule_static_raster(STATIC_RASTER_DELAY))
+            content_manager.register_script_message_handler('overlayStaticChanged')
+            overlay_url = layer_url(overlay_url, 'dynamic')
+
+        self.window, self.webview = self.create_view(overlay_url)
+        self.window.connect('damage-event', self.on_damage)
+        self.webview.connect('load-changed', self.on_load_changed)
+
+        # overlay.html calls window.webkit.messageHandlers.overlayWake.postMessage()
+        content_manager = self.webview.get_user_content_manager()
+        content_manager.connect('script-message-received::overlayWake', lambda manager, result: self.wake())
+        content_manager.register_script_message_handler('overlayWake')
+
+        # Start the (adaptive) snapshot timer
+        self.wake()
+
+    def create_view(self, uri):
         # --- WebKit Setup (Headless) ---
-        self.window = Gtk.OffscreenWindow()
-        self.window.set_default_size(WIDTH, HEIGHT)
+        window = Gtk.OffscreenWindow()
+        window.set_default_size(WIDTH, HEIGHT)
         
-        self.webview = WebKit2.WebView()
+        webview = WebKit2.WebView()
         
         # Configure WebView Settings
-        settings = self.webview.get_settings()
+        settings = webview.get_settings()
         settings.set_enable_write_console_messages_to_stdout(True) # Debugging
         settings.set_enable_developer_extras(True)
         settings.set_enable_webgl(False)
         # Spoof a standard browser User-Agent to avoid being blocked
         settings.set_user_agent("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
         settings.set_media_playback_requires_user_gesture(False) # Allow autoplay
-        self.webview.set_settings(settings)
+        webview.set_settings(settings)
         
-        self.webview.set_background_color(Gdk.RGBA(0, 0, 0, 0)) # Transparent background
-        self.window.add(self.webview)
+        webview.set_background_color(Gdk.RGBA(0, 0, 0, 0)) # Transparent background
+        # overlay.html is laid out for 720p, scale it to the output height
+        webview.set_zoom_level(HEIGHT / 720)
+        window.add(webview)
         
-        # Load overlay
-        overlay_url = os.environ.get('OVERLAY_URL')
-        if not overlay_url:
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            html_path = os.path.join(current_dir, 'overlay.html')
-            overlay_url = f'file://{html_path}'
+        print(f"Loading overlay from: {uri}")
+        webview.load_uri(uri)
         
-        print(f"Loading overlay from: {overlay_url}")
-        self.webview.load_uri(overlay_url)
+        window.show_all()
+        return window, webview
+
+    def wake(self):
+        # Back to full rate now, e.g. the page is about to animate
+        self.active_until = time.time() + OVERLAY_IDLE_AFTER
+        if self.tick_interval != 1000 // FRAMERATE:
+            self.schedule_tick(0)
+
+    def schedule_tick(self, interval):
+        if self.tick_source:
+            GLib.source_remove(self.tick_source)
+        self.tick_interval = interval
+        self.tick_source = GLib.timeout_add(interval, self.on_tick)
+
+    def on_tick(self):
+        self.tick_source = None
+        self.update_surface()
+        now = time.time()
+        self.tick_times.append(now)
+        if now < self.active_until:
+            self.schedule_tick(1000 // FRAMERATE)
+        else:
+            self.schedule_tick(int(1000 / OVERLAY_IDLE_FPS))
+        return False
+
+    def effective_fps(self):
+        # Snapshots per second over the last 5 seconds
+        now = time.time()
+        return sum(1 for t in self.tick_times if now - t <= 5.0) / 5.0
+
+    def on_damage(self, widget, event):
+        # WebKit repainted part of the offscreen window. Once the first event
+        # arrives we trust damage and skip snapshots while nothing is damaged.
+        area = event.area
+        x0, y0 = max(0, area.x), max(0, area.y)
+        x1, y1 = min(WIDTH, area.x + area.width), min(HEIGHT, area.y + area.height)
+        if x1 > x0 and y1 > y0:
+            if self.damage:
+                dx0, dy0, dx1, dy1 = self.damage
+                x0, y0, x1, y1 = min(x0, dx0), min(y0, dy0), max(x1, dx1), max(y1, dy1)
+            self.damage = (x0, y0, x1, y1)
+            self.wake()
+        self.damage_tracking = True
+        return False
+
+    def on_load_changed(self, webview, event):
+        if event == WebKit2.LoadEvent.FINISHED:
+            self.loaded = True
+            self.damage = (0, 0, WIDTH, HEIGHT) # First snapshot covers every tile
+
+    def on_static_load_changed(self, webview, event):
+        if event == WebKit2.LoadEvent.FINISHED:
+            self.schedule_static_raster(STATIC_RASTER_DELAY)
+
+    def schedule_static_raster(self, delay):
+        # Debounced: a config update usually touches several elements
+        if self.static_timer:
+            GLib.source_remove(self.static_timer)
+        self.static_timer = GLib.timeout_add(delay, self.raster_static)
+
+    def raster_static(self):
+        self.static_timer = None
+        surface = self.static_window.get_surface()
+        if surface is None:
+            return False
+        self.static_ctx.set_source_surface(surface, 0, 0)
+        self.static_ctx.paint()
+        self.static_surface.flush()
+        self.static_rasters += 1
+        changed = self.static_tiles.scan(self.static_surface.get_data())
+        if changed:
+            self.static_generation += 1
+            self.ring.mark_dirty(changed)
+            self.wake()
+            print(f"Static overlay layer updated ({len(changed)} tiles, generation {self.static_generation})")
+        return False
+
+    def layer_rects(self):
+        # coverage, static-only and dynamic rects for the next published slot
+        if not OVERLAY_LAYERS:
+            return self.tiles.coverage_rects, [], self.tiles.coverage_rects
+        static_only = []
+        dynamic = []
+        for row in range(self.tiles.rows):
+            for col in range(self.tiles.cols):
+                if self.tiles.visible[row][col]:
+                    dynamic.append((row, col))
+                elif self.static_tiles.visible[row][col]:
+                    static_only.append((row, col))
+        if len(static_only) + len(dynamic) == self.tiles.rows * self.tiles.cols:
+            coverage = None
+        else:
+            coverage = self.tiles.rects(static_only + dynamic)
+        return coverage, self.tiles.rects(static_only), self.tiles.rects(dynamic)
+
+    def update_surface(self):
+        # This runs in the main GTK thread
+        # Until the page has loaded keep the last published frame (matters
+        # when a restarted renderer process takes over the shared ring)
+        surface = self.window.get_surface() if self.loaded else None
+        if surface:
+            region = (0, 0, WIDTH, HEIGHT)
+            if self.damage_tracking:
+                if self.damage is None:
+                    region = None
+                else:
+                    x0, y0, x1, y1 = self.damage
+                    region = (x0, y0, x1 - x0, y1 - y0)
+                    self.damage = None
+
+            dirty = []
+            if region:
+                # Copy only the damaged area of the WebKit surface, then let
+                # the tile hashes tell which parts really changed.
+                self.snap_ctx.save()
+                self.snap_ctx.rectangle(*region)
+                self.snap_ctx.clip()
+                self.snap_ctx.set_source_surface(surface, 0, 0)
+                self.snap_ctx.paint()
+                self.snap_ctx.restore()
+                self.snap_surface.flush()
+                dirty = self.tiles.scan(self.snap_surface.get_data(), region)
+
+            if dirty:
+                self.ring.mark_dirty(dirty)
+                self.snapshots_updated += 1
+                self.active_until = time.time() + OVERLAY_IDLE_AFTER
+            else:
+                self.snapshots_static += 1
+
+            if self.ring.needs_publish:
+                self.publish_overlay()
+
+    def publish_overlay(self):
+        # Bring a free slot up to date with every tile that changed since it
+        # was last written, then hand it to the streaming thread.
+        slot = self.ring.acquire()
+        if slot is None:
+            return # Retry on the next tick, pending tiles are kept
+        if slot.pending:
+            for rect in self.tiles.rects(slot.pending):
+                slot.ctx.rectangle(*rect)
+            slot.ctx.clip()
+            if OVERLAY_LAYERS:
+                # Cached static chrome underneath, dynamic snapshot on top
+                slot.ctx.set_source_surface(self.static_surface, 0, 0)
+                slot.ctx.paint()
+                slot.ctx.set_operator(cairo.OPERATOR_OVER)
+                slot.ctx.set_source_surface(self.snap_surface, 0, 0)
+                slot.ctx.paint()
+                slot.ctx.set_operator(cairo.OPERATOR_SOURCE)
+            else:
+                slot.ctx.set_source_surface(self.snap_surface, 0, 0)
+                slot.ctx.paint()
+            slot.ctx.reset_clip()
+            slot.surface.flush()
+            slot.pending.clear()
+        slot.coverage_rects, slot.static_rects, slot.dynamic_rects = self.layer_rects()
+        slot.static_generation = self.static_generation
+        self.ring.publish(slot)
+
+    def stats(self):
+        stats = {
+            "snapshots_updated": self.snapshots_updated,
+            "snapshots_static": self.snapshots_static,
+            "overlay_fps": round(self.effective_fps(), 2)
+        }
+        if OVERLAY_LAYERS:
+            stats["static_rasters"] = self.static_rasters
+            stats["static_generation"] = self.static_generation
+        return stats
+
+class SharedOverlayLayout:
+    # Byte layout of the shared-memory overlay ring
+    def __init__(self, width, height, slots=SHARED_RING_SIZE):
+        self.width = width
+        self.height = height
+        self.stride = cairo.ImageSurface.format_stride_for_width(cairo.FORMAT_ARGB32, width)
+        self.slots = slots
+        self.slot_size = SHM_SLOT_META_SIZE + self.stride * height
+        self.size = SHM_HEADER_SIZE + self.slot_size * slots
+
+    def slot_offset(self, index):
+        return SHM_HEADER_SIZE + index * self.slot_size
+
+    def slot_surface(self, mm, index):
+        # Wraps the mapping itself: blending reads straight out of shared memory
+        start = self.slot_offset(index) + SHM_SLOT_META_SIZE
+        data = memoryview(mm)[start:start + self.stride * self.height]
+        return cairo.ImageSurface.create_for_data(data, cairo.FORMAT_ARGB32, self.width, self.height, self.stride)
+
+class SharedOverlayWriter:
+    """Renderer-process side of the shared-memory overlay ring.
+
+    Same interface as OverlayRing. The writer never touches the slot that is
+    published as `latest` or announced as `reading` by the pipeline process,
+    and reuses the least recently published of the rest.
+    """
+    def __init__(self, fd, width, height):
+        self.layout = SharedOverlayLayout(width, height)
+        self.mm = mmap.mmap(fd, self.layout.size)
+        self.slots = []
+        self.sequence = 0
+        for i in range(self.layout.slots):
+            slot = OverlaySlot(i, width, height, self.layout.slot_surface(self.mm, i))
+            # Continue the sequence of a previous renderer instance
+            slot.sequence = SHM_SLOT_META.unpack_from(self.mm, self.layout.slot_offset(i))[0]
+            self.sequence = max(self.sequence, slot.sequence)
+            self.slots.append(slot)
+        self.published = struct.unpack_from('<Q', self.mm, SHM_PUBLISHED)[0]
+        self.needs_publish = False
+        self.starved = 0
+        struct.pack_into('<I', self.mm, SHM_PID, os.getpid())
+        self.heartbeat()
+
+    def mark_dirty(self, tiles):
+        for slot in self.slots:
+            slot.pending.update(tiles)
+        self.needs_publish = True
+
+    def acquire(self):
+        latest, reading = struct.unpack_from('<ii', self.mm, SHM_LATEST)
+        candidates = [s for s in self.slots if s.index not in (latest, reading)]
+        if not candidates:
+            self.starved += 1
+            return None
+        slot = min(candidates, key=lambda s: s.sequence)
+        # Sequence 0 marks the slot as being written
+        SHM_SLOT_META.pack_into(self.mm, self.layout.slot_offset(slot.index), 0, 0, 0, 0, 0)
+        return slot
+
+    def publish(self, slot):
+        self.sequence += 1
+        slot.sequence = self.sequence
+        offset = self.layout.slot_offset(slot.index)
+        static_rects = slot.static_rects or []
+        dynamic_rects = slot.dynamic_rects or []
+        flags = SHM_FLAG_FULL_FRAME if slot.coverage_rects is None else 0
+        if len(static_rects) + len(dynamic_rects) > SHM_MAX_RECTS:
+            static_rects, dynamic_rects, flags = [], [], SHM_FLAG_FULL_FRAME
+        for i, rect in enumerate(static_rects + dynamic_rects):
+            SHM_RECT.pack_into(self.mm, offset + SHM_SLOT_META.size + i * SHM_RECT.size, *rect)
+        SHM_SLOT_META.pack_into(self.mm, offset, slot.sequence, flags,
+                                len(static_rects), len(dynamic_rects), slot.static_generation)
+        struct.pack_into('<i', self.mm, SHM_LATEST, slot.index)
+        self.published += 1
+        struct.pack_into('<Q', self.mm, SHM_PUBLISHED, self.published)
+        self.needs_publish = False
+
+    def heartbeat(self, fps=0.0):
+        struct.pack_into('<d', self.mm, SHM_HEARTBEAT, time.time())
+        struct.pack_into('<d', self.mm, SHM_FPS, fps)
+
+class SharedOverlayReader:
+    """Pipeline-process side of the shared-memory overlay ring.
+
+    latest() announces the slot it is about to blend in the header, then
+    re-checks that it is still the published one, so the renderer will not
+    reuse it. Slots are blended zero-copy out of the mapping.
+    """
+    def __init__(self, mm, layout):
+        self.mm = mm
+        self.layout = layout
+        self.slots = [OverlaySlot(i, layout.width, layout.height, layout.slot_surface(mm, i))
+                      for i in range(layout.slots)]
+        self.front = None
+        self.front_sequence = 0
+        self.dropped = 0
+        self.repeated = 0
+        self.torn = 0 # slot was rewritten while it may have been blended
+
+    def latest(self):
+        # Streaming thread
+        index = -1
+        for _ in range(3):
+            index = struct.unpack_from('<i', self.mm, SHM_LATEST)[0]
+            if index < 0:
+                return self.front
+            struct.pack_into('<i', self.mm, SHM_READING, index)
+            if struct.unpack_from('<i', self.mm, SHM_LATEST)[0] == index:
+                break
+
+        if self.front is not None:
+            front_sequence = SHM_SLOT_META.unpack_from(self.mm, self.layout.slot_offset(self.front.index))[0]
+            if front_sequence != self.front_sequence and self.front.index != index:
+                self.torn += 1
+
+        slot = self.slots[index]
+        sequence, flags, static_count, dynamic_count, static_generation = \
+            SHM_SLOT_META.unpack_from(self.mm, self.layout.slot_offset(index))
+        if sequence == 0:
+            return self.front # Renderer restarted and is rewriting it
+        if slot is self.front and sequence == self.front_sequence:
+            self.repeated += 1
+            return slot
+
+        if self.front_sequence and sequence > self.front_sequence + 1:
+            self.dropped += sequence - self.front_sequence - 1
+        if slot.sequence != sequence:
+            base = self.layout.slot_offset(index) + SHM_SLOT_META.size
+            rects = [SHM_RECT.unpack_from(self.mm, base + i * SHM_RECT.size)
+                     for i in range(static_count + dynamic_count)]
+            full_frame = flags & SHM_FLAG_FULL_FRAME
+            slot.coverage_rects = None if full_frame else rects
+            slot.static_rects = rects[:static_count]
+            if full_frame and not rects:
+                slot.dynamic_rects = None
+            else:
+                slot.dynamic_rects = rects[static_count:]
+            slot.static_generation = static_generation
+            slot.sequence = sequence
+        self.front = slot
+        self.front_sequence = sequence
+        return slot
+
+    def stats(self):
+        heartbeat = struct.unpack_from('<d', self.mm, SHM_HEARTBEAT)[0]
+        return {
+            "published": struct.unpack_from('<Q', self.mm, SHM_PUBLISHED)[0],
+            "dropped": self.dropped,
+            "repeated": self.repeated,
+            "torn": self.torn,
+            "sequence": self.front_sequence,
+            "renderer_pid": struct.unpack_from('<I', self.mm, SHM_PID)[0],
+            "overlay_fps": round(struct.unpack_from('<d', self.mm, SHM_FPS)[0], 2),
+            "renderer_age": round(time.time() - heartbeat, 2) if heartbeat else None
+        }
+
+class OverlayRendererProcess:
+    """Runs OverlayRenderer in a child process over a memfd ring.
+
+    If the renderer crashes or stalls, on_draw keeps blending the last
+    published frame while the renderer is restarted with backoff.
+    """
+    def __init__(self, width, height):
+        self.layout = SharedOverlayLayout(width, height)
+        self.fd = os.memfd_create('eko-overlay', 0)
+        os.ftruncate(self.fd, self.layout.size)
+        self.mm = mmap.mmap(self.fd, self.layout.size)
+        SHM_HEADER.pack_into(self.mm, 0, SHM_MAGIC, width, height, self.layout.stride,
+                             self.layout.slots, -1, -1, 0, 0.0, 0, 0.0)
+        self.reader = SharedOverlayReader(self.mm, self.layout)
+        self.process = None
+        self.started_at = 0
+        self.restarts = 0
+        self.backoff = 1
+        self.next_start = 0
+        self.start()
+        GLib.timeout_add_seconds(1, self.supervise)
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-u", os.path.abspath(__file__), "--overlay-renderer", str(self.fd)],
+            pass_fds=(self.fd,)
+        )
+        cpus = parse_cpus(RENDERER_CPUS)
+        if cpus:
+            os.sched_setaffinity(self.process.pid, cpus)
+        self.started_at = time.time()
+        print(f"Overlay renderer started (pid {self.process.pid})")
+
+    def supervise(self):
+        now = time.time()
+        if self.process is None:
+            if now >= self.next_start:
+                self.restarts += 1
+                self.start()
+            return True
+
+        code = self.process.poll()
+        if code is not None:
+            print(f"Overlay renderer exited ({code}), reusing last overlay frame")
+            self._schedule_restart(now)
+            return True
+
+        heartbeat = struct.unpack_from('<d', self.mm, SHM_HEARTBEAT)[0]
+        if now - max(heartbeat, self.started_at) > RENDERER_STALL_TIMEOUT:
+            print(f"Overlay renderer stalled for {now - max(heartbeat, self.started_at):.1f}s, restarting")
+            self.process.kill()
+            self.process.wait()
+            self._schedule_restart(now)
+        elif now - self.started_at > 60:
+            self.backoff = 1 # Healthy for a while, reset backoff
+        return True
+
+    def _schedule_restart(self, now):
+        self.process = None
+        self.next_start = now + self.backoff
+        self.backoff = min(self.backoff * 2, 30)
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def stats(self):
+        return dict(self.reader.stats(), renderer="process", restarts=self.restarts)
+
+def program_uri(video_path):
+    if '://' in video_path:
+        return video_path
+    # Construct path (handle relative media)
+    if not os.path.isabs(video_path):
+        video_path = os.path.abspath(video_path)
+    return f"file:///{video_path.replace(os.sep, '/')}"
+
+def program_window(data):
+    # (start, end) as unix time; the API sends naive UTC ISO timestamps
+    def parse(value):
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc).timestamp()
+    return parse(data['start_time']), parse(data['end_time'])
+
+def program_clips(data):
+    # Rundown of a program; a plain program is a single clip
+    clips = data.get('clips')
+    if isinstance(clips, str):
+        clips = json.loads(clips)
+    return clips or [data['video_path']]
+
+class SourceManager:
+    """Owns the dynamic inputs of the pipeline (program clip bins).
+
+    Every selector request pad is handed out here and released together with
+    the bin that used it. Retired bins are set to NULL, removed and then
+    watched until GObject finalizes them, so a leaked bin shows up in the
+    stats instead of as slowly growing RSS.
+    """
+    def __init__(self, pipeline, selectors):
+        self.pipeline = pipeline
+        self.selectors = selectors # elements whose pad counts are reported
+        self.lock = threading.Lock()
+        self.pads = {} # owner -> [(selector, request pad)]
+        self.pending = {} # bin name -> (retired at, weak ref), not finalized yet
+        self.reported = set()
+        self.requested = 0
+        self.released = 0
+        self.retired = 0
+        self.finalized = 0
+        self.stuck = 0 # bins that did not reach NULL
+
+    def request_pad(self, owner, selector):
+        # Streaming thread (pad-added); None once the owner is retired
+        with self.lock:
+            if owner.retired:
+                return None
+            pad = selector.get_request_pad("sink_%u")
+            if pad:
+                self.pads.setdefault(owner, []).append((selector, pad))
+                self.requested += 1
+            return pad
+
+    def retire(self, owner, bin):
+        # Main thread
+        with self.lock:
+            owner.retired = True
+            pads = self.pads.pop(owner, [])
+        bin.set_state(Gst.State.NULL)
+        if bin.get_state(0)[1] != Gst.State.NULL:
+            self.stuck += 1
+            print(f"Source {bin.get_name()} did not reach NULL")
+        for selector, pad in pads:
+            selector.release_request_pad(pad)
+            self.released += 1
+        self.pipeline.remove(bin)
+        self.retired += 1
+        self.watch(bin)
+
+    def watch(self, bin):
+        # Count a removed bin (also RTMP/recording branches) until it is freed
+        name = bin.get_name()
+        ref = bin.weak_ref(self.on_finalized, name)
+        with self.lock:
+            self.pending[name] = (time.time(), ref)
+
+    def on_finalized(self, name):
+        # Any thread, the last reference was dropped
+        with self.lock:
+            self.pending.pop(name, None)
+            self.finalized += 1
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            leaked = [name for name, (retired_at, ref) in self.pending.items() if now - retired_at > SOURCE_LEAK_AFTER]
+            stats = {
+                "sources": len(self.pads),
+                "request_pads": sum(len(pads) for pads in self.pads.values()),
+                "requested": self.requested,
+                "released": self.released,
+                "retired": self.retired,
+                "finalized": self.finalized,
+                "pending": len(self.pending),
+                "leaked": len(leaked),
+                "stuck": self.stuck,
+                "selector_pads": {element.get_name(): len(element.sinkpads) for element in self.selectors}
+            }
+        for name in leaked:
+            if name not in self.reported:
+                self.reported.add(name)
+                print(f"Source {name} still not freed {SOURCE_LEAK_AFTER}s after removal")
+        return stats
+
+class ProgramBin:
+    """One clip of a program decoded in its own bin, linked to request pads of
+    the video/audio input-selectors.
+
+    A cued (or standby) bin decodes ahead of air time and blocks on its first
+    buffer, so activate() only has to shift its timestamps to the wanted
+    running time and flip the selectors. EOS is swallowed at the bin's pads
+    and reported to the app, which switches to the next clip.
+    """
+    serial = 0
+
+    def __init__(self, app, data, index):
+        self.app = app
+        self.data = data
+        self.index = index
+        self.lock = threading.Lock()
+        self.live = False
+        self.offset = None # running time of the clip's first buffer
+        self.scheduled_at = None
+        self.links = {} # 'video'/'audio' -> (src pad, selector, selector sink pad)
+        self.probes = {} # kind -> blocking probe id
+        self.first_pts = {}
+        self.last_end = {} # kind -> end of the last buffer (stream time)
+        self.eos = set()
+        self.retired = False # set by SourceManager.retire
+
+        ProgramBin.serial += 1
+        self.bin = Gst.Bin.new(f"program_{data['id']}_{ProgramBin.serial}")
+        source = Gst.ElementFactory.make("uridecodebin")
+        source.set_property("uri", program_uri(program_clips(data)[index]))
+        source.connect("pad-added", self.on_pad_added)
+        self.bin.add(source)
+        app.pipeline.add(self.bin)
+        self.bin.set_state(Gst.State.PLAYING)
+
+    @property
+    def prerolled(self):
+        return bool(self.first_pts)
+
+    def on_pad_added(self, source, new_pad):
+        # Streaming thread. Link dynamic pads to new selector pads
+        new_pad_type = new_pad.query_caps(None).get_structure(0).get_name()
+        
+        if new_pad_type.startswith("video"):
+            # source -> videoconvert -> videoscale -> caps -> vsel
+            convert = Gst.ElementFactory.make("videoconvert")
+            scale = Gst.ElementFactory.make("videoscale")
+            capsfilter = Gst.ElementFactory.make("capsfilter")
+            capsfilter.set_property("caps", Gst.Caps.from_string(f"video/x-raw,width={WIDTH},height={HEIGHT}"))
+            elements = [convert, scale, capsfilter]
+            kind, selector = 'video', self.app.vsel
+        elif new_pad_type.startswith("audio"):
+            # source -> audioconvert -> audioresample -> asel
+            elements = [Gst.ElementFactory.make("audioconvert"), Gst.ElementFactory.make("audioresample")]
+            kind, selector = 'audio', self.app.asel
+        else:
+            return
+
+        with self.lock:
+            if kind in self.links or self.retired:
+                return # Only the first stream of each type goes on air
+            for element in elements:
+                self.bin.add(element)
+                element.sync_state_with_parent()
+            new_pad.link(elements[0].get_static_pad("sink"))
+            for upstream, downstream in zip(elements, elements[1:]):
+                upstream.link(downstream)
+
+            src_pad = elements[-1].get_static_pad("src")
+            sink_pad = self.app.sources.request_pad(self, selector)
+            if not sink_pad:
+                if not self.retired:
+                    print(f"Failed to get {kind} selector pad")
+                return
+            self.links[kind] = (src_pad, selector, sink_pad)
+            src_pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM, self.on_data, kind)
+            # Hold the first decoded buffer until activate() (or, for a bin
+            # that is already live, until its timestamps can be shifted)
+            self.probes[kind] = src_pad.add_probe(
+                Gst.PadProbeType.BLOCK | Gst.PadProbeType.BUFFER, self.on_blocked, kind)
+            # The selector is outside the bin: link through a ghost pad
+            ghost = Gst.GhostPad.new(f"{kind}_src", src_pad)
+            ghost.set_active(True)
+            self.bin.add_pad(ghost)
+            result = ghost.link(sink_pad)
+            if result != Gst.PadLinkReturn.OK:
+                print(f"Program {self.data['id']} clip {self.index}: {kind} link failed ({result.value_nick})")
+                GLib.idle_add(self.app.on_program_error, self, f"{kind} link failed")
+                return
+            if self.live:
+                self.go_live(kind)
+
+    def on_data(self, pad, info, kind):
+        # Streaming thread
+        if info.type & Gst.PadProbeType.BUFFER:
+            buf = info.get_buffer()
+            if buf.pts != Gst.CLOCK_TIME_NONE:
+                self.last_end[kind] = buf.pts + (buf.duration if buf.duration != Gst.CLOCK_TIME_NONE else 0)
+            return Gst.PadProbeReturn.OK
+
+        event = info.get_event()
+        if event.type == Gst.EventType.EOS:
+            # input-selector would pass EOS on and end the whole stream
+            with self.lock:
+                self.eos.add(kind)
+                finished = self.eos >= set(self.links)
+            if finished:
+                GLib.idle_add(self.app.on_program_eos, self)
+            return Gst.PadProbeReturn.DROP
+        return Gst.PadProbeReturn.OK
+
+    def on_blocked(self, pad, info, kind):
+        # Streaming thread, returns once the probe is removed
+        buf = info.get_buffer()
+        with self.lock:
+            if kind not in self.first_pts:
+                self.first_pts[kind] = buf.pts if buf.pts != Gst.CLOCK_TIME_NONE else 0
+                if kind == 'video':
+                    print(f"Program {self.data['id']} clip {self.index} prerolled")
+            if self.live:
+                # Activated before this stream had a buffer to block on
+                self.probes.pop(kind, None)
+                if self.offset is None:
+                    self.offset = self.app.output_running_time() - self.first_pts[kind]
+                pad.set_offset(self.offset)
+                return Gst.PadProbeReturn.REMOVE
+        return Gst.PadProbeReturn.OK
+
+    def activate(self, scheduled_at=None, running_time=None):
+        # Main thread. scheduled_at (unix time) enables the switch latency
+        # measurement, running_time places the first buffer (default: right
+        # after the last buffer out of the selectors).
+        with self.lock:
+            self.live = True
+            self.scheduled_at = scheduled_at
+            if self.first_pts:
+                if running_time is None:
+                    running_time = self.app.output_running_time()
+                self.offset = running_time - min(self.first_pts.values())
+            for kind in self.links:
+                self.go_live(kind)
+
+    def go_live(self, kind):
+        # Called with self.lock held
+        src_pad, selector, sink_pad = self.links[kind]
+        if self.offset is not None:
+            src_pad.set_offset(self.offset)
+        selector.set_property("active-pad", sink_pad)
+        if kind == 'video' and self.scheduled_at is not None:
+            src_pad.add_probe(Gst.PadProbeType.BUFFER, self.on_first_frame, None)
+        probe = self.probes.pop(kind, None)
+        if probe is not None and kind in self.first_pts:
+            src_pad.remove_probe(probe)
+        elif probe is not None:
+            # Still decoding; on_blocked releases it
+            self.probes[kind] = probe
+
+    def end_running_time(self):
+        # Running time right after the clip's last buffer
+        if self.offset is None or not self.last_end:
+            return None
+        return self.offset + max(self.last_end.values())
+
+    def on_first_frame(self, pad, info, user_data):
+        # Streaming thread: the program's first frame is on air
+        latency = (time.time() - self.scheduled_at) * 1000.0
+        self.app.record_switch(self, latency)
+        return Gst.PadProbeReturn.REMOVE
+
+    def owns(self, element):
+        bin = self.bin
+        return bin is not None and (element == bin or element.has_as_ancestor(bin))
+
+    def teardown(self):
+        # Main thread
+        if self.bin is None:
+            return
+        bin, self.bin = self.bin, None
+        self.app.sources.retire(self, bin)
+        # Pad probes and pad-added point back at this object; drop our
+        # references into the bin so the cycle can't keep it alive
+        self.links = {}
+        self.probes = {}
+
+def decode_pcm(path, timeout=60, max_bytes=None):
+    # Decode a whole audio file to PCM_CAPS bytes. Blocking, worker threads only
+    pipeline = Gst.parse_launch(
+        f'uridecodebin name=src ! audioconvert ! audioresample ! {PCM_CAPS} ! appsink name=sink sync=false')
+    pipeline.get_by_name('src').set_property('uri', program_uri(path))
+    sink = pipeline.get_by_name('sink')
+    bus = pipeline.get_bus()
+    chunks = []
+    size = 0
+    deadline = time.time() + timeout
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        while True:
+            sample = sink.emit('try-pull-sample', Gst.SECOND)
+            if sample is not None:
+                buf = sample.get_buffer()
+                chunks.append(buf.extract_dup(0, buf.get_size()))
+                size += buf.get_size()
+                if max_bytes is not None and size > max_bytes:
+                    raise RuntimeError(f"more than {max_bytes // (1024 * 1024)} MB of PCM")
+                continue
+            if sink.get_property('eos'):
+                break
+            msg = bus.pop_filtered(Gst.MessageType.ERROR)
+            if msg:
+                raise RuntimeError(msg.parse_error()[0].message)
+            if time.time() > deadline:
+                raise RuntimeError("decode timed out")
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+    return b''.join(chunks)
+
+class PcmSource:
+    # Feeds an appsrc (PCM_CAPS) with next_chunk(), or silence when it has
+    # nothing to play. Runs in the appsrc streaming thread.
+    def __init__(self, appsrc):
+        self.appsrc = appsrc
+        self.frames = 0 # pushed so far, drives the timestamps
+        self.silence = bytes(PCM_CHUNK_FRAMES * PCM_FRAME_BYTES)
+        appsrc.connect('need-data', self.on_need_data)
+
+    def next_chunk(self):
+        return None
+
+    def on_need_data(self, src, length):
+        data = self.next_chunk() or self.silence
+        frames = len(data) // PCM_FRAME_BYTES
+        buf = Gst.Buffer.new_wrapped(data)
+        buf.pts = self.frames * Gst.SECOND // PCM_RATE
+        buf.duration = frames * Gst.SECOND // PCM_RATE
+        self.frames += frames
+        src.emit('push-buffer', buf)
+
+class TTSPlayer(PcmSource):
+    """Long-lived announcement branch: appsrc ! volume ! amix.sink_1.
+
+    Clips are decoded once into an in-memory PCM cache keyed by the file's
+    SHA-1 and queued; need-data plays them back to back and fills the gaps
+    with silence, so audiomixer never waits on this pad and no pads are
+    requested or released per announcement.
+    """
+    def __init__(self, appsrc, on_start, on_idle):
+        super().__init__(appsrc)
+        self.on_start = on_start # main thread, announcement started
+        self.on_idle = on_idle # main thread, queue ran dry
+        self.cache = collections.OrderedDict() # sha1 -> PCM, LRU
+        self.cache_bytes = 0
+        self.jobs = queue.Queue() # decode requests, one worker keeps them in order
+        self.queue = collections.deque() # (pcm, requested_at, name) ready to play
+        self.current = None
+        self.position = 0
+        self.played = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.failed = 0
+        self.last_first_sample_ms = None
+        threading.Thread(target=self.worker, daemon=True).start()
+
+    def play(self, path):
+        self.jobs.put((path, time.time()))
+
+    def worker(self):
+        while True:
+            path, requested_at = self.jobs.get()
+            try:
+                with open(path, 'rb') as f:
+                    key = hashlib.sha1(f.read()).hexdigest()
+                pcm = self.cache.get(key)
+                if pcm is None:
+                    self.cache_misses += 1
+                    pcm = decode_pcm(path)
+                    self.cache[key] = pcm
+                    self.cache_bytes += len(pcm)
+                    while self.cache_bytes > TTS_CACHE_BYTES and len(self.cache) > 1:
+                        _, evicted = self.cache.popitem(last=False)
+                        self.cache_bytes -= len(evicted)
+                else:
+                    self.cache_hits += 1
+                    self.cache.move_to_end(key)
+                self.queue.append((pcm, requested_at, os.path.basename(path)))
+            except Exception as e:
+                self.failed += 1
+                print(f"TTS decode failed for {path}: {e}")
+
+    def next_chunk(self):
+        # Streaming thread
+        if self.current is None and self.queue:
+            pcm, requested_at, name = self.queue.popleft()
+            self.current = pcm
+            self.position = 0
+            self.played += 1
+            self.last_first_sample_ms = round((time.time() - requested_at) * 1000.0, 1)
+            GLib.idle_add(self.on_start, name)
+
+        if self.current is None:
+            return None
+        end = self.position + len(self.silence)
+        data = self.current[self.position:end]
+        self.position = end
+        if self.position >= len(self.current):
+            self.current = None
+            if not self.queue:
+                GLib.idle_add(self.on_idle)
+        return data
+
+    def stats(self):
+        return {
+            "playing": self.current is not None,
+            "queued": len(self.queue) + self.jobs.qsize(),
+            "played": self.played,
+            "failed": self.failed,
+            "cache_clips": len(self.cache),
+            "cache_bytes": self.cache_bytes,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "last_first_sample_ms": self.last_first_sample_ms
+        }
+
+class MusicBed(PcmSource):
+    """Background music: appsrc ! volume ! amix.sink_0.
+
+    Every track of the playlist is decoded once and looped from memory, track
+    after track, without a decoder restart at the loop point. A new playlist
+    is decoded in the background and swapped in at a buffer boundary.
+    """
+    def __init__(self, appsrc):
+        super().__init__(appsrc)
+        self.decoded = {} # path -> PCM of the current playlist
+        self.tracks = [] # (name, PCM) playing
+        self.pending = None # decoded playlist waiting to be swapped in
+        self.playlist = []
+        self.track = 0
+        self.position = 0
+        self.loops = 0
+        self.jobs = queue.Queue()
+        threading.Thread(target=self.worker, daemon=True).start()
+
+    def set_playlist(self, paths):
+        self.jobs.put(list(paths))
+
+    def worker(self):
+        while True:
+            paths = self.jobs.get()
+            if paths == self.playlist:
+                continue # Re-sent on failover, keep playing where we are
+            decoded = {}
+            tracks = []
+            for path in paths:
+                pcm = decoded.get(path)
+                budget = MUSIC_CACHE_BYTES - sum(len(d) for d in decoded.values())
+                if pcm is None:
+                    pcm = self.decoded.get(path)
+                    if pcm is not None and len(pcm) > budget:
+                        print(f"Music bed: {path} skipped, MUSIC_CACHE_MB is used up")
+                        continue
+                if pcm is None:
+                    try:
+                        started = time.time()
+                        pcm = decode_pcm(path, timeout=300, max_bytes=budget)
+                        print(f"Music bed decoded: {path} ({len(pcm) // PCM_FRAME_BYTES / PCM_RATE:.0f}s in {time.time() - started:.1f}s)")
+                    except Exception as e:
+                        print(f"Music bed decode failed for {path}: {e}")
+                        continue
+                if pcm:
+                    decoded[path] = pcm
+                    tracks.append((os.path.basename(path), pcm))
+            # Only keep what the new playlist uses
+            self.decoded = decoded
+            self.playlist = paths
+            self.pending = tracks
+
+    def next_chunk(self):
+        # Streaming thread
+        if self.pending is not None:
+            self.tracks, self.pending = self.pending, None
+            self.track = 0
+            self.position = 0
+        if not self.tracks:
+            return None
+
+        need = len(self.silence)
+        pieces = []
+        while need > 0:
+            pcm = self.tracks[self.track][1]
+            piece = pcm[self.position:self.position + need]
+            pieces.append(piece)
+            need -= len(piece)
+            self.position += len(piece)
+            if self.position >= len(pcm):
+                # Seamless: the next track (or the loop) continues this buffer
+                self.position = 0
+                self.track = (self.track + 1) % len(self.tracks)
+                if self.track == 0:
+                    self.loops += 1
+        return b''.join(pieces)
+
+    def stats(self):
+        tracks = self.tracks
+        return {
+            "playlist": self.playlist,
+            "track": tracks[self.track % len(tracks)][0] if tracks else None,
+            "position": round(self.position / PCM_FRAME_BYTES / PCM_RATE, 1),
+            "loops": self.loops,
+            "decoded_bytes": sum(len(pcm) for pcm in self.decoded.values())
+        }
+
+def masked_location(location):
+    # Stream keys are the last path element of an RTMP URL
+    base, _, key = location.rpartition('/')
+    return f"{base}/***" if base and key and '://' in base else location
+
+class RtmpOutput:
+    """One RTMP destination hanging off a flvmux tee.
+
+    The branch is `queue leaky=downstream ! rtmpsink` in its own bin, so a slow
+    ingest only drops its own data. When the sink errors or stops taking data
+    the bin is dropped from the running pipeline and re-added after an
+    exponential backoff while the other outputs keep streaming.
+    """
+    serial = 0
+
+    def __init__(self, app, name, tee, location):
+        self.app = app
+        self.name = name
+        self.tee = tee
+        self.location = location
+        self.bin = None
+        self.tee_pad = None
+        self.queue = None
+        self.state = "idle" # connecting, live, backoff
+        self.failed = False # set from the streaming thread, the tee pad drops until detach
+        self.wait_keyframe = False
+        self.backoff = OUTPUT_BACKOFF_MIN
+        self.retry_timer = None
+        self.connects = 0
+        self.failures = 0
+        self.last_error = None
+        self.live_since = None
+        self.last_fed = 0 # tee handed us a buffer
+        self.last_progress = 0 # rtmpsink took a buffer
+        self.bytes = 0
+        self.sampled_bytes = 0
+        self.sink_buffers = 0
+        self.queue_drops = 0
+        self.late = 0
+        self.max_lateness_ms = 0.0
+        self.segment = None
+
+    def attach(self):
+        self.retry_timer = None
+        RtmpOutput.serial += 1
+        self.bin = Gst.parse_bin_from_description(
+            f'queue name=queue leaky=downstream max-size-buffers=0 max-size-bytes=0 '
+            f'max-size-time={OUTPUT_QUEUE_MS * Gst.MSECOND} ! '
+            f'rtmpsink name=sink location="{self.location}" async=false', True)
+        self.bin.set_name(f"out_{self.name}_{RtmpOutput.serial}")
+        self.queue = self.bin.get_by_name("queue")
+        self.queue.connect("overrun", self.on_queue_overrun)
+        self.bin.get_by_name("sink").get_static_pad("sink").add_probe(
+            Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM, self.on_sink_data, None)
+
+        # A reconnect joins mid-GOP: hold back data until the next keyframe
+        self.wait_keyframe = self.connects > 0
+        self.failed = False
+        self.segment = None
+        self.sink_buffers = 0
+        self.last_fed = self.last_progress = time.time()
+
+        self.app.pipeline.add(self.bin)
+        self.tee_pad = self.tee.get_request_pad("src_%u")
+        self.tee_pad.add_probe(Gst.PadProbeType.BUFFER, self.on_tee_data, None)
+        self.tee_pad.link(self.bin.get_static_pad("sink"))
+        self.bin.sync_state_with_parent()
+
+        self.state = "connecting"
+        self.connects += 1
+        if self.wait_keyframe:
+            self.tee_pad.send_event(GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0))
+        print(f"Output {self.name}: connecting to {masked_location(self.location)}")
+        return False
+
+    def detach(self):
+        self.failed = True
+        bin, tee_pad = self.bin, self.tee_pad
+        self.bin = self.tee_pad = self.queue = None
+        tee_pad.unlink(bin.get_static_pad("sink"))
+        self.tee.release_request_pad(tee_pad)
+        # A sink stuck in a network write can take a while to shut down
+        threading.Thread(target=self.dispose, args=(bin,), daemon=True).start()
+
+    def dispose(self, bin):
+        bin.set_state(Gst.State.NULL)
+        self.app.pipeline.remove(bin)
+        self.app.sources.watch(bin)
+
+    def owns(self, element):
+        bin = self.bin # also called from streaming threads
+        return bin is not None and (element == bin or element.has_as_ancestor(bin))
+
+    def on_error(self, reason):
+        if self.bin is None:
+            return # Already waiting for the retry
+        self.failures += 1
+        self.last_error = reason
+        self.live_since = None
+        self.detach()
+        self.state = "backoff"
+        print(f"Output {self.name} failed ({reason}), reconnecting in {self.backoff}s")
+        self.retry_timer = GLib.timeout_add(int(self.backoff * 1000), self.attach)
+        self.backoff = min(self.backoff * 2, OUTPUT_BACKOFF_MAX)
+
+    def check(self):
+        # Runs on the GLib loop every few seconds
+        if self.bin is None:
+            return
+        now = time.time()
+        if self.last_fed - self.last_progress > OUTPUT_STALL_TIMEOUT:
+            self.on_error(f"no data accepted for {int(now - self.last_progress)}s")
+        elif self.live_since and now - self.live_since > OUTPUT_STABLE_AFTER:
+            self.backoff = OUTPUT_BACKOFF_MIN
+
+    def on_tee_data(self, pad, info, user_data):
+        if self.failed:
+            return Gst.PadProbeReturn.DROP
+        self.last_fed = time.time()
+        if self.wait_keyframe:
+            if info.get_buffer().has_flags(Gst.BufferFlags.DELTA_UNIT):
+                return Gst.PadProbeReturn.DROP
+            self.wait_keyframe = False
+        return Gst.PadProbeReturn.OK
+
+    def on_sink_data(self, pad, info, user_data):
+        if info.type & Gst.PadProbeType.EVENT_DOWNSTREAM:
+            event = info.get_event()
+            if event.type == Gst.EventType.SEGMENT:
+                self.segment = event.parse_segment()
+            return Gst.PadProbeReturn.OK
+
+        buf = info.get_buffer()
+        now = time.time()
+        self.last_progress = now
+        self.bytes += buf.get_size()
+        self.sink_buffers += 1
+        if self.sink_buffers == 2 and self.state == "connecting":
+            # rtmpsink connects on its first render, taking a second buffer means it worked
+            self.state = "live"
+            self.live_since = now
+            GLib.idle_add(print, f"Output {self.name}: live")
+
+        # Late: the buffer reaches the network sink after its running time
+        clock = self.app.pipeline.get_clock()
+        if self.segment and clock and buf.pts != Gst.CLOCK_TIME_NONE:
+            buffer_time = self.segment.to_running_time(Gst.Format.TIME, buf.pts)
+            lateness = clock.get_time() - self.app.pipeline.get_base_time() - buffer_time
+            if lateness > 0:
+                self.late += 1
+                self.max_lateness_ms = max(self.max_lateness_ms, lateness / Gst.MSECOND)
+        return Gst.PadProbeReturn.OK
+
+    def on_queue_overrun(self, queue_element):
+        # Leaky queue full, the oldest data is being dropped
+        self.queue_drops += 1
+
+    def sample(self, dt):
+        sent = self.bytes - self.sampled_bytes
+        self.sampled_bytes = self.bytes
+        stats = {
+            "location": masked_location(self.location),
+            "state": self.state,
+            "bytes": self.bytes,
+            "kbps": round(sent * 8 / dt / 1000, 1),
+            "uptime": round(time.time() - self.live_since) if self.live_since else 0,
+            "connects": self.connects,
+            "reconnects": max(self.connects - 1, 0),
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "queue_ms": round(self.queue.get_property("current-level-time") / Gst.MSECOND, 1) if self.queue else 0,
+            "queue_drops": self.queue_drops,
+            "late": self.late,
+            "max_lateness_ms": round(self.max_lateness_ms, 1)
+        }
+        self.max_lateness_ms = 0.0
+        return stats
+
+class Recorder:
+    """On-air recording: the encoded H.264/AAC remuxed into MPEG-TS segments.
+
+    Hangs off tees after x264enc and voaacenc, so it adds no encode CPU.
+    Leaky queues keep a slow disk from stalling the outputs, and the oldest
+    segments are deleted once RECORDING_MAX_MB is exceeded.
+    """
+    def __init__(self, app, video_tee, audio_tee):
+        self.app = app
+        self.video_tee = video_tee
+        self.audio_tee = audio_tee
+        self.bin = None
+        self.tee_pads = []
+        self.failed = False # set from the streaming thread on a write error
+        self.retry_timer = None
+        self.segments = 0
+        self.current = None
+        self.deleted = 0
+        self.disk_bytes = 0
+        self.last_error = None
+
+    def attach(self):
+        self.retry_timer = None
+        os.makedirs(RECORDINGS_DIR, exist_ok=True)
+        queue_opts = f'leaky=downstream max-size-buffers=0 max-size-bytes=0 max-size-time={5 * Gst.SECOND}'
+        self.bin = Gst.parse_bin_from_description(
+            f'queue name=vq {queue_opts} ! h264parse ! '
+            f'splitmuxsink name=rec muxer-factory=mpegtsmux max-size-time={RECORDING_SEGMENT * Gst.SECOND} '
+            f'queue name=aq {queue_opts} ! aacparse ! rec.audio_%u', False)
+        self.bin.add_pad(Gst.GhostPad.new("video", self.bin.get_by_name("vq").get_static_pad("sink")))
+        self.bin.add_pad(Gst.GhostPad.new("audio", self.bin.get_by_name("aq").get_static_pad("sink")))
+        self.bin.get_by_name("rec").connect("format-location", self.on_format_location)
+        self.failed = False
+
+        self.app.pipeline.add(self.bin)
+        for tee, name in ((self.video_tee, "video"), (self.audio_tee, "audio")):
+            tee_pad = tee.get_request_pad("src_%u")
+            tee_pad.add_probe(Gst.PadProbeType.BUFFER, self.on_tee_data, None)
+            tee_pad.link(self.bin.get_static_pad(name))
+            self.tee_pads.append((tee, tee_pad))
+        self.bin.sync_state_with_parent()
+        # Start the first segment on a keyframe
+        self.tee_pads[0][1].send_event(GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0))
+        print(f"Recording to {RECORDINGS_DIR} in {RECORDING_SEGMENT}s segments (max {RECORDING_MAX_MB} MB)")
+        return False
+
+    def detach(self):
+        self.failed = True
+        bin = self.bin
+        self.bin = None
+        for tee, tee_pad in self.tee_pads:
+            tee_pad.unlink(tee_pad.get_peer())
+            tee.release_request_pad(tee_pad)
+        self.tee_pads = []
+        threading.Thread(target=self.dispose, args=(bin,), daemon=True).start()
+
+    def dispose(self, bin):
+        # TS segments need no finalizing, the one being written stays playable
+        bin.set_state(Gst.State.NULL)
+        self.app.pipeline.remove(bin)
+        self.app.sources.watch(bin)
+
+    def owns(self, element):
+        bin = self.bin # also called from streaming threads
+        return bin is not None and (element == bin or element.has_as_ancestor(bin))
+
+    def on_error(self, reason):
+        if self.bin is None:
+            return
+        self.last_error = reason
+        self.current = None
+        self.detach()
+        print(f"Recording stopped ({reason}), retrying in {RECORDING_RETRY}s")
+        self.retry_timer = GLib.timeout_add_seconds(RECORDING_RETRY, self.attach)
+
+    def on_tee_data(self, pad, info, user_data):
+        return Gst.PadProbeReturn.DROP if self.failed else Gst.PadProbeReturn.OK
+
+    def on_format_location(self, splitmux, fragment_id):
+        # Streaming thread; the name carries the segment's UTC start time
+        name = time.strftime("rec_%Y%m%d-%H%M%S", time.gmtime())
+        path = os.path.join(RECORDINGS_DIR, f"{name}.ts")
+        if os.path.exists(path):
+            path = os.path.join(RECORDINGS_DIR, f"{name}_{fragment_id}.ts")
+        self.current = os.path.basename(path)
+        self.segments += 1
+        self.app.run_in_worker(self.prune)
+        return path
+
+    def prune(self):
+        # Worker thread
+        segments = sorted(f for f in os.listdir(RECORDINGS_DIR) if f.startswith("rec_") and f.endswith(".ts"))
+        sizes = {}
+        for name in segments:
+            try:
+                sizes[name] = os.path.getsize(os.path.join(RECORDINGS_DIR, name))
+            except OSError:
+                pass
+        total = sum(sizes.values())
+        # Oldest first, never the segment being written
+        for name in segments[:-1]:
+            if total <= RECORDING_MAX_MB * 1024 * 1024:
+                break
+            try:
+                os.remove(os.path.join(RECORDINGS_DIR, name))
+                total -= sizes.get(name, 0)
+                self.deleted += 1
+            except OSError as e:
+                print(f"Recording retention: could not delete {name}: {e}")
+        self.disk_bytes = total
+
+    def stats(self):
+        return {
+            "recording": self.bin is not None,
+            "current": self.current,
+            "segments": self.segments,
+            "deleted": self.deleted,
+            "disk_mb": round(self.disk_bytes / (1024 * 1024), 1),
+            "last_error": self.last_error
+        }
+
+def pipeline_elements(pipeline):
+    elements = []
+    it = pipeline.iterate_recurse()
+    while True:
+        result, element = it.next()
+        if result == Gst.IteratorResult.RESYNC:
+            it.resync()
+            elements = []
+        elif result == Gst.IteratorResult.OK:
+            elements.append(element)
+        else:
+            return elements
+
+class PipelineTelemetry:
+    """Pad-probe metrics for the stream pipeline, reported in [STATS].
+
+    Counters are bumped from the streaming threads and turned into rates on
+    the GLib loop by sample(): composited and encoded fps, x264 encode time
+    per frame, queue fill levels, leaky queue drops and QoS drops. Each
+    RtmpOutput counts its own bytes, late buffers and reconnects.
+    """
+    def __init__(self, pipeline, overlay, venc, outputs):
+        self.pipeline = pipeline
+        self.outputs = outputs
+        self.composited = 0
+        self.encoded = 0
+        self.encode_started = {} # pts -> time the frame entered x264enc
+        self.encode_time = 0.0
+        self.encode_max = 0.0
+        self.queues = []
+        self.queue_drops = {}
+        self.qos_dropped = {} # element name -> dropped (from QoS messages)
+        self.last = {"time": time.time(), "composited": 0, "encoded": 0, "encode_time": 0.0}
+
+        overlay.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.on_composited, None)
+        venc.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self.on_encode_in, None)
+        venc.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.on_encode_out, None)
+
+        for element in pipeline_elements(pipeline):
+            factory = element.get_factory().get_name() if element.get_factory() else ""
+            if factory == "queue":
+                self.queues.append(element)
+                self.queue_drops[element.get_name()] = 0
+                element.connect("overrun", self.on_queue_overrun)
+
+    def on_composited(self, pad, info, user_data):
+        self.composited += 1
+        return Gst.PadProbeReturn.OK
+
+    def on_encode_in(self, pad, info, user_data):
+        if len(self.encode_started) > 256:
+            self.encode_started.clear() # x264 lost track of some pts, start over
+        self.encode_started[info.get_buffer().pts] = time.perf_counter()
+        return Gst.PadProbeReturn.OK
+
+    def on_encode_out(self, pad, info, user_data):
+        self.encoded += 1
+        started = self.encode_started.pop(info.get_buffer().pts, None)
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            self.encode_time += elapsed
+            self.encode_max = max(self.encode_max, elapsed)
+        return Gst.PadProbeReturn.OK
+
+    def on_queue_overrun(self, queue_element):
+        # Full queue; for the leaky ones this means a buffer was dropped
+        self.queue_drops[queue_element.get_name()] += 1
+
+    def on_qos(self, message):
+        fmt, processed, dropped = message.parse_qos_stats()
+        if dropped != Gst.CLOCK_TIME_NONE and dropped >= 0:
+            self.qos_dropped[message.src.get_name()] = dropped
+
+    def sample(self):
+        now = time.time()
+        dt = max(now - self.last["time"], 0.001)
+        encoded = self.encoded - self.last["encoded"]
+        encode_time = self.encode_time - self.last["encode_time"]
+        stats = {
+            "composited_fps": round((self.composited - self.last["composited"]) / dt, 2),
+            "output_fps": round(encoded / dt, 2),
+            "encode_ms": round(encode_time * 1000 / encoded, 2) if encoded else None,
+            "encode_max_ms": round(self.encode_max * 1000, 2),
+            "queues": {
+                q.get_name(): {
+                    "buffers": q.get_property("current-level-buffers"),
+                    "max_buffers": q.get_property("max-size-buffers"),
+                    "time_ms": round(q.get_property("current-level-time") / Gst.MSECOND, 1),
+                    "leaky": q.get_property("leaky") != 0,
+                    "drops": self.queue_drops[q.get_name()]
+                } for q in self.queues
+            },
+            "outputs": {output.name: output.sample(dt) for output in self.outputs},
+            "qos_dropped": dict(self.qos_dropped)
+        }
+        self.encode_max = 0.0
+        self.last = {"time": now, "composited": self.composited, "encoded": self.encoded,
+                     "encode_time": self.encode_time}
+        return stats
+
+class LoopLagMonitor:
+    """Measures how late GLib main-loop callbacks run.
+
+    A timer asks to fire every LOOP_LAG_INTERVAL ms; anything beyond that is
+    time some other callback held the loop (and delayed overlay snapshots).
+    """
+    def __init__(self):
+        self.expected = time.monotonic() + LOOP_LAG_INTERVAL / 1000
+        self.last_tick = time.monotonic()
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.ticks = 0
+        self.stalls = 0
+        GLib.timeout_add(LOOP_LAG_INTERVAL, self.on_tick)
+
+    def on_tick(self):
+        now = time.monotonic()
+        lag = max(now - self.expected, 0.0)
+        self.expected = now + LOOP_LAG_INTERVAL / 1000
+        self.last_tick = now
+        self.ticks += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+        if lag * 1000 > LOOP_STALL_MS:
+            self.stalls += 1
+            print(f"Main loop stalled for {lag * 1000:.0f} ms")
+        return True
+
+    def sample(self):
+        stats = {
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "avg_lag_ms": round(self.total_lag * 1000 / self.ticks, 2) if self.ticks else 0,
+            "stalls": self.stalls
+        }
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.ticks = 0
+        return stats
+
+class StreamOverlayApp:
+    def __init__(self):
+        self.mainloop = GLib.MainLoop()
         
-        self.window.show_all()
+        # --- Program Schedule State ---
+        self.current_program_id = None
+        self.program = None # ProgramBin (clip) on air
+        self.standby = None # Next clip of the same program, decoding
+        self.cued = None # ProgramBin prerolling for the next slot
+        self.clip_transitions = 0
+        self.schedule = [] # Upcoming programs pushed by the server
+        self.program_timer = None
+        self.program_switches = 0
+        self.last_switch_latency_ms = None
+        self.api_base = "http://127.0.0.1:8123/api"
+        self.schedule_fetching = False
+
+        # Blocking work (HTTP, file I/O, parsing) runs here, see run_in_worker
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+        self.loop_lag = LoopLagMonitor()
+
+        # Program files are checked as soon as they are scheduled
+        self.program_checks = {} # uri -> result
+        self.discoverer = GstPbutils.Discoverer.new(10 * Gst.SECOND)
+        self.discoverer.connect('discovered', self.on_discovered)
+        self.discoverer.start()
         
-        # Start a timer to snapshot the webview
-        GLib.timeout_add(1000 // FRAMERATE, self.update_surface)
+        # --- Overlay Renderer ---
+        # on_draw only ever reads the newest complete slot of self.ring, which
+        # is either filled in-process or by the renderer child process.
+        self.renderer = None
+        self.renderer_process = None
+        if OVERLAY_RENDERER == 'process':
+            self.renderer_process = OverlayRendererProcess(WIDTH, HEIGHT)
+            self.ring = self.renderer_process.reader
+        else:
+            self.ring = OverlayRing(WIDTH, HEIGHT)
+            self.renderer = OverlayRenderer(self.ring)
+
+        # Pin the pipeline (encoder) threads away from the renderer
+        encoder_cpus = parse_cpus(ENCODER_CPUS)
+        if encoder_cpus:
+            os.sched_setaffinity(0, encoder_cpus)
+
+        # overlaycomposition mode: composition cached per published slot
+        self.composition = None
+        self.composition_sequence = -1
+        # Static-only rectangles survive dynamic updates (OVERLAY_LAYERS=1)
+        self.static_rectangles = []
+        self.static_rectangles_key = None
+
+        # Heartbeat + stats for StreamManager
+        GLib.timeout_add_seconds(5, self.report_heartbeat)
+        self.progress_fd = int(HEARTBEAT_FD) if HEARTBEAT_FD else None
         
-        # Start Schedule Poller
-        GLib.timeout_add_seconds(5, self.check_schedule)
+        # Start Schedule Poller (only when run by hand, StreamManager pushes
+        # program switches over the control channel)
+        if not os.environ.get('CONTROL_FD'):
+            GLib.timeout_add_seconds(5, self.check_schedule)
 
         # --- GStreamer Pipeline ---
         # We use input-selectors to switch between Default (Pad 0) and Program (Pad 1)
         
         BACKUP_RTMP_URL = os.environ.get('BACKUP_RTMP_URL')
         
-        sink_pipeline = ""
-        if BACKUP_RTMP_URL:
-            # print(f"Configuring Dual Stream: Primary + Backup")
-            sink_pipeline = (
-                f'flvmux name=mux streamable=true ! tee name=t '
-                f't. ! queue ! rtmpsink location="{RTMP_URL}" '
-                f't. ! queue ! rtmpsink location="{BACKUP_RTMP_URL}" '
-            )
-        else:
-            sink_pipeline = (
-                f'flvmux name=mux streamable=true ! rtmpsink location="{RTMP_URL}" '
-            )
+        # The RTMP branches are added by RtmpOutput once the pipeline is built,
+        # each tee keeps going with any of them detached
+        sink_pipeline = 'flvmux name=mux streamable=true ! tee name=t allow-not-linked=true '
 
         # --- VIDEO BRANCH ---
         # Selector 0: Default Black
         # Selector 1: Program Video (Dynamic)
+        if OVERLAY_MODE == 'composition':
+            overlay_stage = 'videoconvert ! video/x-raw,format=I420 ! overlaycomposition name=overlay ! '
+        else:
+            overlay_stage = 'videoconvert ! cairooverlay name=overlay ! videoconvert ! '
+        print(f"Overlay compositing mode: {OVERLAY_MODE}")
+
+        # --- RENDITION LADDER ---
+        # Composite once, then tee the raw video into one scaled encoder per
+        # rendition. Audio is encoded once and tee'd into every flvmux.
+        # Rendition queues are leaky so a slow branch drops its own frames
+        # instead of stalling the main output; vtee itself is paced by the
+        # main branch (see PACING below).
+        video_tee = 'tee name=vtee vtee. ! ' if RENDITIONS or PREVIEW_INTERVAL else ''
+        # Encoded audio is shared by the rendition muxers and the recorder
+        audio_tee = 'tee name=atee atee. ! queue ! ' if RENDITIONS or RECORDING else ''
+        rendition_pipeline = ''
+        if RENDITIONS:
+            for i, r in enumerate(RENDITIONS):
+                rendition_pipeline += (
+                    f'vtee. ! queue leaky=downstream max-size-buffers=5 ! videoscale ! '
+                    f'video/x-raw,width={r["width"]},height={r["height"]} ! '
+                    f'x264enc name=venc_r{i} bitrate={r["video_bitrate"]} tune=zerolatency speed-preset={X264_PRESET} '
+                    f'key-int-max={KEYFRAME_INTERVAL} threads={r.get("threads", X264_THREADS)} ! queue ! '
+                    f'flvmux name=mux_r{i} streamable=true ! tee name=t_r{i} allow-not-linked=true '
+                    f'atee. ! queue ! mux_r{i}. '
+                )
+                print(f"Rendition {r.get('name', i)}: {r['width']}x{r['height']} @ {r['video_bitrate']} kbit/s")
+
+        # --- ADMIN PREVIEW ---
+        # Frames are thinned to the preview rate before scaling, so the cost
+        # is one small JPEG per interval however many operators are watching
+        preview_pipeline = ''
+        if PREVIEW_INTERVAL:
+            preview_height = PREVIEW_WIDTH * HEIGHT // WIDTH // 2 * 2
+            preview_pipeline = (
+                f'vtee. ! queue leaky=downstream max-size-buffers=1 ! videorate drop-only=true ! '
+                f'video/x-raw,framerate=1000/{int(PREVIEW_INTERVAL * 1000)} ! videoscale ! '
+                f'video/x-raw,width={PREVIEW_WIDTH},height={preview_height} ! jpegenc quality=70 ! '
+                f'appsink name=preview emit-signals=true sync=false async=false max-buffers=1 drop=true '
+            )
+
+        # --- PACING ---
+        # No source is live and every RTMP branch sits behind a leaky queue,
+        # so clocksync is what holds the pipeline to real time: encoded
+        # buffers wait for their running time before reaching the muxers and
+        # tees, and the blocked branch throttles the encoders, compositor,
+        # program decoders and appsrcs upstream. Placed after the encoders so
+        # a parked standby still negotiates and encodes its first frame.
         video_pipeline = (
             f'input-selector name=vsel ! '
-            f'videoconvert ! cairooverlay name=overlay ! videoconvert ! queue ! '
-            f'x264enc bitrate=2500 tune=zerolatency speed-preset=ultrafast key-int-max=40 threads=3 ! queue ! mux. '
+            f'{overlay_stage}{video_tee}queue ! '
+            f'x264enc name=venc bitrate={VIDEO_BITRATE} tune=zerolatency speed-preset={X264_PRESET} '
+            f'key-int-max={KEYFRAME_INTERVAL} threads={X264_THREADS} ! clocksync name=vclock ! '
+            f'{"tee name=vrec allow-not-linked=true ! " if RECORDING else ""}queue ! mux. '
             
             # Default Source (Pad 0) connected to vsel
             f'videotestsrc pattern=black ! video/x-raw,width={WIDTH},height={HEIGHT},framerate={FRAMERATE}/1 ! '
@@ -117,32 +1987,25 @@ class StreamOverlayApp:
         # Audio Mixer Construction
         # Pad 0: Music (Background)
         # Pad 1: TTS (Announcement)
-        audio_mix_pipeline = (
-            f'audiomixer name=amix ! '
-            f'voaacenc bitrate=128000 ! mux. '
-        )
         
-        # Music Source (Pad 0 of Mixer)
+        # Music Source (Pad 0 of Mixer): MusicBed loops the decoded playlist
+        # from memory (silence until the first track is decoded)
         music_file = "news-music-2025-335894.mp3"
-        if os.path.exists(music_file):
-            # print(f"Found background music: {music_file}")
-            audio_source = (
-                f'multifilesrc location="{music_file}" loop=true ! '
-                'decodebin ! audioconvert ! audioresample ! audio/x-raw,rate=44100,channels=2 ! '
-                'volume name=vol_music volume=1.0 ! amix.sink_0 '
-            )
-        else:
-            audio_source = (
-                'audiotestsrc wave=silence ! audio/x-raw,rate=44100,channels=2 ! '
-                'volume name=vol_music volume=1.0 ! amix.sink_0 '
-            )
+        music_playlist = MUSIC_PLAYLIST if MUSIC_PLAYLIST is not None else \
+            ([music_file] if os.path.exists(music_file) else [])
+        music_source = (
+            f'appsrc name=music_src format=time stream-type=stream block=false '
+            f'max-bytes={4 * PCM_CHUNK_FRAMES * PCM_FRAME_BYTES} caps="{PCM_CAPS}" ! '
+            'volume name=vol_music volume=1.0 ! amix.sink_0 '
+        )
             
-        # TTS Source (Pad 1 of Mixer) - Initially silence/waiting
-        # We don't keep a live source open, we just want the pad ready?
-        # Typically we dynamically link/unlink or use a latch.
-        # Simplest: Input-selector for the Whole Audio Branch? 
-        # No, we want mixing.
-        # So we leave amix.sink_1 open (or request it dynamically).
+        # TTS Source (Pad 1 of Mixer): one long-lived appsrc fed by TTSPlayer,
+        # silence between announcements
+        tts_source = (
+            f'appsrc name=tts_src format=time stream-type=stream block=false '
+            f'max-bytes={4 * PCM_CHUNK_FRAMES * PCM_FRAME_BYTES} caps="{PCM_CAPS}" ! '
+            'volume volume=1.5 ! amix.sink_1 ' # Boost TTS slightly
+        )
         
         # Let's wrap the mix in an input-selector branch so we can switch to Program Audio totally.
         # Selector 0: The Mixer (Music + TTS)
@@ -150,367 +2013,680 @@ class StreamOverlayApp:
         
         audio_pipeline = (
             f'input-selector name=asel ! '
-            f'voaacenc bitrate=128000 ! mux. '
+            f'voaacenc bitrate={AUDIO_BITRATE} ! clocksync name=aclock ! {audio_tee}mux. '
             
             # Branch 0: Mixer
             f'audiomixer name=amix ! asel.sink_0 '
         )
-        
-        # Determine Music Source string again for clarity
-        if os.path.exists(music_file):
-             audio_source_0 = (
-                f'multifilesrc location="{music_file}" loop=true ! '
-                'decodebin ! audioconvert ! audioresample ! audio/x-raw,rate=44100,channels=2 ! '
-                'volume name=vol_music volume=1.0 ! amix.sink_0 '
-            )
-        else:
-            audio_source_0 = (
-                'audiotestsrc wave=silence ! audio/x-raw,rate=44100,channels=2 ! '
-                'volume name=vol_music volume=1.0 ! amix.sink_0 '
-            )
 
-        pipeline_str = sink_pipeline + video_pipeline + audio_pipeline + audio_source_0
+        pipeline_str = sink_pipeline + video_pipeline + audio_pipeline + music_source + tts_source + rendition_pipeline + preview_pipeline
         
         print(f"Starting pipeline...")
         self.pipeline = Gst.parse_launch(pipeline_str)
         
         self.vsel = self.pipeline.get_by_name('vsel')
         self.asel = self.pipeline.get_by_name('asel')
+        # Running time at the end of the last buffer out of each selector:
+        # the next clip is placed after what was actually switched, not after
+        # the clock, which runs behind whatever is queued downstream
+        self.selector_segments = {}
+        self.selector_out = {}
+        for kind, selector in (('video', self.vsel), ('audio', self.asel)):
+            selector.get_static_pad('src').add_probe(
+                Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM, self.on_selector_data, kind)
         self.amix = self.pipeline.get_by_name('amix')
         self.vol_music = self.pipeline.get_by_name('vol_music')
+        self.music_volume = 1.0 # Set over the control channel, restored after TTS
+        self.music = MusicBed(self.pipeline.get_by_name('music_src'))
+        self.music.set_playlist(music_playlist)
+        self.tts = TTSPlayer(self.pipeline.get_by_name('tts_src'), self.on_tts_start, self.restore_music_volume)
+        self.venc = self.pipeline.get_by_name('venc')
+        self.sources = SourceManager(self.pipeline, (self.vsel, self.asel, self.amix))
         
         self.overlay = self.pipeline.get_by_name('overlay')
-        self.overlay.connect('draw', self.on_draw)
+        if OVERLAY_MODE == 'composition':
+            self.overlay.connect('draw', self.on_composition_draw)
+        else:
+            self.overlay.connect('draw', self.on_draw)
         
+        # --- RTMP Outputs ---
+        self.outputs = [RtmpOutput(self, "primary", self.pipeline.get_by_name('t'), RTMP_URL)]
+        if BACKUP_RTMP_URL:
+            self.outputs.append(RtmpOutput(self, "backup", self.pipeline.get_by_name('t'), BACKUP_RTMP_URL))
+        for i, r in enumerate(RENDITIONS):
+            self.outputs.append(RtmpOutput(self, r.get("name", f"r{i}"), self.pipeline.get_by_name(f't_r{i}'), r["rtmp_url"]))
+
+        self.recorder = Recorder(self, self.pipeline.get_by_name('vrec'), self.pipeline.get_by_name('atee')) if RECORDING else None
+
+        if PREVIEW_INTERVAL:
+            os.makedirs(os.path.dirname(PREVIEW_FILE) or '.', exist_ok=True)
+            self.pipeline.get_by_name('preview').connect('new-sample', self.on_preview_sample)
+
+        self.telemetry = PipelineTelemetry(self.pipeline, self.overlay, self.venc, self.outputs)
+        self.parked = [] # (tee, tee pad, fakesink) holding a standby pipeline in preroll
+        self.promoted_at = None
+        self.on_air = False
+        if STREAM_STANDBY:
+            self.park()
+        else:
+            for output in self.outputs:
+                output.attach()
+            if self.recorder:
+                self.recorder.attach()
+        GLib.timeout_add_seconds(5, self.check_outputs)
+        if self.progress_fd is not None:
+            threading.Thread(target=self.report_progress, daemon=True).start()
+
         # Bus handling
         bus = self.pipeline.get_bus()
         bus.add_signal_watch()
         bus.connect('message', self.on_message)
+        # Output errors are also seen synchronously, so the failed branch
+        # drops data before its flow error can reach the tee
+        bus.enable_sync_message_emission()
+        bus.connect('sync-message::error', self.on_sync_error)
 
-        # Audio Trigger State
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        self.volume_trigger_file = os.path.join(current_dir, "volume_trigger.json")
-        
-        # TTS State
-        self.tts_bin = None
-        self.last_tts_timestamp = 0
-        self.tts_trigger_file = os.path.join(current_dir, "tts_trigger.json")
-        
-        print(f"DEBUG: Monitoring TTS trigger at: {self.tts_trigger_file}")
-        
-        # Start TTS Poller
-        GLib.timeout_add(1000, self.check_tts_trigger)
+        # Runtime Encoder Tuning (pushed by /api/stream/encoder)
+        self.video_bitrate = VIDEO_BITRATE
+        self.keyframe_interval = KEYFRAME_INTERVAL
+        self.keyframe_timer = None
 
-    def check_tts_trigger(self):
-        # Don't interrupt Program
-        if self.current_program_id is not None:
-            return True
-            
+        # --- Control Channel ---
+        # StreamManager passes one end of a socketpair and pushes one JSON
+        # command per line (tts, program, volume, encoder, config)
+        self.control = None
+        self.control_buffer = b""
+        control_fd = os.environ.get('CONTROL_FD')
+        if control_fd:
+            self.control = socket.socket(fileno=int(control_fd))
+            self.control.setblocking(False)
+            GLib.io_add_watch(self.control.fileno(), GLib.PRIORITY_DEFAULT,
+                              GLib.IOCondition.IN | GLib.IOCondition.HUP | GLib.IOCondition.ERR,
+                              self.on_control)
+            print("Control channel connected")
+
+    def on_control(self, fd, condition):
         try:
-            if os.path.exists(self.tts_trigger_file):
-                # print(f"DEBUG: Reading {self.tts_trigger_file}") # Too verbose? 
-                with open(self.tts_trigger_file, 'r') as f:
-                    data = json.load(f)
-                    
-                ts = data.get('timestamp', 0)
-                if ts > self.last_tts_timestamp:
-                    print(f"DEBUG: New TTS Trigger detected! Timestamp: {ts}")
-                    self.last_tts_timestamp = ts
-                    file_path = data.get('file')
-                    if file_path and os.path.exists(file_path):
-                        self.play_tts(file_path)
-                    else:
-                        print(f"DEBUG: TTS file not found: {file_path}")
-        except Exception as e:
-            print(f"TTS Check failed: {e}")
-            
+            data = self.control.recv(65536)
+        except BlockingIOError:
+            return True
+        except OSError as e:
+            print(f"Control channel error: {e}")
+            data = b""
+        if not data:
+            print("Control channel closed")
+            self.control.close()
+            return False
+
+        self.control_buffer += data
+        while b"\n" in self.control_buffer:
+            line, self.control_buffer = self.control_buffer.split(b"\n", 1)
+            if not line.strip():
+                continue
+            try:
+                self.handle_command(json.loads(line))
+            except Exception as e:
+                print(f"Control command failed: {e}")
+        return True
+
+    def handle_command(self, command):
+        cmd = command.get('cmd')
+        if cmd == 'tts':
+            # Don't interrupt Program
+            if self.current_program_id is not None:
+                print("TTS skipped, program is playing")
+                return
+            file_path = command.get('file')
+            if file_path and os.path.exists(file_path):
+                self.play_tts(file_path)
+            else:
+                print(f"DEBUG: TTS file not found: {file_path}")
+        elif cmd == 'promote':
+            self.promote()
+        elif cmd == 'schedule':
+            self.apply_schedule(command.get('programs') or [])
+        elif cmd == 'volume':
+            if self.vol_music and command.get('music') is not None:
+                self.music_volume = float(command['music'])
+                if not self.tts.stats()["playing"]:
+                    self.vol_music.set_property("volume", self.music_volume)
+                print(f"Music volume set to {command['music']}")
+        elif cmd == 'music':
+            print(f"Music bed playlist: {command.get('tracks')}")
+            self.music.set_playlist(command.get('tracks') or [])
+        elif cmd == 'encoder':
+            self.apply_encoder_settings(command.get('bitrate'), command.get('keyframe_interval'))
+        elif cmd == 'config':
+            # overlay.html reloads its config from the news socket, just make
+            # sure the snapshots catch the change at full rate
+            if self.renderer:
+                self.renderer.wake()
+        else:
+            print(f"Unknown control command: {cmd}")
+
+    def apply_encoder_settings(self, bitrate=None, keyframe_interval=None):
+        if bitrate:
+            # x264enc reconfigures bitrate in PLAYING
+            self.venc.set_property("bitrate", int(bitrate))
+            self.video_bitrate = int(bitrate)
+            print(f"Encoder bitrate set to {self.video_bitrate} kbit/s")
+
+        if keyframe_interval:
+            keyframe_interval = int(keyframe_interval)
+            pspec = self.venc.find_property("key-int-max")
+            if pspec.flags & Gst.PARAM_MUTABLE_PLAYING:
+                self.venc.set_property("key-int-max", keyframe_interval)
+            else:
+                # key-int-max is fixed once x264 is opened. Force key units at
+                # the new interval instead; that can only shorten the GOP, a
+                # longer interval takes effect on the next (re)start.
+                if self.keyframe_timer:
+                    GLib.source_remove(self.keyframe_timer)
+                    self.keyframe_timer = None
+                if keyframe_interval < KEYFRAME_INTERVAL:
+                    interval_ms = max(1, keyframe_interval * 1000 // FRAMERATE)
+                    self.keyframe_timer = GLib.timeout_add(interval_ms, self.force_keyframe)
+            self.keyframe_interval = keyframe_interval
+            print(f"Encoder keyframe interval set to {self.keyframe_interval} frames")
+
+    def force_keyframe(self):
+        event = GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+        self.venc.get_static_pad("src").send_event(event)
         return True
 
     def play_tts(self, file_path):
-        print(f"Playing TTS: {file_path}")
-        
+        print(f"Queueing TTS: {file_path}")
+        self.tts.play(file_path)
+
+    def on_tts_start(self, name):
+        print(f"Playing TTS: {name} ({self.tts.last_first_sample_ms} ms after request)")
         # Duck Music
         if self.vol_music:
             self.vol_music.set_property("volume", 0.05)
-            
-        # Create TTS Bin if previous one exists (cleanup?)
-        if self.tts_bin:
-            self.tts_bin.set_state(Gst.State.NULL)
-            self.pipeline.remove(self.tts_bin)
-            self.tts_bin = None
-            
-        # New Bin
-        # file -> decode -> convert -> resample -> volume -> amix.sink_1
-        self.tts_bin = Gst.Bin.new("tts_bin")
-        
-        uri = f"file:///{file_path.replace(os.sep, '/')}"
-        
-        source = Gst.ElementFactory.make("uridecodebin")
-        source.set_property("uri", uri)
-        source.connect("pad-added", self.on_tts_pad_added)
-        
-        self.tts_bin.add(source)
-        self.pipeline.add(self.tts_bin)
-        self.tts_bin.set_state(Gst.State.PLAYING)
-
-    def on_tts_pad_added(self, source, new_pad):
-        # Link TTS to Mixer sink_1
-        new_pad_caps = new_pad.query_caps(None)
-        new_pad_struct = new_pad_caps.get_structure(0)
-        new_pad_name = new_pad_struct.get_name()
-        
-        if new_pad_name.startswith("audio"):
-            convert = Gst.ElementFactory.make("audioconvert")
-            resample = Gst.ElementFactory.make("audioresample")
-            vol = Gst.ElementFactory.make("volume")
-            vol.set_property("volume", 1.5) # Boost TTS slightly
-            
-            self.tts_bin.add(convert)
-            self.tts_bin.add(resample)
-            self.tts_bin.add(vol)
-            
-            convert.sync_state_with_parent()
-            resample.sync_state_with_parent()
-            vol.sync_state_with_parent()
-            
-            # Logic: source -> convert -> resample -> vol -> amix.sink_1
-            new_pad.link(convert.get_static_pad("sink"))
-            convert.link(resample)
-            resample.link(vol)
-            
-            src_pad = vol.get_static_pad("src")
-            sink_pad = self.amix.get_request_pad("sink_%u")
-            
-            if sink_pad:
-                 src_pad.link(sink_pad)
-                 sink_pad.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self.on_tts_event, None)
-            else:
-                print("Failed to get amix sink pad")
-
-    def on_tts_event(self, pad, info, user_data):
-        event = info.get_event()
-        if event.type == Gst.EventType.EOS:
-            print("TTS Finished (EOS)")
-            # Restore Music Volume
-            GLib.idle_add(self.restore_music_volume)
-        return Gst.PadProbeReturn.OK
+        return False
 
     def restore_music_volume(self):
+        print("TTS Finished")
         if self.vol_music:
-            self.vol_music.set_property("volume", 1.0)
-        
-        # Cleanup TTS bin
-        if self.tts_bin:
-            self.tts_bin.set_state(Gst.State.NULL)
-            self.pipeline.remove(self.tts_bin)
-            self.tts_bin = None
+            self.vol_music.set_property("volume", self.music_volume)
         return False
 
 
+    def run_in_worker(self, work, on_done=None, *args):
+        """Run blocking work off the GLib loop; on_done(result) is called back on the loop."""
+        def finished(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Worker task {work.__name__} failed: {e}")
+                result = None
+            if on_done:
+                GLib.idle_add(lambda: on_done(result) and False)
+        self.executor.submit(work, *args).add_done_callback(finished)
+
     def check_schedule(self):
+        if not self.schedule_fetching:
+            self.schedule_fetching = True
+            self.run_in_worker(self.fetch_schedule, self.on_schedule_fetched)
+        return True
+
+    def fetch_schedule(self):
+        # Worker thread
         try:
             with urllib.request.urlopen(f"{self.api_base}/programs/current", timeout=2) as response:
                 if response.getcode() == 200:
                     data = json.loads(response.read().decode())
-                    if data and 'id' in data:
-                        # Found active program
-                        if self.current_program_id != data['id']:
-                            self.start_program(data)
-                    else:
-                        # No active program
-                        if self.current_program_id is not None:
-                            self.stop_program()
-                else:
-                    if self.current_program_id is not None:
-                        self.stop_program()
+                    return [data] if data and 'id' in data else []
+                return []
         except Exception as e:
             print(f"Schedule Check Error: {e}")
-            
-        return True
+            return None
+
+    def on_schedule_fetched(self, programs):
+        self.schedule_fetching = False
+        if programs is not None:
+            self.apply_schedule(programs)
+
+    def apply_schedule(self, programs):
+        self.schedule = sorted(programs, key=lambda p: p['start_time'])
+        for data in self.schedule:
+            self.validate_program(data)
+        self.program_tick()
+
+    def program_tick(self):
+        # Runs at every schedule boundary: cue, switch, stop
+        if self.program_timer:
+            GLib.source_remove(self.program_timer)
+            self.program_timer = None
+
+        now = time.time()
+        current = None
+        upcoming = None
+        for data in self.schedule:
+            start, end = program_window(data)
+            if start <= now < end and current is None:
+                current = data
+            elif start > now and upcoming is None:
+                upcoming = data
+
+        if current and current['id'] != self.current_program_id:
+            self.start_program(current)
+        elif current is None and self.current_program_id is not None:
+            self.stop_program()
+
+        if upcoming:
+            start = program_window(upcoming)[0]
+            if start - now <= PROGRAM_PREROLL and (self.cued is None or self.cued.data['id'] != upcoming['id']):
+                self.cue_program(upcoming)
+
+        # Next boundary
+        events = []
+        if current:
+            events.append(program_window(current)[1])
+        if upcoming:
+            start = program_window(upcoming)[0]
+            events += [start - PROGRAM_PREROLL, start]
+        events = [t for t in events if t > now]
+        if events:
+            self.program_timer = GLib.timeout_add(max(1, int((min(events) - now) * 1000)), self.program_tick)
+        return False
+
+    def validate_program(self, data):
+        for path in program_clips(data):
+            uri = program_uri(path)
+            if uri in self.program_checks:
+                continue
+            self.program_checks[uri] = {"status": "checking"}
+            self.discoverer.discover_uri_async(uri)
+
+    def on_discovered(self, discoverer, info, error):
+        uri = info.get_uri()
+        result = info.get_result()
+        if result == GstPbutils.DiscovererResult.OK:
+            check = {
+                "status": "ok",
+                "duration": info.get_duration() / Gst.SECOND,
+                "video": bool(info.get_video_streams()),
+                "audio": bool(info.get_audio_streams())
+            }
+            if not check["video"]:
+                check.update(status="error", error="no video stream")
+        else:
+            check = {"status": "error", "error": error.message if error else result.value_nick}
+        self.program_checks[uri] = check
+        if check["status"] == "ok":
+            print(f"Program file OK: {uri} ({check['duration']:.0f}s)")
+        else:
+            print(f"Program file INVALID: {uri}: {check['error']}")
+
+    def clip_check(self, path):
+        return self.program_checks.get(program_uri(path), {})
+
+    def next_clip(self, data, index):
+        # Next playable clip after index, wrapping around for loop-to-fill
+        clips = program_clips(data)
+        loop = data.get('loop', True) is not False
+        for step in range(1, len(clips) + 1):
+            candidate = index + step
+            if candidate >= len(clips):
+                if not loop:
+                    return None
+                candidate %= len(clips)
+            if self.clip_check(clips[candidate]).get("status") != "error":
+                return candidate
+        return None
+
+    def cue_program(self, data):
+        index = self.next_clip(dict(data, loop=False), -1)
+        if index is None:
+            print(f"Not cueing program {data['title']} (ID: {data['id']}): no clip passed validation")
+            return None
+        if self.cued:
+            self.cued.teardown()
+        print(f"Cueing Program: {data['title']} (ID: {data['id']})")
+        self.cued = ProgramBin(self, data, index)
+        return self.cued
+
+    def cue_standby(self):
+        # Decode the program's next clip while the current one plays
+        if self.standby:
+            self.standby.teardown()
+            self.standby = None
+        if self.program:
+            index = self.next_clip(self.program.data, self.program.index)
+            if index is not None:
+                self.standby = ProgramBin(self, self.program.data, index)
 
     def start_program(self, data):
-        print(f"Starting Program: {data['title']} (ID: {data['id']})")
+        if self.cued and self.cued.data['id'] == data['id']:
+            program = self.cued
+            self.cued = None
+        else:
+            # Not prerolled (late schedule change), decode from cold
+            program = self.cue_program(data)
+            self.cued = None
+            if program is None:
+                if self.current_program_id is not None:
+                    self.stop_program()
+                return
+
+        print(f"Starting Program: {data['title']} (ID: {data['id']}, prerolled: {program.prerolled})")
+        self.release_program()
+        self.program = program
         self.current_program_id = data['id']
-        
-        # Construct path (handle relative media)
-        video_path = data['video_path']
-        if not os.path.isabs(video_path):
-            video_path = os.path.abspath(video_path)
-        
-        uri = f"file:///{video_path.replace(os.sep, '/')}"
-        
-        # Create Dynamic Bin
-        self.program_bin = Gst.Bin.new("program_bin")
-        
-        # URIDecodeBin
-        source = Gst.ElementFactory.make("uridecodebin", "source")
-        source.set_property("uri", uri)
-        source.connect("pad-added", self.on_pad_added)
-        
-        self.program_bin.add(source)
-        self.pipeline.add(self.program_bin)
-        
-        # Sync state
-        self.program_bin.set_state(Gst.State.PLAYING)
-        
-        # Switch Selectors (Optimistic switch)
-        # Note: If decode fails, we might get silence/black.
-        pad0 = self.vsel.get_static_pad("sink_1")
-        self.vsel.set_property("active-pad", pad0)
-        
-        apad0 = self.asel.get_static_pad("sink_1")
-        self.asel.set_property("active-pad", apad0)
-        
+        start = program_window(data)[0]
+        # Late starts (restart mid-program, cold cue) count from now
+        program.activate(start if time.time() - start < 1 else time.time())
+        self.cue_standby()
+
         # Notify Overlay (optional, hiding overlays done via API usually, but we can enforce)
         # For now, we leave overlays ON (Ticker over video is common)
 
-    def stop_program(self):
-        print("Stopping Program")
-        self.current_program_id = None
-        
+    def on_program_eos(self, program):
+        # Main thread (idle callback from the clip's streaming thread)
+        if program is not self.program:
+            return False
+        if self.standby is None:
+            print(f"Program {program.data['id']} ran out of content, back to default until the slot ends")
+            self.show_default()
+            self.release_program()
+            return False
+
+        # Gapless: the next clip starts exactly where this one ends
+        following = self.standby
+        self.standby = None
+        end = program.end_running_time()
+        now = self.output_running_time()
+        following.activate(running_time=end if end is not None and end > now else now)
+        self.program = following
+        program.teardown()
+        self.clip_transitions += 1
+        print(f"Program {following.data['id']}: clip {program.index} -> {following.index} (prerolled: {following.prerolled})")
+        self.cue_standby()
+        return False
+
+    def on_program_error(self, program, reason):
+        # Main thread. A broken clip is marked so next_clip skips it, then
+        # its bin goes, wherever it was in the rundown
+        if program.bin is None:
+            return False # Already torn down
+        clip = program_clips(program.data)[program.index]
+        self.program_checks[program_uri(clip)] = {"status": "error", "error": reason}
+        if program is self.program:
+            self.on_program_eos(program) # carry on with the rest of the rundown
+        elif program is self.standby:
+            self.standby = None
+            program.teardown()
+            self.cue_standby()
+        elif program is self.cued:
+            self.cued = None
+            program.teardown()
+        return False
+
+    def show_default(self):
         # Switch back to default
         pad0 = self.vsel.get_static_pad("sink_0")
         self.vsel.set_property("active-pad", pad0)
         
         apad0 = self.asel.get_static_pad("sink_0")
         self.asel.set_property("active-pad", apad0)
-        
-        # Cleanup Bin
-        if self.program_bin:
-            self.program_bin.set_state(Gst.State.NULL)
-            self.pipeline.remove(self.program_bin)
-            self.program_bin = None
 
-    def on_pad_added(self, source, new_pad):
-        # Link dynamic pads to selectors
-        new_pad_caps = new_pad.query_caps(None)
-        new_pad_struct = new_pad_caps.get_structure(0)
-        new_pad_type = new_pad_struct.get_name()
-        
-        if new_pad_type.startswith("video"):
-            # Ensure format compatibility
-            # source -> videoconvert -> videoscale -> caps -> vsel.sink_1
-            convert = Gst.ElementFactory.make("videoconvert")
-            scale = Gst.ElementFactory.make("videoscale")
-            capsfilter = Gst.ElementFactory.make("capsfilter")
-            caps = Gst.Caps.from_string(f"video/x-raw,width={WIDTH},height={HEIGHT}")
-            capsfilter.set_property("caps", caps)
-            
-            self.program_bin.add(convert)
-            self.program_bin.add(scale)
-            self.program_bin.add(capsfilter)
-            
-            convert.sync_state_with_parent()
-            scale.sync_state_with_parent()
-            capsfilter.sync_state_with_parent()
-            
-            # Internal Links
-            new_pad.link(convert.get_static_pad("sink"))
-            convert.link(scale)
-            scale.link(capsfilter)
-            
-            # External Link to Selector
-            src_pad = capsfilter.get_static_pad("src")
-            sink_pad = self.vsel.get_request_pad("sink_%u") # Use request pad or static? input-selector has sometimes sink_%u
-            # Actually input-selector usually has sink_%u request pads, but we manually used sink_0 in string.
-            # sink_1 might not exist until requested?
-            # GStreamer parse_launch might create sink_0 and sink_1 if referenced? No, sink_0 was referenced.
-            # Let's request a pad.
-            
-            # Wait, in the pipeline string string I didn't reference vsel.sink_1.
-            # So I should request a pad.
-            # BUT I need to know it is index 1 for switching?
-            # input-selector pads have a 'always-ok' property? No.
-            # We used set_property("active-pad", pad).
-            
-            # If I request, I get sink_1?
-            # sink_pad = self.vsel.get_compat_pad(sink_1)? 
-            
-            # Let's get static first?
-            sink_pad = self.vsel.get_static_pad("sink_1")
-            if not sink_pad:
-                sink_pad = self.vsel.get_request_pad("sink_%u")
-            
-            if sink_pad:
-                src_pad.link(sink_pad)
-            else:
-                print("Failed to get video sink pad")
+    def release_program(self):
+        # Cleanup Bins
+        for program in (self.program, self.standby):
+            if program:
+                program.teardown()
+        self.program = None
+        self.standby = None
 
-        elif new_pad_type.startswith("audio"):
-            # source -> audioconvert -> audioresample -> asel.sink_1
-            convert = Gst.ElementFactory.make("audioconvert")
-            resample = Gst.ElementFactory.make("audioresample")
-            
-            self.program_bin.add(convert)
-            self.program_bin.add(resample)
-            
-            convert.sync_state_with_parent()
-            resample.sync_state_with_parent()
-            
-            new_pad.link(convert.get_static_pad("sink"))
-            convert.link(resample)
-            
-            src_pad = resample.get_static_pad("src")
-            sink_pad = self.asel.get_static_pad("sink_1")
-            if not sink_pad:
-                sink_pad = self.asel.get_request_pad("sink_%u")
-                
-            if sink_pad:
-                src_pad.link(sink_pad)
+    def stop_program(self):
+        print("Stopping Program")
+        self.current_program_id = None
+        self.show_default()
+        self.release_program()
 
-    def update_surface(self):
-        # This runs in the main GTK thread
-        surface = self.window.get_surface()
-        if surface:
-            # Reuse surface to reduce memory allocation churn
-            if self.img_surface is None:
-                try:
-                    self.img_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, WIDTH, HEIGHT)
-                    self.img_ctx = cairo.Context(self.img_surface)
-                except Exception as e:
-                    print(f"Error creating surface: {e}")
-                    return True
-
-            with self.surface_lock:
-                if self.img_ctx:
-                    self.img_ctx.set_source_surface(surface, 0, 0)
-                    self.img_ctx.paint()
-                    self.current_surface = self.img_surface
-        
-        # Heartbeat check (every 5 seconds)
-        now = time.time()
-        if now - self.last_heartbeat > 5.0:
-            print(f"[HEARTBEAT] Stream active. Memory optimized.", flush=True)
-            self.last_heartbeat = now
-            
-        return True # Keep calling
+    def running_time(self):
+        clock = self.pipeline.get_clock()
+        if clock is None:
+            return 0
+        return clock.get_time() - self.pipeline.get_base_time()
+
+    def on_selector_data(self, pad, info, kind):
+        # Streaming thread
+        if info.type & Gst.PadProbeType.BUFFER:
+            segment = self.selector_segments.get(kind)
+            buf = info.get_buffer()
+            if segment is None or buf.pts == Gst.CLOCK_TIME_NONE:
+                return Gst.PadProbeReturn.OK
+            position = segment.to_running_time(Gst.Format.TIME, buf.pts)
+            if position != Gst.CLOCK_TIME_NONE and position >= 0:
+                if buf.duration != Gst.CLOCK_TIME_NONE:
+                    position += buf.duration
+                self.selector_out[kind] = position
+        elif info.get_event().type == Gst.EventType.SEGMENT:
+            self.selector_segments[kind] = info.get_event().parse_segment()
+        return Gst.PadProbeReturn.OK
+
+    def output_running_time(self):
+        # Where the next buffer switched onto the selectors lands
+        if not self.selector_out:
+            return self.running_time()
+        return max(self.selector_out.values())
+
+    def record_switch(self, program, latency_ms):
+        # Streaming thread
+        self.program_switches += 1
+        self.last_switch_latency_ms = round(latency_ms, 1)
+        print(f"Program {program.data['id']} on air, switch latency {latency_ms:.1f} ms")
+
+    def program_stats(self):
+        return {
+            "on_air": self.current_program_id,
+            "clip": self.program.index if self.program else None,
+            "standby_prerolled": self.standby.prerolled if self.standby else False,
+            "cued": self.cued.data['id'] if self.cued else None,
+            "cued_prerolled": self.cued.prerolled if self.cued else False,
+            "switches": self.program_switches,
+            "clip_transitions": self.clip_transitions,
+            "last_switch_latency_ms": self.last_switch_latency_ms,
+            "checks": {str(data['id']): [self.clip_check(path) for path in program_clips(data)] for data in self.schedule}
+        }
+
+    def report_heartbeat(self):
+        print(f"[HEARTBEAT] Stream active.", flush=True)
+        print(f"[STATS] {json.dumps(self.collect_stats())}", flush=True)
+        return True
+
+    def report_progress(self):
+        # Own thread, so a stuck GLib loop can't fake a stall (loop_age says
+        # how long the loop has been stuck) and a busy one can't hide one
+        try:
+            with os.fdopen(self.progress_fd, 'w', buffering=1) as pipe:
+                while True:
+                    record = {
+                        "t": round(time.time(), 3),
+                        "state": self.pipeline.get_state(0)[1].value_nick,
+                        "frames": self.telemetry.encoded,
+                        "running": round(self.running_time() / Gst.SECOND, 3),
+                        "loop_age": round(time.monotonic() - self.loop_lag.last_tick, 3),
+                        "sinks": {output.name: round(output.last_progress, 3) if output.bin else None
+                                  for output in self.outputs},
+                        "standby": bool(self.parked)
+                    }
+                    pipe.write(json.dumps(record, separators=(',', ':')) + "\n")
+                    time.sleep(HEARTBEAT_INTERVAL)
+        except OSError as e:
+            print(f"Progress heartbeat stopped: {e}")
+
+    def collect_stats(self):
+        return {
+            "encoder": {
+                "profile": STREAM_PROFILE,
+                "width": WIDTH,
+                "height": HEIGHT,
+                "framerate": FRAMERATE,
+                "bitrate": self.video_bitrate,
+                "keyframe_interval": self.keyframe_interval,
+                "preset": X264_PRESET,
+                "threads": X264_THREADS,
+                "audio_bitrate": AUDIO_BITRATE,
+                "renditions": [
+                    {"name": r.get("name", str(i)), "width": r["width"], "height": r["height"], "video_bitrate": r["video_bitrate"]}
+                    for i, r in enumerate(RENDITIONS)
+                ]
+            },
+            "overlay_mode": OVERLAY_MODE,
+            "overlay": self.overlay_stats(),
+            "program": self.program_stats(),
+            "tts": dict(self.tts.stats(), amix_pads=len(self.amix.sinkpads)),
+            "music": self.music.stats(),
+            "pipeline": self.telemetry.sample(),
+            "recording": self.recorder.stats() if self.recorder else None,
+            "main_loop": self.loop_lag.sample(),
+            "sources": self.sources.stats()
+        }
+
+    def overlay_stats(self):
+        if self.renderer_process:
+            return self.renderer_process.stats()
+        return dict(self.ring.stats(), renderer="inline", **self.renderer.stats())
 
     def on_draw(self, overlay, context, timestamp, duration):
-        # This runs in the GStreamer streaming thread
-        with self.surface_lock:
-            if self.current_surface:
-                context.set_source_surface(self.current_surface, 0, 0)
-                context.paint()
+        # This runs in the GStreamer streaming thread, never blocks on GTK
+        slot = self.ring.latest() if self.ring else None
+        if slot:
+            rects = slot.coverage_rects
+            if rects is not None:
+                if not rects:
+                    return # Overlay fully transparent, nothing to blend
+                for rect in rects:
+                    context.rectangle(*rect)
+                context.clip()
+            context.set_source_surface(slot.surface, 0, 0)
+            context.paint()
+        else:
+            # Debug: Draw a red rectangle if no surface yet
+            context.set_source_rgba(1, 0, 0, 0.5)
+            context.rectangle(100, 100, 200, 200)
+            context.fill()
+
+    def on_composition_draw(self, overlay, sample):
+        # Streaming thread. Returning the same composition lets
+        # overlaycomposition reuse its converted rectangles.
+        slot = self.ring.latest() if self.ring else None
+        if slot is None:
+            return None
+        if slot.sequence != self.composition_sequence:
+            if slot.static_rects:
+                # Static-only tiles are identical in every slot of the same
+                # static generation: keep their rectangles (and the converted
+                # pixels overlaycomposition caches on them), rebuild the rest
+                key = (slot.static_generation, tuple(slot.static_rects))
+                if key != self.static_rectangles_key:
+                    self.static_rectangles = build_overlay_rectangles(slot.surface, slot.static_rects)
+                    self.static_rectangles_key = key
+                rectangles = self.static_rectangles + build_overlay_rectangles(slot.surface, slot.dynamic_rects or [])
             else:
-                # Debug: Draw a red rectangle if no surface yet
-                context.set_source_rgba(1, 0, 0, 0.5)
-                context.rectangle(100, 100, 200, 200)
-                context.fill()
+                rectangles = build_overlay_rectangles(slot.surface, slot.coverage_rects)
+            self.composition = compose_overlay_rectangles(rectangles)
+            self.composition_sequence = slot.sequence
+        return self.composition
+
+    def park(self):
+        # A prerolling fakesink per tee: PAUSED completes once the encoders
+        # have negotiated and produced a frame, then back-pressure holds
+        # every source until promote()
+        tees = []
+        for output in self.outputs:
+            if output.tee not in tees:
+                tees.append(output.tee)
+        for tee in tees:
+            sink = Gst.ElementFactory.make("fakesink", f"park_{tee.get_name()}")
+            self.pipeline.add(sink)
+            tee_pad = tee.get_request_pad("src_%u")
+            tee_pad.link(sink.get_static_pad("sink"))
+            self.parked.append((tee, tee_pad, sink))
+        print("Standby: parking pipeline in PAUSED")
+
+    def promote(self):
+        if not self.parked:
+            return
+        self.promoted_at = time.time()
+        print("Standby: promoted, going live")
+        for tee, tee_pad, sink in self.parked:
+            # Release the tee pad first so the preroll flush is seen by tee
+            # as a removed pad (not-linked) instead of a flushing flow
+            tee_pad.unlink(sink.get_static_pad("sink"))
+            tee.release_request_pad(tee_pad)
+            sink.set_state(Gst.State.NULL)
+            self.pipeline.remove(sink)
+        self.parked = []
+        for output in self.outputs:
+            output.attach()
+        if self.recorder:
+            self.recorder.attach()
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def on_preview_sample(self, appsink):
+        # Streaming thread. Written with a rename so the server never reads half a JPEG.
+        sample = appsink.emit('pull-sample')
+        if sample is None or self.parked:
+            return Gst.FlowReturn.OK # a parked standby must not replace the live preview
+        buf = sample.get_buffer()
+        ok, info = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return Gst.FlowReturn.OK
+        try:
+            tmp = PREVIEW_FILE + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(info.data)
+            os.replace(tmp, PREVIEW_FILE)
+        except OSError as e:
+            print(f"Preview write failed: {e}")
+        finally:
+            buf.unmap(info)
+        return Gst.FlowReturn.OK
+
+    def output_for(self, element):
+        # RTMP outputs and the recorder, the branches that fail on their own
+        for output in self.outputs + ([self.recorder] if self.recorder else []):
+            if output.owns(element):
+                return output
+        return None
+
+    def on_sync_error(self, bus, message):
+        # Streaming thread
+        output = self.output_for(message.src)
+        if output:
+            output.failed = True
+
+    def check_outputs(self):
+        for output in self.outputs:
+            output.check()
+        return True
 
     def on_message(self, bus, message):
         t = message.type
         if t == Gst.MessageType.EOS:
+            # Program clips never get here, ProgramBin drops their EOS and
+            # the rundown moves on to the next clip (see on_program_eos)
             print("End of stream")
-            # If loading a file, EOS might trigger?
-            # We should probably handle EOS from program_bin separately?
-            # But the bus is shared.
-            # If EOS comes from program_bin, we should loop or stop?
-            # For now, simplistic approach: ignore EOS from files (loop handled by uridecodebin? no)
-            pass 
         elif t == Gst.MessageType.ERROR:
             err, debug = message.parse_error()
             print(f"Error: {err}, {debug}")
+            output = self.output_for(message.src)
+            if output:
+                # Only this branch goes down, it re-attaches on its own
+                output.on_error(err.message)
+            else:
+                # Broken clip, on air or decoding ahead
+                for program in (self.program, self.cued, self.standby):
+                    if program and program.owns(message.src):
+                        self.on_program_error(program, err.message)
+                        break
             # self.mainloop.quit() # detailed error handling needed
+        elif t == Gst.MessageType.QOS:
+            self.telemetry.on_qos(message)
         elif t == Gst.MessageType.WARNING:
             err, debug = message.parse_warning()
             print(f"Warning: {err}, {debug}")
@@ -518,16 +2694,47 @@ class StreamOverlayApp:
             if message.src == self.pipeline:
                 old_state, new_state, pending_state = message.parse_state_changed()
                 print(f"Pipeline state changed from {old_state.value_nick} to {new_state.value_nick}")
+                if new_state == Gst.State.PAUSED and self.parked:
+                    print("[STANDBY] ready", flush=True)
+                elif new_state == Gst.State.PLAYING and not self.on_air:
+                    # StreamManager times recoveries up to this line
+                    self.on_air = True
+                    since = f" {int((time.time() - self.promoted_at) * 1000)} ms after promote" if self.promoted_at else ""
+                    print(f"[ONAIR] pipeline playing{since}", flush=True)
 
     def run(self):
-        self.pipeline.set_state(Gst.State.PLAYING)
+        self.pipeline.set_state(Gst.State.PAUSED if STREAM_STANDBY else Gst.State.PLAYING)
         try:
             self.mainloop.run()
         except KeyboardInterrupt:
             pass
         finally:
             self.pipeline.set_state(Gst.State.NULL)
+            self.executor.shutdown(wait=False)
+            if self.renderer_process:
+                self.renderer_process.stop()
+
+def run_overlay_renderer(fd):
+    # Child process entry for OVERLAY_RENDERER=process
+    writer = SharedOverlayWriter(fd, WIDTH, HEIGHT)
+    renderer = OverlayRenderer(writer)
+    loop = GLib.MainLoop()
+    parent = os.getppid()
+
+    def heartbeat():
+        # Exit with the pipeline process instead of lingering as an orphan
+        if os.getppid() != parent:
+            loop.quit()
+            return False
+        writer.heartbeat(renderer.effective_fps())
+        return True
+
+    GLib.timeout_add(500, heartbeat)
+    loop.run()
 
 if __name__ == '__main__':
-    app = StreamOverlayApp()
-    app.run()
+    if len(sys.argv) > 2 and sys.argv[1] == '--overlay-renderer':
+        run_overlay_renderer(int(sys.argv[2]))
+    else:
+        app = StreamOverlayApp()
+        app.run()
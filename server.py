@@ -1,27 +1,31 @@
 import os
 import subprocess
 import signal
+import socket
 import json
 import re
 import sys
 import threading
-import queue
 import asyncio
 import time
 import datetime
+import collections
 import streamlink # Added for YouTube resolution
 from typing import Optional, List
-from fastapi import FastAPI, UploadFile, Form, WebSocket, WebSocketDisconnect, Depends, HTTPException, File
+from fastapi import FastAPI, UploadFile, Form, WebSocket, Depends, HTTPException, File, Header, Response, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 
 # Import our new database module
 import database
 from database import NewsItem, SystemConfig, NewsType, NewsCategory, get_db, Program, Voter, VoteCount
 from services.vote_collector import vote_collector
+from services.stream_log import StreamLog
+from services.broadcaster import Broadcaster
+from services.vote_batcher import VoteBatcher
 
 # Notification Config
 NTFY_TOPIC = os.environ.get('NTFY_TOPIC', 'eko_news_secret_123') # CHANGE THIS IN PRODUCTION
@@ -31,31 +35,154 @@ app = FastAPI()
 app.mount("/static", StaticFiles(directory="ui"), name="static")
 app.mount("/media", StaticFiles(directory="media"), name="media")
 
-# Log Management
-log_queue = queue.Queue()
-connected_websockets: List[WebSocket] = []
-news_websockets: List[WebSocket] = [] # New list for news updates
-
-
+# Output Profiles (stored overrides live in SystemConfig "output_profiles")
+# threads=0 lets main.py use every detected core
+OUTPUT_PROFILES = {
+    "720p15-lowcpu": {"width": 1280, "height": 720, "framerate": 15, "video_bitrate": 1500,
+                      "keyframe_interval": 30, "x264_preset": "ultrafast", "threads": 0, "audio_bitrate": 96000},
+    "720p15": {"width": 1280, "height": 720, "framerate": 15, "video_bitrate": 2500,
+               "keyframe_interval": 40, "x264_preset": "ultrafast", "threads": 0, "audio_bitrate": 128000},
+    "720p30": {"width": 1280, "height": 720, "framerate": 30, "video_bitrate": 3500,
+               "keyframe_interval": 60, "x264_preset": "superfast", "threads": 0, "audio_bitrate": 128000},
+    "1080p30": {"width": 1920, "height": 1080, "framerate": 30, "video_bitrate": 5000,
+                "keyframe_interval": 60, "x264_preset": "superfast", "threads": 0, "audio_bitrate": 128000},
+}
+DEFAULT_OUTPUT_PROFILE = "720p15"
+
+# Profile field -> environment variable read by main.py
+PROFILE_ENV = {
+    "width": "STREAM_WIDTH",
+    "height": "STREAM_HEIGHT",
+    "framerate": "STREAM_FRAMERATE",
+    "video_bitrate": "VIDEO_BITRATE",
+    "keyframe_interval": "KEYFRAME_INTERVAL",
+    "x264_preset": "X264_PRESET",
+    "threads": "X264_THREADS",
+    "audio_bitrate": "AUDIO_BITRATE",
+}
+
+METRICS_HISTORY = 120 # pipeline telemetry samples kept (main.py reports every 5s)
+
+# Hot standby: keep a second main.py prerolled in PAUSED (renderer loaded,
+# pipeline negotiated, no RTMP outputs) and promote it when the live one fails
+HOT_STANDBY = os.environ.get('HOT_STANDBY', '0') == '1'
+STANDBY_DELAY = 20 # seconds after the live process starts before spawning the standby
+
+# Watchdog: main.py writes a progress record (encoded frames, running time,
+# last buffer per output) to a side pipe every second; health is judged on it
+WATCHDOG_STALL = float(os.environ.get('WATCHDOG_STALL', 5)) # seconds without a new encoded frame
+WATCHDOG_HEARTBEAT = float(os.environ.get('WATCHDOG_HEARTBEAT', 5)) # seconds without a progress record
+WATCHDOG_STARTUP = float(os.environ.get('WATCHDOG_STARTUP', 45)) # grace for the first frame after a start
+
+# Vote bursts: one overlay update per window, a few popups each
+VOTE_BATCH_WINDOW = float(os.environ.get('VOTE_BATCH_WINDOW', 2.0)) # seconds
+VOTE_DISPLAY_MAX = int(os.environ.get('VOTE_DISPLAY_MAX', 3)) # voters animated per batch
+
+# On-air recording segments written by main.py (RECORDING=1)
+RECORDINGS_DIR = os.environ.get('RECORDINGS_DIR', os.path.join('data', 'recordings'))
+# Admin preview JPEG written by main.py every PREVIEW_INTERVAL seconds
+PREVIEW_FILE = os.environ.get('PREVIEW_FILE', os.path.join('data', 'preview.jpg'))
+preview_cache = {} # path -> {"mtime", "data", "etag"}, one disk read per new frame
+preview_lock = threading.Lock()
+
+RECORDING_NAME = re.compile(r"^rec_(\d{8}-\d{6})(?:_\d+)?\.ts$")
+
+# Channels: every channel is one main.py with its own outputs, overlay URL
+# (?channel=), config overrides and news. "default" is the channel behind
+# /api/stream/*, the others are defined in SystemConfig "channels".
+DEFAULT_CHANNEL = "default"
+CHANNEL_NAME = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+USAGE_INTERVAL = 5 # seconds between CPU / memory samples of a channel's processes
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+# Log Management: stream_log.txt (rotated), recent lines and /ws/logs clients
+stream_log = StreamLog("stream_log.txt")
+# /ws/news: overlays and admin pages, each with its own send queue
+news_broadcaster = Broadcaster("news", queue_size=100, max_lag=5.0)
+
+
+
+def process_tree(pid):
+    """pid and its descendants (main.py, the overlay renderer process, ...)."""
+    pids = [pid]
+    for parent in pids: # grows while walking
+        try:
+            with open(f"/proc/{parent}/task/{parent}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+def process_usage(pid):
+    """(cpu seconds, rss bytes, process count) of a process tree, from /proc."""
+    cpu, rss, count = 0.0, 0, 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split() # comm may contain spaces
+        except (OSError, IndexError):
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS # utime + stime
+        rss += int(fields[21]) * PAGE_SIZE
+        count += 1
+    return cpu, rss, count
 
 class StreamManager:
-    def __init__(self):
+    def __init__(self, name=DEFAULT_CHANNEL):
+        self.name = name
+        self.tag = "[StreamManager]" if name == DEFAULT_CHANNEL else f"[StreamManager:{name}]"
+        # Files main.py writes, one set per channel
+        if name == DEFAULT_CHANNEL:
+            self.overlay_url = "http://127.0.0.1:8123/overlay"
+            self.recordings_dir = RECORDINGS_DIR
+            self.preview_file = PREVIEW_FILE
+        else:
+            self.overlay_url = f"http://127.0.0.1:8123/overlay?channel={name}"
+            self.recordings_dir = os.path.join(RECORDINGS_DIR, name)
+            root, ext = os.path.splitext(PREVIEW_FILE)
+            self.preview_file = f"{root}_{name}{ext}"
+        self.cpus = None # CPU set for the channel's processes, None = any
+        self.nice = None # Scheduling priority of the channel's processes
+        self.usage = {} # Latest CPU / memory sample, see _sample_usage
+        self.usage_sample = None # (pid, time, cpu seconds) of the previous sample
         self.process = None
         self.should_run = False
         self.rtmp_url = None
         self.backup_rtmp_url = None
         self.stream_key = None
+        self.profile = None # Output profile dict (incl. "name"), see OUTPUT_PROFILES
+        self.renditions = [] # Extra ladder outputs encoded from the same composite
         self.lock = threading.Lock()
         self.monitor_thread = None
-        self.log_file = "stream_log.txt"
         self.last_heartbeat = 0
-
-
-    def start(self, rtmp_url, backup_rtmp_url=None, stream_key=None):
+        self.stats = {} # Latest [STATS] record reported by main.py
+        self.metrics = collections.deque(maxlen=METRICS_HISTORY) # Recent pipeline telemetry samples
+        self.control = None # Socket to main.py, one JSON command per line
+        self.control_lock = threading.Lock()
+        self.schedule = [] # Upcoming programs, re-sent to every new process
+        self.music_playlist = None # Music bed files, None = main.py default track
+        self.music_volume = None # Last volume/duck setting, None = main.py default
+        self.process_started_at = 0
+        self.progress = None # Latest progress record of the live process
+        self.last_progress = 0 # When that record arrived
+        self.last_frame_at = 0 # When the encoded frame count last moved
+        self.standby = None # Prerolled main.py waiting for "promote" (HOT_STANDBY)
+        self.standby_control = None
+        self.standby_ready = False
+        self.standby_heartbeat = 0
+        self.recovering = None # {"since", "dark_since", "mode"} until the new process is on air
+        self.recoveries = collections.deque(maxlen=20) # Measured time-to-recover
+        self.closed = False # Channel deleted, ends the monitor loop
+
+
+    def start(self, rtmp_url, backup_rtmp_url=None, stream_key=None, profile=None, renditions=None):
         with self.lock:
+            self.renditions = renditions or []
             self.rtmp_url = rtmp_url
             self.backup_rtmp_url = backup_rtmp_url
             self.stream_key = stream_key
+            self.profile = profile
             self.should_run = True
             self.last_heartbeat = time.time() # Reset on start
 
@@ -63,106 +190,400 @@ class StreamManager:
             if self.monitor_thread is None or not self.monitor_thread.is_alive():
                 self.monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
                 self.monitor_thread.start()
-                print("[StreamManager] Monitor loop started.")
+                print(f"{self.tag} Monitor loop started.")
 
     def stop(self):
         with self.lock:
             self.should_run = False
+            self.recovering = None
         self._kill_process()
+        self._kill_standby()
+        self.usage = {}
 
     def is_running(self):
         return self.process is not None and self.process.poll() is None
 
     def _monitor_loop(self):
-        while True:
+        while not self.closed:
             # Check if we should stop monitoring (only if main thread exits, but daemon handles that)
             # Actually we busy-wait check should_run
             if not self.should_run:
                 if self.process:
                     self._kill_process()
+                if self.standby:
+                    self._kill_standby()
                 time.sleep(2)
                 continue
 
-            if self.process is None or self.process.poll() is not None:
-                print(f"[StreamManager] Stream process not running. Restarting...")
+            if self.process is not None and self.process.poll() is not None:
+                print(f"{self.tag} Stream process exited ({self.process.returncode}).")
+                self._recover("process exited")
+            elif self.process is None:
+                print(f"{self.tag} Stream process not running. Restarting...")
                 self._start_process()
             
-            # Watchdog Check
-            now = time.time()
+            # Watchdog Check: frame progress, not log chatter
             if self.process and self.process.poll() is None:
-                # If no heartbeat/log for 30 seconds, restart
-                if now - self.last_heartbeat > 30:
-                    print(f"[StreamManager] Watchdog: No heartbeat for {now - self.last_heartbeat:.1f}s. Restarting stream...")
-                    self._log_to_file("Watchdog triggered: Stream stuck.")
-                    self._kill_process()
-                    # Loop will restart it in next iteration
+                problem = self._health_problem(time.time())
+                if problem:
+                    print(f"{self.tag} Watchdog: {problem}. Restarting stream...")
+                    self._log_to_file(f"Watchdog triggered: {problem}")
+                    self._recover("watchdog")
+
+            if HOT_STANDBY:
+                self._check_standby()
+
+            if time.time() - self.usage.get("at", 0) >= USAGE_INTERVAL:
+                self._sample_usage()
             
-            time.sleep(5)
+            time.sleep(1)
+
+    def _sample_usage(self):
+        now = time.time()
+        usage = {"at": now, "cpus": sorted(self.cpus) if self.cpus else None, "nice": self.nice,
+                 "cpu_percent": None, "rss_mb": None, "processes": 0, "standby_rss_mb": None}
+        process = self.process
+        if process and process.poll() is None:
+            cpu, rss, count = process_usage(process.pid)
+            last = self.usage_sample
+            if last and last[0] == process.pid and now > last[1]:
+                usage["cpu_percent"] = round(100.0 * (cpu - last[2]) / (now - last[1]), 1)
+            self.usage_sample = (process.pid, now, cpu)
+            usage["rss_mb"] = round(rss / 1048576, 1)
+            usage["processes"] = count
+        else:
+            self.usage_sample = None
+        standby = self.standby
+        if standby and standby.poll() is None:
+            usage["standby_rss_mb"] = round(process_usage(standby.pid)[1] / 1048576, 1)
+        self.usage = usage
+
+    def _apply_limits(self, process):
+        # Set from here right after exec (preexec_fn is unsafe in a threaded
+        # server). The interpreter has not started any threads yet, so its
+        # threads and the renderer process inherit both settings
+        try:
+            if self.nice:
+                os.setpriority(os.PRIO_PROCESS, process.pid, self.nice)
+            if self.cpus:
+                os.sched_setaffinity(process.pid, self.cpus)
+        except OSError as e:
+            self._log_to_file(f"Failed to apply CPU limits to {process.pid}: {e}")
+            print(f"{self.tag} CPU limits failed: {e}")
+
+    def _health_problem(self, now):
+        """Why the live process looks stuck, or None if it is making progress."""
+        if self.progress is None:
+            if now - self.process_started_at > WATCHDOG_STARTUP:
+                return f"no progress record {now - self.process_started_at:.0f}s after start"
+            return None
+        if now - self.last_progress > WATCHDOG_HEARTBEAT:
+            return f"no progress record for {now - self.last_progress:.1f}s"
+        if not self.progress["frames"]:
+            if now - self.process_started_at > WATCHDOG_STARTUP:
+                return f"no frame encoded {now - self.process_started_at:.0f}s after start"
+            return None
+        if now - self.last_frame_at > WATCHDOG_STALL:
+            return f"encoder stuck at frame {self.progress['frames']} for {now - self.last_frame_at:.1f}s"
+        return None
+
+    def _reset_progress(self):
+        now = time.time()
+        self.progress = None
+        self.last_progress = now
+        self.last_frame_at = now
+
+    def _read_progress(self, proc, fd):
+        # One JSON record per line from main.py's progress thread
+        try:
+            with os.fdopen(fd, "rb") as pipe:
+                for line in pipe:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    now = time.time()
+                    if proc is self.standby:
+                        self.standby_heartbeat = now
+                    elif proc is self.process:
+                        if self.progress is None or record.get("frames") != self.progress.get("frames"):
+                            self.last_frame_at = now
+                        self.progress = dict(record, received_at=now)
+                        self.last_progress = now
+        except Exception as e:
+            print(f"{self.tag} Progress reader error: {e}")
+
+    def _recover(self, reason):
+        # Time-to-recover runs from here until the replacement prints [ONAIR]
+        dark_since = self.last_frame_at if self.progress else self.process_started_at
+        self.recovering = {"since": time.time(), "dark_since": dark_since, "reason": reason}
+        if self._promote_standby():
+            self.recovering["mode"] = "standby"
+        else:
+            self.recovering["mode"] = "cold"
+            self._kill_process()
+            self._start_process()
 
     def _start_process(self):
+        process, control = self._spawn()
+        if process is None:
+            return
+        self.process = process
+        self.process_started_at = time.time()
+        self.last_heartbeat = time.time()
+        self._reset_progress()
+        with self.control_lock:
+            self.control = control
+        # Bring the new process up to date
+        self._replay_settings()
+
+    def _replay_settings(self):
+        """Re-send the runtime settings a freshly live process may not have."""
+        if self.schedule:
+            self.send_command("schedule", programs=self.schedule)
+        if self.music_volume is not None:
+            self.send_command("volume", music=self.music_volume)
+
+    def _spawn(self, standby=False):
+        """Start main.py, returns (process, control socket) or (None, None)."""
         env = os.environ.copy()
-        env["OVERLAY_URL"] = "http://127.0.0.1:8123/overlay"
+        env["OVERLAY_URL"] = self.overlay_url
+        env["STREAM_CHANNEL"] = self.name
+        env["RECORDINGS_DIR"] = self.recordings_dir
+        env["PREVIEW_FILE"] = self.preview_file
         
         if self.rtmp_url:
             env["RTMP_URL"] = self.rtmp_url
         if self.backup_rtmp_url:
             env["BACKUP_RTMP_URL"] = self.backup_rtmp_url
+        if self.profile:
+            env["STREAM_PROFILE"] = self.profile["name"]
+            for field, var in PROFILE_ENV.items():
+                if field in self.profile:
+                    env[var] = str(self.profile[field])
+        if self.renditions:
+            env["RENDITIONS"] = json.dumps(self.renditions)
+        if self.music_playlist is not None:
+            env["MUSIC_PLAYLIST"] = json.dumps(self.music_playlist)
+            
+        if standby:
+            env["STREAM_STANDBY"] = "1"
             
-        self._log_to_file(f"Starting stream process... RTMP={self.rtmp_url}")
+        profile_name = self.profile["name"] if self.profile else "default"
+        kind = "standby" if standby else "stream"
+        self._log_to_file(f"Starting {kind} process... RTMP={self.rtmp_url} PROFILE={profile_name}")
+
+        # Control channel: main.py watches its end on the GLib loop
+        control, child_control = socket.socketpair()
+        env["CONTROL_FD"] = str(child_control.fileno())
+        # Progress heartbeat side pipe
+        progress_read, progress_write = os.pipe()
+        env["HEARTBEAT_FD"] = str(progress_write)
 
         try:
-            self.process = subprocess.Popen(
+            process = subprocess.Popen(
                 [sys.executable, "-u", "main.py"], 
                 env=env,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                bufsize=1
+                bufsize=1,
+                pass_fds=(child_control.fileno(), progress_write)
             )
+            if self.nice or self.cpus:
+                self._apply_limits(process)
             
             # Start Log Reader for this process
-            t = threading.Thread(target=self._read_logs, args=(self.process,), daemon=True)
+            t = threading.Thread(target=self._read_logs, args=(process,), daemon=True)
             t.start()
+            threading.Thread(target=self._read_progress, args=(process, progress_read), daemon=True).start()
+
+            control.settimeout(2)
+            return process, control
             
         except Exception as e:
+            control.close()
+            os.close(progress_read)
             self._log_to_file(f"Failed to start process: {e}")
-            print(f"[StreamManager] Start failed: {e}")
+            print(f"{self.tag} Start failed: {e}")
+            return None, None
+        finally:
+            child_control.close()
+            os.close(progress_write)
+
+    def _check_standby(self):
+        now = time.time()
+        if self.standby is not None:
+            if self.standby.poll() is not None:
+                print(f"{self.tag} Standby process exited ({self.standby.returncode}).")
+                self._kill_standby()
+            elif now - self.standby_heartbeat > (WATCHDOG_HEARTBEAT if self.standby_ready else WATCHDOG_STARTUP):
+                print(f"{self.tag} Standby: no progress record for {now - self.standby_heartbeat:.1f}s, replacing it")
+                self._kill_standby()
+        # Spawn once the live process is settled so the two don't fight over startup CPU
+        if self.standby is None and self.is_running() and now - self.process_started_at > STANDBY_DELAY:
+            print(f"{self.tag} Starting warm standby...")
+            self.standby, self.standby_control = self._spawn(standby=True)
+            self.standby_ready = False
+            self.standby_heartbeat = now
+
+    def _promote_standby(self):
+        """Swap the prerolled standby in for the failed process. False if none is ready."""
+        standby = self.standby
+        if standby is None or not self.standby_ready or standby.poll() is not None:
+            return False
+        # Kill first: two processes must never publish to the same stream key
+        self._kill_process(force=True)
+        self.process = standby
+        self.process_started_at = time.time()
+        self.last_heartbeat = time.time()
+        self._reset_progress()
+        with self.control_lock:
+            self.control = self.standby_control
+        self.standby = None
+        self.standby_control = None
+        self.standby_ready = False
+        print(f"{self.tag} Failover: promoting warm standby")
+        self._log_to_file("Failover: promoting warm standby")
+        self.send_command("promote")
+        # The standby got its env when it was spawned, possibly before the
+        # last encoder, volume or music change
+        self._replay_settings()
+        if self.profile:
+            self.send_command("encoder", bitrate=self.profile.get("video_bitrate"),
+                              keyframe_interval=self.profile.get("keyframe_interval"))
+        if self.music_playlist is not None:
+            self.send_command("music", tracks=self.music_playlist)
+        return True
+
+    def _kill_standby(self):
+        standby, control = self.standby, self.standby_control
+        self.standby = None
+        self.standby_control = None
+        self.standby_ready = False
+        if control:
+            control.close()
+        if standby:
+            standby.kill()
+            standby.wait()
+
+    def _on_air(self):
+        recovering, self.recovering = self.recovering, None
+        if not recovering:
+            return
+        now = time.time()
+        record = {
+            "at": now,
+            "reason": recovering["reason"],
+            "mode": recovering["mode"],
+            "recover_ms": int((now - recovering["since"]) * 1000), # failure detected -> on air
+            "dark_s": round(now - recovering["dark_since"], 1) # last heartbeat of the failed process -> on air
+        }
+        self.recoveries.append(record)
+        message = (f"Recovered ({record['mode']}, {record['reason']}) in {record['recover_ms']} ms, "
+                   f"{record['dark_s']}s since the last heartbeat")
+        print(f"{self.tag} {message}")
+        self._log_to_file(message)
+
+    def send_command(self, cmd, **payload):
+        """Push a command to the live main.py. Returns False if no stream process is listening."""
+        message = (json.dumps(dict(payload, cmd=cmd), default=str) + "\n").encode("utf-8")
+        with self.control_lock:
+            if self.control is None:
+                return False
+            try:
+                self.control.sendall(message)
+                return True
+            except OSError as e:
+                # main.py is gone or stuck; the watchdog deals with the process
+                print(f"{self.tag} Control channel error: {e}")
+                self.control.close()
+                self.control = None
+                return False
+
+    def send_standby(self, cmd, **payload):
+        """Keep the warm standby in step with settings it would otherwise only get from env."""
+        message = (json.dumps(dict(payload, cmd=cmd), default=str) + "\n").encode("utf-8")
+        with self.control_lock:
+            if self.standby_control is None:
+                return False
+            try:
+                self.standby_control.sendall(message)
+                return True
+            except OSError as e:
+                print(f"{self.tag} Standby control channel error: {e}")
+                return False
+
+    def set_schedule(self, programs):
+        self.schedule = programs
+        self.send_command("schedule", programs=programs)
+
+    def _close_control(self):
+        with self.control_lock:
+            if self.control:
+                self.control.close()
+                self.control = None
 
     def _read_logs(self, proc):
         try:
             for line in iter(proc.stdout.readline, b''):
                 decoded_line = line.decode('utf-8').strip()
-                if decoded_line:
+                if decoded_line and proc is not self.process:
+                    # Warm standby (or a process that was just replaced):
+                    # only liveness and readiness matter until it is promoted
+                    if proc is self.standby:
+                        if decoded_line.startswith("[STANDBY] ready"):
+                            self.standby_ready = True
+                            print(f"{self.tag} Warm standby ready")
+                        elif not decoded_line.startswith("[STATS] "):
+                            self._log_to_file(f"[STANDBY] {decoded_line}")
+                elif decoded_line:
                     # Update Heartbeat
                     self.last_heartbeat = time.time()
+
+                    if decoded_line.startswith("[ONAIR]"):
+                        self._on_air()
+
+                    # Structured stats are kept for the API, not logged
+                    if decoded_line.startswith("[STATS] "):
+                        try:
+                            self.stats = json.loads(decoded_line[len("[STATS] "):])
+                            self.stats["received_at"] = self.last_heartbeat
+                            if "pipeline" in self.stats:
+                                self.metrics.append(dict(self.stats["pipeline"], at=self.last_heartbeat))
+                        except ValueError:
+                            pass
+                        continue
                     
+                    if self.name != DEFAULT_CHANNEL:
+                        decoded_line = f"[{self.name}] {decoded_line}"
                     # Console
                     print(f"[STREAM] {decoded_line}")
-                    # WebSocket Queue
-                    log_queue.put(decoded_line)
-                    # File
-                    self._log_to_file(decoded_line)
+                    # File, recent lines and WebSocket clients (all buffered)
+                    stream_log.add(decoded_line)
         except Exception as e:
-            print(f"[StreamManager] Log reader error: {e}")
+            print(f"{self.tag} Log reader error: {e}")
         finally:
             proc.stdout.close()
 
-    def _kill_process(self):
+    def _kill_process(self, force=False):
+        self._close_control()
         if self.process:
-            print("[StreamManager] Stopping stream process...")
-            self.process.terminate()
-            try:
-                self.process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
+            print(f"{self.tag} Stopping stream process...")
+            if force:
                 self.process.kill()
+                self.process.wait()
+            else:
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
             self.process = None
 
     def _log_to_file(self, message):
-        try:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            with open(self.log_file, "a", encoding="utf-8") as f:
-                f.write(f"[{timestamp}] {message}\n")
-        except Exception as e:
-            print(f"Failed to write to log file: {e}")
+        if self.name != DEFAULT_CHANNEL:
+            message = f"[{self.name}] {message}"
+        stream_log.write(message)
 
 class YouTubeStreamResolver:
     def __init__(self):
@@ -201,84 +622,103 @@ class YouTubeStreamResolver:
             print(f"[YouTubeResolver] Error: {e}")
             return None
 
-stream_manager = StreamManager()
-youtube_resolver = YouTubeStreamResolver()
+def parse_cpus(value):
+    if not value:
+        return None
+    return {int(c) for c in str(value).split(',') if c.strip()}
 
-def handle_new_votes(votes):
-    """Callback from vote_collector when new votes are detected."""
-    # Since vote_collector runs in a thread, we need a way to 
-    # run broadcast (which is async) in the main event loop.
-    try:
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            for vote in votes:
-                asyncio.run_coroutine_threadsafe(
-                    broadcast_news_update("NEW_VOTE", vote), 
-                    loop
-                )
-    except Exception as e:
-        print(f"[Server] Error handling new votes: {e}")
+class ChannelPool:
+    """StreamManagers by channel name, definitions kept in SystemConfig "channels"."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.managers = {DEFAULT_CHANNEL: StreamManager(DEFAULT_CHANNEL)}
+        self.settings = {} # name -> ChannelConfig dict
 
-vote_collector.on_new_vote = handle_new_votes
+    def get(self, name):
+        return self.managers.get(name or DEFAULT_CHANNEL)
 
-async def broadcast_logs():
-    """Background task to broadcast logs to all connected websockets."""
-    while True:
+    def all(self):
+        with self.lock:
+            return list(self.managers.values())
+
+    def load(self, db):
+        item = db.query(SystemConfig).filter(SystemConfig.key == "channels").first()
         try:
-            try:
-                log_line = log_queue.get_nowait()
-                msg = json.dumps({"log": log_line})
-                to_remove = []
-                for ws in connected_websockets:
-                    try:
-                        await ws.send_text(msg)
-                    except Exception:
-                        to_remove.append(ws)
-                
-                for ws in to_remove:
-                    if ws in connected_websockets:
-                        connected_websockets.remove(ws)
-            except queue.Empty:
-                await asyncio.sleep(0.5)
-        except Exception as e:
-            print(f"Error in broadcast loop: {e}")
-            await asyncio.sleep(1)
+            stored = json.loads(item.value) if item and item.value else {}
+        except ValueError:
+            stored = {}
+        for settings in stored.values():
+            self.define(settings)
+
+    def save(self, db):
+        with self.lock:
+            value = json.dumps(self.settings)
+        item = db.query(SystemConfig).filter(SystemConfig.key == "channels").first()
+        if item:
+            item.value = value
+        else:
+            db.add(SystemConfig(key="channels", value=value))
+        db.commit()
+
+    def define(self, settings):
+        name = settings["name"]
+        with self.lock:
+            manager = self.managers.get(name)
+            if manager is None:
+                manager = self.managers[name] = StreamManager(name)
+            self.settings[name] = settings
+        # Applied on the next (re)start of the channel's processes
+        manager.cpus = parse_cpus(settings.get("cpus"))
+        manager.nice = settings.get("nice")
+        return manager
+
+    def remove(self, name):
+        with self.lock:
+            manager = self.managers.pop(name, None)
+            self.settings.pop(name, None)
+        if manager:
+            manager.stop()
+            manager.closed = True
+        return manager
+
+channels = ChannelPool()
+stream_manager = channels.get(DEFAULT_CHANNEL) # /api/stream/* controls the default channel
+youtube_resolver = YouTubeStreamResolver()
+
+# Votes reach the overlays as one NEW_VOTES message per VOTE_BATCH_WINDOW
+# seconds with the totals and at most VOTE_DISPLAY_MAX voters to animate
+vote_batcher = VoteBatcher(lambda type, data: broadcast_news_update(type, data),
+                           window=VOTE_BATCH_WINDOW, max_display=VOTE_DISPLAY_MAX)
+
+def handle_new_votes(votes, counts=None):
+    """Callback from vote_collector (its own thread) when new votes are detected."""
+    if not vote_batcher.submit(votes, counts):
+        print(f"[Server] Event loop not ready, {len(votes)} vote(s) not broadcast")
+
+vote_collector.on_new_vote = handle_new_votes
 
 # Broadcast helper for news
-async def broadcast_news_update(type: str, data: dict):
-    payload = json.dumps({"type": type, "payload": data})
-    to_remove = []
-    for ws in news_websockets:
-        try:
-            await ws.send_text(payload)
-        except Exception:
-            to_remove.append(ws)
-    for ws in to_remove:
-        news_websockets.remove(ws)
+async def broadcast_news_update(type: str, data: dict, channel: Optional[str] = None):
+    # channel: only that channel's overlay acts on it, None = every channel
+    message = {"type": type, "payload": data}
+    if channel:
+        message["channel"] = channel
+    # Serialized once; queued per client, never awaited on a slow one
+    news_broadcaster.publish(json.dumps(message))
 
 # WebSocket for Logs
 @app.websocket("/ws/logs")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    connected_websockets.append(websocket)
-    try:
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        if websocket in connected_websockets:
-            connected_websockets.remove(websocket)
+    # Recent lines first, then one batched frame per interval; a lagging
+    # client loses frames instead of holding memory
+    await stream_log.serve(websocket)
 
 # WebSocket for News Updates (Real-time Overlay)
 @app.websocket("/ws/news")
 async def news_websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    news_websockets.append(websocket)
-    try:
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        if websocket in news_websockets:
-            news_websockets.remove(websocket)
+    await news_broadcaster.serve(websocket)
 
 def apply_content_filters(text: str, filters: List[str]) -> str:
     """Removes blocked words/symbols from text (case-insensitive)."""
@@ -338,14 +778,17 @@ async def startup_event():
     
     db.commit()
     print("[System] Checked and loaded default Tamil RSS feeds.")
+    channels.load(db)
     db.close()
 
     # Start Services
+    vote_batcher.attach(asyncio.get_running_loop()) # before the collector can submit
     vote_collector.start()
 
     # Sync tasks
-    asyncio.create_task(broadcast_logs())
+    asyncio.create_task(stream_log.run()) # Batched /ws/logs frames
     asyncio.create_task(sync_rss_feeds()) # Start RSS Sync
+    asyncio.create_task(program_scheduler()) # Push program switches to main.py
 
 # Enable CORS
 app.add_middleware(
@@ -475,10 +918,18 @@ class ConfigUpdate(BaseModel):
     lbar_content_type: Optional[str] = None # IMAGE, URL, HTML
     lbar_content_data: Optional[str] = None
 
+def channel_config_key(channel, key):
+    # Per-channel overrides sit next to the shared keys in SystemConfig
+    return f"channel:{channel}:{key}" if channel else key
+
 @app.get("/api/config")
-def get_config(db: Session = Depends(get_db)):
+def get_config(channel: Optional[str] = None, db: Session = Depends(get_db)):
     # Helper to get value or default
     def get_val(key, default):
+        if channel:
+            item = db.query(SystemConfig).filter(SystemConfig.key == channel_config_key(channel, key)).first()
+            if item:
+                return item.value
         item = db.query(SystemConfig).filter(SystemConfig.key == key).first()
         return item.value if item else default
 
@@ -503,9 +954,14 @@ def get_config(db: Session = Depends(get_db)):
     }
 
 @app.post("/api/config")
-async def update_config(conf: ConfigUpdate, db: Session = Depends(get_db)):
+async def update_config(conf: ConfigUpdate, channel: Optional[str] = None, db: Session = Depends(get_db)):
+    # channel: override the values for that channel only
+    if channel and channels.get(channel) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown channel: {channel}")
+
     def set_val(key, val):
         if val is None: return
+        key = channel_config_key(channel, key)
         item = db.query(SystemConfig).filter(SystemConfig.key == key).first()
         if not item:
             item = SystemConfig(key=key, value=str(val))
@@ -535,7 +991,9 @@ async def update_config(conf: ConfigUpdate, db: Session = Depends(get_db)):
     db.commit()
     
     # Broadcast to Overlay
-    await broadcast_news_update("CONFIG_UPDATED", conf.dict(exclude_none=True))
+    await broadcast_news_update("CONFIG_UPDATED", conf.dict(exclude_none=True), channel)
+    for manager in ([channels.get(channel)] if channel else channels.all()):
+        manager.send_command("config", config=conf.dict(exclude_none=True))
     
     return {"status": "success"}
 
@@ -553,6 +1011,7 @@ class NewsCreate(BaseModel):
     source_url: Optional[str] = None
     external_id: Optional[str] = None
     media_url: Optional[str] = None
+    channel: Optional[str] = None # None = every channel
 
 class NewsUpdate(BaseModel):
     title_tamil: Optional[str] = None
@@ -564,6 +1023,7 @@ class NewsUpdate(BaseModel):
     source: Optional[str] = None
     source_url: Optional[str] = None
     media_url: Optional[str] = None
+    channel: Optional[str] = None # "" = back to every channel
 
 class ExternalFetchRequest(BaseModel):
     url: str
@@ -806,6 +1266,8 @@ class ProgramCreate(BaseModel):
     start_time: datetime.datetime
     end_time: datetime.datetime
     is_active: bool = True
+    clips: Optional[List[str]] = None # Rundown played in order (video_path if empty)
+    loop: bool = True # Repeat the rundown to fill the slot
 
 @app.get("/api/programs")
 def get_programs(db: Session = Depends(get_db)):
@@ -819,10 +1281,17 @@ def create_program(prog: ProgramCreate, db: Session = Depends(get_db)):
     # Validate times
     if prog.end_time <= prog.start_time:
          raise HTTPException(status_code=400, detail="End time must be after start time")
+    clips = [c.strip() for c in prog.clips or [] if c.strip()] or [prog.video_path]
+    for clip in clips:
+        # URLs are checked by main.py once the program is scheduled
+        if "://" not in clip and not os.path.isfile(os.path.abspath(clip)):
+             raise HTTPException(status_code=400, detail=f"Video file not found: {clip}")
 
     db_prog = Program(
         title=prog.title,
-        video_path=prog.video_path,
+        video_path=clips[0],
+        clips=json.dumps(clips) if len(clips) > 1 else None,
+        loop=prog.loop,
         start_time=prog.start_time,
         end_time=prog.end_time,
         is_active=prog.is_active
@@ -830,6 +1299,7 @@ def create_program(prog: ProgramCreate, db: Session = Depends(get_db)):
     db.add(db_prog)
     db.commit()
     db.refresh(db_prog)
+    notify_schedule_changed()
     return db_prog
 
 @app.delete("/api/programs/{prog_id}")
@@ -838,13 +1308,14 @@ def delete_program(prog_id: int, db: Session = Depends(get_db)):
     if prog:
         db.delete(prog)
         db.commit()
+        notify_schedule_changed()
     return {"status": "success"}
 
 @app.get("/api/programs/current")
 def get_current_program(db: Session = Depends(get_db)):
     """
     Returns the program that should be playing NOW.
-    Used by main.py to switch streams.
+    Used by program_scheduler (and by main.py when run without the server).
     """
     now = datetime.datetime.utcnow()
     prog = db.query(Program).filter(
@@ -857,6 +1328,65 @@ def get_current_program(db: Session = Depends(get_db)):
         return prog
     return None # No active program
 
+# --- Program Scheduler ---
+# Pushes the upcoming programs to main.py over the control channel whenever
+# the list changes. main.py validates the files, prerolls each program
+# PROGRAM_PREROLL seconds early and switches at the exact start time.
+SCHEDULE_AHEAD = 10 # programs sent to main.py
+schedule_loop = None
+program_schedule_changed = None
+
+def notify_schedule_changed():
+    # Safe to call from the sync endpoints (threadpool)
+    if schedule_loop and program_schedule_changed:
+        schedule_loop.call_soon_threadsafe(program_schedule_changed.set)
+
+def program_payload(prog):
+    return {
+        "id": prog.id,
+        "title": prog.title,
+        "video_path": prog.video_path,
+        "clips": json.loads(prog.clips) if prog.clips else [prog.video_path],
+        "loop": prog.loop is not False,
+        "start_time": prog.start_time.isoformat(),
+        "end_time": prog.end_time.isoformat()
+    }
+
+async def program_scheduler():
+    global schedule_loop, program_schedule_changed
+    schedule_loop = asyncio.get_running_loop()
+    program_schedule_changed = asyncio.Event()
+    while True:
+        program_schedule_changed.clear()
+        delay = 60
+        db = SessionLocal()
+        try:
+            now = datetime.datetime.utcnow()
+            programs = db.query(Program).filter(
+                Program.is_active == True,
+                Program.end_time > now
+            ).order_by(Program.start_time).limit(SCHEDULE_AHEAD).all()
+            payload = [program_payload(p) for p in programs]
+            # Programs are shared, every channel runs the same schedule
+            for manager in channels.all():
+                if payload != manager.schedule:
+                    print(f"[Scheduler] Schedule updated for {manager.name}: {len(payload)} upcoming program(s)")
+                    manager.set_schedule(payload)
+
+            # Wake up when the first program drops off the list
+            if programs:
+                delay = min(delay, (programs[0].end_time - now).total_seconds())
+        except Exception as e:
+            print(f"[Scheduler] Error: {e}")
+            delay = 5
+        finally:
+            db.close()
+
+        try:
+            await asyncio.wait_for(program_schedule_changed.wait(), timeout=max(delay, 0.05))
+        except asyncio.TimeoutError:
+            pass
+
 @app.get("/api/ads/active")
 def get_active_ads(db: Session = Depends(get_db)):
     """
@@ -890,9 +1420,13 @@ def get_active_ads(db: Session = Depends(get_db)):
 # --- News Management API ---
 
 @app.get("/api/news")
-def get_news(db: Session = Depends(get_db)):
-    # Return all active news sorted by priority and date
-    items = db.query(NewsItem).filter(NewsItem.is_active == True).order_by(NewsItem.priority.desc(), NewsItem.created_at.desc()).all()
+def get_news(channel: Optional[str] = None, db: Session = Depends(get_db)):
+    # Return all active news for the channel (its own and shared) sorted by priority and date
+    channel = channel or DEFAULT_CHANNEL
+    items = db.query(NewsItem).filter(
+        NewsItem.is_active == True,
+        (NewsItem.channel == None) | (NewsItem.channel == channel)
+    ).order_by(NewsItem.priority.desc(), NewsItem.created_at.desc()).all()
     return items
 
 @app.post("/api/news")
@@ -900,6 +1434,8 @@ async def create_news(item: NewsCreate, db: Session = Depends(get_db)):
     # Validate Title Length
     if len(item.title_tamil.split()) <= 3:
         raise HTTPException(status_code=400, detail="Headline too short (must be > 3 words)")
+    if item.channel and channels.get(item.channel) is None:
+        raise HTTPException(status_code=400, detail=f"Unknown channel: {item.channel}")
 
     db_item = NewsItem(
         title_tamil=item.title_tamil,
@@ -912,7 +1448,8 @@ async def create_news(item: NewsCreate, db: Session = Depends(get_db)):
         source=item.source,
         source_url=item.source_url,
         external_id=item.external_id,
-        media_url=item.media_url
+        media_url=item.media_url,
+        channel=item.channel or None
     )
     db.add(db_item)
     db.commit()
@@ -920,7 +1457,7 @@ async def create_news(item: NewsCreate, db: Session = Depends(get_db)):
     
     # Notify Overlay via WebSocket (only if active)
     if db_item.is_active:
-        await broadcast_news_update("NEWS_ADDED", {"id": db_item.id, "title": db_item.title_tamil, "type": db_item.type})
+        await broadcast_news_update("NEWS_ADDED", {"id": db_item.id, "title": db_item.title_tamil, "type": db_item.type}, db_item.channel)
     else:
         # If Pending/Draft, send notification for approval
         send_ntfy_approval_request(db_item)
@@ -941,11 +1478,15 @@ async def update_news(news_id: int, item: NewsUpdate, db: Session = Depends(get_
     if item.source is not None: db_item.source = item.source
     if item.source_url is not None: db_item.source_url = item.source_url
     if item.media_url is not None: db_item.media_url = item.media_url
+    # Moving an item between channels: both overlays have to refresh
+    previous_channel = db_item.channel
+    if item.channel is not None: db_item.channel = item.channel or None
     
     db.commit()
     db.refresh(db_item)
     
-    await broadcast_news_update("NEWS_UPDATED", {"id": db_item.id, "active": db_item.is_active})
+    scope = db_item.channel if db_item.channel == previous_channel else None
+    await broadcast_news_update("NEWS_UPDATED", {"id": db_item.id, "active": db_item.is_active}, scope)
     return db_item
 
 @app.delete("/api/news/{news_id}")
@@ -975,7 +1516,7 @@ async def approve_news_item(news_id: int, db: Session = Depends(get_db)):
     db_item.is_active = True
     db.commit()
     
-    await broadcast_news_update("NEWS_ADDED", {"id": db_item.id, "title": db_item.title_tamil, "type": db_item.type})
+    await broadcast_news_update("NEWS_ADDED", {"id": db_item.id, "title": db_item.title_tamil, "type": db_item.type}, db_item.channel)
     return {"status": "approved", "is_active": True}
 
 @app.post("/api/admin/news/{news_id}/reject")
@@ -992,7 +1533,7 @@ async def reject_news_item(news_id: int, db: Session = Depends(get_db)):
     db_item.is_active = False
     db.commit()
     
-    await broadcast_news_update("NEWS_REMOVED", {"id": db_item.id}) # Just in case it was active
+    await broadcast_news_update("NEWS_REMOVED", {"id": db_item.id}, db_item.channel) # Just in case it was active
     return {"status": "rejected", "is_active": False}
 
 
@@ -1004,8 +1545,43 @@ class DuckRequest(BaseModel):
 
 @app.post("/api/stream/duck")
 def trigger_duck(req: DuckRequest):
-    # Backward compatibility or manual ducking
-    pass
+    # Manual ducking of the background music
+    volume = 0.2 if req.state == "duck" else 1.0
+    stream_manager.music_volume = volume
+    sent = stream_manager.send_command("volume", music=volume)
+    return {"status": "sent" if sent else "not_running", "music": volume}
+
+class VolumeUpdate(BaseModel):
+    music: float
+
+@app.post("/api/stream/volume")
+def set_stream_volume(req: VolumeUpdate):
+    if not (0.0 <= req.music <= 2.0):
+        raise HTTPException(status_code=400, detail="Volume must be between 0.0 and 2.0")
+    stream_manager.music_volume = req.music
+    sent = stream_manager.send_command("volume", music=req.music)
+    return {"status": "sent" if sent else "not_running", "music": req.music}
+
+def media_file(path):
+    # Only uploaded media: files go straight to a decoder in main.py
+    media_dir = os.path.realpath("media")
+    file = path[1:] if path.startswith("/media/") else path
+    file_path = os.path.realpath(file)
+    if os.path.commonpath([file_path, media_dir]) != media_dir:
+        raise HTTPException(status_code=400, detail=f"Audio file must be in media/: {path}")
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail=f"Audio file not found: {path}")
+    return file_path
+
+class TTSRequest(BaseModel):
+    file: str
+
+@app.post("/api/stream/tts")
+def trigger_tts(req: TTSRequest):
+    """Plays an audio file over the ducked music bed (skipped while a program runs)."""
+    file_path = media_file(req.file)
+    sent = stream_manager.send_command("tts", file=file_path)
+    return {"status": "sent" if sent else "not_running"}
 
 
 def send_ntfy_approval_request(item):
@@ -1055,7 +1631,7 @@ async def show_news_on_screen(news_id: int, db: Session = Depends(get_db)):
         "description": db_item.title_english or "" # Use english title as description fallback? Or just Title.
     }
     
-    await broadcast_news_update("SHOW_NEWS_MAIN", payload)
+    await broadcast_news_update("SHOW_NEWS_MAIN", payload, db_item.channel)
     return {"status": "success"}
 
 # --- Filter Management API ---
@@ -1088,14 +1664,100 @@ def set_filters(data: FilterConfig, db: Session = Depends(get_db)):
     db.commit()
     return {"status": "success", "filters": data.filters}
 
+# --- Output Profiles API ---
+X264_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow")
+
+# Bounds keep a saved profile negotiable: a bad one would fail caps on every
+# (watchdog) restart of main.py. I420 needs even dimensions.
+class OutputProfile(BaseModel):
+    name: str
+    width: int = Field(1280, ge=160, le=3840, multiple_of=2)
+    height: int = Field(720, ge=120, le=2160, multiple_of=2)
+    framerate: int = Field(15, ge=1, le=60)
+    video_bitrate: int = Field(2500, ge=100, le=50000) # kbit/s
+    keyframe_interval: int = Field(40, ge=1, le=600) # frames
+    x264_preset: str = "ultrafast" # one of X264_PRESETS
+    threads: int = Field(0, ge=0, le=64) # 0 = detected core count
+    audio_bitrate: int = Field(128000, ge=16000, le=320000) # bit/s
+
+def load_output_profiles(db: Session):
+    profiles = {name: dict(p) for name, p in OUTPUT_PROFILES.items()}
+    stored = db.query(SystemConfig).filter(SystemConfig.key == "output_profiles").first()
+    if stored and stored.value:
+        try:
+            # Built-in profiles can't be replaced (older versions allowed it)
+            profiles.update({name: p for name, p in json.loads(stored.value).items() if name not in OUTPUT_PROFILES})
+        except:
+            pass
+    return profiles
+
+def get_selected_profile_name(db: Session):
+    item = db.query(SystemConfig).filter(SystemConfig.key == "output_profile").first()
+    return item.value if item and item.value else DEFAULT_OUTPUT_PROFILE
+
+@app.get("/api/config/profiles")
+def get_output_profiles(db: Session = Depends(get_db)):
+    return {"selected": get_selected_profile_name(db), "profiles": load_output_profiles(db)}
+
+@app.post("/api/config/profiles")
+def save_output_profile(profile: OutputProfile, db: Session = Depends(get_db)):
+    if profile.name in OUTPUT_PROFILES:
+        raise HTTPException(status_code=400, detail=f"{profile.name} is a built-in profile, save it under another name")
+    if profile.x264_preset not in X264_PRESETS:
+        raise HTTPException(status_code=400, detail=f"x264_preset must be one of {', '.join(X264_PRESETS)}")
+    stored = db.query(SystemConfig).filter(SystemConfig.key == "output_profiles").first()
+    custom = {}
+    if stored and stored.value:
+        try:
+            custom = json.loads(stored.value)
+        except:
+            custom = {}
+
+    data = profile.dict()
+    name = data.pop("name")
+    custom[name] = data
+
+    if stored:
+        stored.value = json.dumps(custom)
+    else:
+        db.add(SystemConfig(key="output_profiles", value=json.dumps(custom)))
+    db.commit()
+    return {"status": "success", "name": name, "profile": data}
+
 # --- Stream Control API ---
+class Rendition(BaseModel):
+    name: str # e.g. "480p"
+    width: int = Field(..., ge=160, le=3840, multiple_of=2) # at most the profile's size, see check_renditions
+    height: int = Field(..., ge=120, le=2160, multiple_of=2)
+    video_bitrate: int = Field(..., ge=100, le=50000) # kbit/s
+    rtmp_url: str # rtmp:// or rtmps://
+
+def check_renditions(renditions, profile):
+    """400 for a ladder main.py could not build from the profile's composite."""
+    names = set()
+    for r in renditions or []:
+        if r.name in names:
+            raise HTTPException(status_code=400, detail=f"Duplicate rendition name: {r.name}")
+        names.add(r.name)
+        if r.width > profile["width"] or r.height > profile["height"]:
+            raise HTTPException(status_code=400, detail=f"Rendition {r.name} is larger than the "
+                                f"{profile['width']}x{profile['height']} program")
+        if not r.rtmp_url.startswith(("rtmp://", "rtmps://")):
+            raise HTTPException(status_code=400, detail=f"Rendition {r.name}: rtmp_url must start with rtmp:// or rtmps://")
+
 class StreamConfig(BaseModel):
     rtmp_url: Optional[str] = None
     backup_rtmp_url: Optional[str] = None
     stream_key: Optional[str] = None
+    profile: Optional[str] = None # Output profile name, defaults to the last used one
+    renditions: Optional[List[Rendition]] = None # Extra bitrate ladder outputs
+
+class EncoderUpdate(BaseModel):
+    bitrate: Optional[int] = None # kbit/s
+    keyframe_interval: Optional[int] = None # frames
 
 @app.post("/api/stream/start")
-def start_stream(config: StreamConfig):
+def start_stream(config: StreamConfig, db: Session = Depends(get_db)):
     # Persist the stream key if provided
     if config.stream_key:
         if os.path.exists(OVERLAY_FILE):
@@ -1114,15 +1776,103 @@ def start_stream(config: StreamConfig):
     
     if stream_manager.is_running():
         return {"status": "already_running"}
+
+    # Resolve Output Profile
+    profiles = load_output_profiles(db)
+    profile_name = config.profile or get_selected_profile_name(db)
+    if profile_name not in profiles:
+        raise HTTPException(status_code=400, detail=f"Unknown output profile: {profile_name}")
+    check_renditions(config.renditions, profiles[profile_name])
+
+    selected = db.query(SystemConfig).filter(SystemConfig.key == "output_profile").first()
+    if selected:
+        selected.value = profile_name
+    else:
+        db.add(SystemConfig(key="output_profile", value=profile_name))
+    db.commit()
+
+    profile = dict(profiles[profile_name], name=profile_name)
+    stream_manager.music_playlist = load_music_playlist(db)
     
     # Start Manager
     stream_manager.start(
         rtmp_url=config.rtmp_url, 
         backup_rtmp_url=config.backup_rtmp_url,
-        stream_key=config.stream_key
+        stream_key=config.stream_key,
+        profile=profile,
+        renditions=[r.dict() for r in config.renditions or []]
     )
     
-    return {"status": "started"}
+    return {"status": "started", "profile": profile_name}
+
+@app.post("/api/stream/encoder")
+def update_encoder(update: EncoderUpdate):
+    """
+    Adjusts bitrate / keyframe interval of the running encoder without a restart.
+    The values are also kept in the active profile so watchdog restarts reuse them.
+    """
+    if update.bitrate is not None and not (100 <= update.bitrate <= 50000):
+        raise HTTPException(status_code=400, detail="Bitrate must be between 100 and 50000 kbit/s")
+    if update.keyframe_interval is not None and not (1 <= update.keyframe_interval <= 600):
+        raise HTTPException(status_code=400, detail="Keyframe interval must be between 1 and 600 frames")
+
+    if stream_manager.profile:
+        if update.bitrate is not None:
+            stream_manager.profile["video_bitrate"] = update.bitrate
+        if update.keyframe_interval is not None:
+            stream_manager.profile["keyframe_interval"] = update.keyframe_interval
+
+    sent = stream_manager.send_command("encoder", bitrate=update.bitrate, keyframe_interval=update.keyframe_interval)
+    return {"status": "applied" if sent else "saved", "running": stream_manager.is_running()}
+
+# --- Music Bed ---
+# Stored in SystemConfig "music_playlist"; main.py decodes the tracks once
+# and loops them from memory.
+MUSIC_EXTENSIONS = (".mp3", ".wav", ".ogg", ".m4a", ".aac", ".flac")
+
+class MusicPlaylist(BaseModel):
+    tracks: List[str]
+
+def load_music_playlist(db: Session):
+    item = db.query(SystemConfig).filter(SystemConfig.key == "music_playlist").first()
+    if not item:
+        return None
+    tracks = []
+    for track in json.loads(item.value):
+        try:
+            tracks.append(media_file(track))
+        except HTTPException as e:
+            print(f"Music playlist: dropping {track} ({e.detail})") # Saved before the media/ rule
+    return tracks
+
+@app.get("/api/stream/music")
+def get_music_playlist(db: Session = Depends(get_db)):
+    available = []
+    if os.path.exists("media"):
+        available = [f"media/{f}" for f in sorted(os.listdir("media")) if f.lower().endswith(MUSIC_EXTENSIONS)]
+    return {"playlist": load_music_playlist(db), "available": available}
+
+@app.post("/api/stream/music")
+def set_music_playlist(playlist: MusicPlaylist, db: Session = Depends(get_db)):
+    tracks = []
+    for track in (t.strip() for t in playlist.tracks):
+        if track:
+            tracks.append(media_file(track))
+
+    item = db.query(SystemConfig).filter(SystemConfig.key == "music_playlist").first()
+    if item:
+        item.value = json.dumps(tracks)
+    else:
+        db.add(SystemConfig(key="music_playlist", value=json.dumps(tracks)))
+    db.commit()
+
+    # The music bed is shared by every channel
+    sent = False
+    for manager in channels.all():
+        manager.music_playlist = tracks
+        sent = manager.send_command("music", tracks=tracks) or sent
+        manager.send_standby("music", tracks=tracks)
+    return {"status": "applied" if sent else "saved", "playlist": tracks}
 
 @app.post("/api/stream/stop")
 def stop_stream():
@@ -1133,6 +1883,253 @@ def stop_stream():
 def get_status():
     return {"running": stream_manager.is_running()}
 
+@app.get("/api/stream/stats")
+def get_stream_stats():
+    """Latest pipeline stats reported by main.py (overlay ring counters etc)."""
+    return {
+        "running": stream_manager.is_running(),
+        "stats": stream_manager.stats,
+        "progress": stream_manager.progress,
+        "standby": {"enabled": HOT_STANDBY, "ready": stream_manager.standby_ready},
+        "log": stream_log.stats(),
+        "usage": stream_manager.usage,
+        "recoveries": list(stream_manager.recoveries)
+    }
+
+@app.get("/api/websockets")
+def get_websocket_stats():
+    """Per-client queue depth and lag of the /ws/news and /ws/logs fan-outs."""
+    return {"news": news_broadcaster.stats(), "logs": stream_log.clients.stats()}
+
+@app.get("/api/stream/metrics")
+def get_stream_metrics(history: int = Query(60, ge=0, le=METRICS_HISTORY)):
+    """Pipeline telemetry: fps, encode time, queue fill, output throughput, drops."""
+    samples = list(stream_manager.metrics)
+    return {
+        "running": stream_manager.is_running(),
+        "latest": samples[-1] if samples else None,
+        "history": samples[-history:] if history else []
+    }
+
+@app.get("/api/stream/preview.jpg")
+def get_stream_preview(channel: Optional[str] = None, if_none_match: Optional[str] = Header(None)):
+    """Latest on-air frame. Cached in memory and by ETag, so viewers add no pipeline work."""
+    manager = get_channel_or_404(channel)
+    if not manager.is_running():
+        raise HTTPException(status_code=404, detail="Stream is off air")
+    path = manager.preview_file
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        raise HTTPException(status_code=404, detail="No preview yet")
+    with preview_lock:
+        cached = preview_cache.setdefault(path, {"mtime": None, "data": None, "etag": None})
+        if cached["mtime"] != mtime:
+            try:
+                with open(path, "rb") as f:
+                    cached["data"] = f.read()
+            except OSError:
+                raise HTTPException(status_code=404, detail="No preview yet")
+            cached["mtime"] = mtime
+            cached["etag"] = f'"{mtime:x}"'
+        data, etag = cached["data"], cached["etag"]
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+# --- Channels ---
+class ChannelConfig(BaseModel):
+    name: str # lowercase, used in the overlay URL and log lines
+    rtmp_url: Optional[str] = None
+    backup_rtmp_url: Optional[str] = None
+    stream_key: Optional[str] = None
+    profile: Optional[str] = None # Output profile name, defaults to the selected one
+    renditions: Optional[List[Rendition]] = None
+    cpus: Optional[str] = None # CPU set for the channel's processes, e.g. "2,3"
+    nice: Optional[int] = None # 0-19, added to the channel's scheduling priority
+
+def channel_summary(manager):
+    return {
+        "name": manager.name,
+        "running": manager.is_running(),
+        "overlay_url": manager.overlay_url,
+        "settings": channels.settings.get(manager.name),
+        "usage": manager.usage,
+        "frames": manager.progress["frames"] if manager.progress else None,
+        "standby_ready": manager.standby_ready
+    }
+
+def get_channel_or_404(name):
+    manager = channels.get(name)
+    if manager is None:
+        raise HTTPException(status_code=404, detail=f"Unknown channel: {name}")
+    return manager
+
+@app.get("/api/channels")
+def get_channels():
+    """Every channel with its settings, state and CPU / memory usage."""
+    return [channel_summary(m) for m in channels.all()]
+
+@app.post("/api/channels")
+def save_channel(channel: ChannelConfig, db: Session = Depends(get_db)):
+    """Creates or updates a channel. Output, CPU and nice changes apply on its next start."""
+    if not CHANNEL_NAME.match(channel.name):
+        raise HTTPException(status_code=400, detail="Channel name must be lowercase letters, digits, - or _")
+    profiles = load_output_profiles(db)
+    profile_name = channel.profile or get_selected_profile_name(db)
+    if profile_name not in profiles:
+        raise HTTPException(status_code=400, detail=f"Unknown output profile: {profile_name}")
+    check_renditions(channel.renditions, profiles[profile_name])
+    if channel.nice is not None and not (0 <= channel.nice <= 19):
+        raise HTTPException(status_code=400, detail="Nice must be between 0 and 19")
+    try:
+        cpus = parse_cpus(channel.cpus)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="CPUs must be a comma separated list, e.g. 2,3")
+    if cpus and not cpus <= os.sched_getaffinity(0):
+        raise HTTPException(status_code=400, detail=f"CPUs must be within {sorted(os.sched_getaffinity(0))}")
+
+    settings = channel.dict()
+    settings["renditions"] = [r.dict() for r in channel.renditions or []]
+    manager = channels.define(settings)
+    channels.save(db)
+    notify_schedule_changed() # A new channel picks up the program schedule
+    return channel_summary(manager)
+
+@app.delete("/api/channels/{name}")
+def delete_channel(name: str, db: Session = Depends(get_db)):
+    if name == DEFAULT_CHANNEL:
+        raise HTTPException(status_code=400, detail="The default channel cannot be deleted")
+    get_channel_or_404(name)
+    channels.remove(name)
+    channels.save(db)
+    for item in db.query(SystemConfig).filter(SystemConfig.key.startswith(channel_config_key(name, ""), autoescape=True)).all():
+        db.delete(item)
+    # Its news would match no overlay any more: share it with every channel
+    moved = db.query(NewsItem).filter(NewsItem.channel == name).update({NewsItem.channel: None}, synchronize_session=False)
+    db.commit()
+    if moved and schedule_loop:
+        # Sync endpoint (threadpool): the overlays pick the items up on the server loop
+        asyncio.run_coroutine_threadsafe(broadcast_news_update("NEWS_REFRESH", {"count": moved}), schedule_loop)
+    return {"status": "deleted", "news_shared": moved}
+
+@app.post("/api/channels/{name}/start")
+def start_channel(name: str, db: Session = Depends(get_db)):
+    manager = get_channel_or_404(name)
+    if manager.is_running():
+        return {"status": "already_running"}
+    settings = channels.settings.get(name, {})
+
+    profiles = load_output_profiles(db)
+    profile_name = settings.get("profile") or get_selected_profile_name(db)
+    if profile_name not in profiles:
+        raise HTTPException(status_code=400, detail=f"Unknown output profile: {profile_name}")
+
+    manager.music_playlist = load_music_playlist(db)
+    manager.start(
+        rtmp_url=settings.get("rtmp_url"),
+        backup_rtmp_url=settings.get("backup_rtmp_url"),
+        stream_key=settings.get("stream_key"),
+        profile=dict(profiles[profile_name], name=profile_name),
+        renditions=settings.get("renditions")
+    )
+    return {"status": "started", "profile": profile_name}
+
+@app.post("/api/channels/{name}/stop")
+def stop_channel(name: str):
+    get_channel_or_404(name).stop()
+    return {"status": "stopped"}
+
+@app.get("/api/channels/{name}/stats")
+def get_channel_stats(name: str):
+    manager = get_channel_or_404(name)
+    return dict(channel_summary(manager),
+                stats=manager.stats,
+                progress=manager.progress,
+                recoveries=list(manager.recoveries))
+
+# --- Recordings ---
+def list_recordings(directory, start=None, end=None):
+    """Recorded segments overlapping [start, end] (naive UTC), oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    segments = []
+    for name in sorted(os.listdir(directory)):
+        match = RECORDING_NAME.match(name)
+        if not match:
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue # Deleted by retention meanwhile
+        segments.append({
+            "name": name,
+            "start": datetime.datetime.strptime(match.group(1), "%Y%m%d-%H%M%S"),
+            "end": datetime.datetime.utcfromtimestamp(stat.st_mtime),
+            "size": stat.st_size
+        })
+    # A segment ends where the next one starts (the file's mtime trails that by
+    # the muxer flush), or at its last write when recording stopped in between
+    for segment, following in zip(segments, segments[1:]):
+        segment["end"] = min(segment["end"], following["start"])
+    return [
+        seg for seg in segments
+        if (end is None or seg["start"] < end) and (start is None or seg["end"] > start)
+    ]
+
+def utc_naive(value):
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+@app.get("/api/recordings")
+def get_recordings(start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None,
+                   channel: Optional[str] = None):
+    """On-air segments in a time range (ISO timestamps, naive = UTC)."""
+    manager = get_channel_or_404(channel)
+    segments = list_recordings(manager.recordings_dir, utc_naive(start), utc_naive(end))
+    query = f"?channel={manager.name}" if channel else ""
+    return [
+        dict(seg, start=seg["start"].isoformat(), end=seg["end"].isoformat(), url=f"/api/recordings/{seg['name']}{query}")
+        for seg in segments
+    ]
+
+@app.get("/api/recordings/download")
+def download_recordings(start: datetime.datetime, end: datetime.datetime, channel: Optional[str] = None):
+    """All segments in a time range as one MPEG-TS file (TS segments concatenate as-is)."""
+    directory = get_channel_or_404(channel).recordings_dir
+    segments = list_recordings(directory, utc_naive(start), utc_naive(end))
+    if not segments:
+        raise HTTPException(status_code=404, detail="No recordings in that range")
+
+    def stream():
+        for seg in segments:
+            try:
+                with open(os.path.join(directory, seg["name"]), "rb") as f:
+                    while True:
+                        chunk = f.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        yield chunk
+            except OSError:
+                continue # Pruned while downloading
+
+    filename = f"recording_{segments[0]['start']:%Y%m%d-%H%M%S}_{segments[-1]['end']:%Y%m%d-%H%M%S}.ts"
+    return StreamingResponse(stream(), media_type="video/mp2t",
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/api/recordings/{name}")
+def download_recording(name: str, channel: Optional[str] = None):
+    if not RECORDING_NAME.match(name):
+        raise HTTPException(status_code=404, detail="Recording not found")
+    path = os.path.join(get_channel_or_404(channel).recordings_dir, name)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Recording not found")
+    return FileResponse(path, media_type="video/mp2t", filename=name)
+
+
 # --- Voting Configuration API ---
 class VotingConfig(BaseModel):
     youtube_api_key: Optional[str] = None
@@ -1190,7 +2187,7 @@ def test_vote_connection(api_key: str, video_id: str):
 @app.get("/api/votes/status")
 def get_vote_status():
     from services.vote_collector import vote_collector
-    return vote_collector.status
+    return dict(vote_collector.status, broadcast=vote_batcher.stats())
 
 @app.get("/api/logs")
 def get_api_logs(db: Session = Depends(get_db)):
@@ -1201,17 +2198,11 @@ def get_api_logs(db: Session = Depends(get_db)):
 # --- Voting System API ---
 @app.get("/api/votes/counts")
 def get_vote_counts(db: Session = Depends(get_db)):
-    from services.vote_collector import PARTIES
+    from services.vote_collector import vote_counts
     print(f"[API] GET /api/votes/counts called")
     
-    db_counts = db.query(VoteCount).all()
-    
-    # Start with zeroes for all defined parties
-    results = {code: 0 for code in PARTIES.keys()}
-    
-    # Overwrite with actual totals from DB
-    for c in db_counts:
-        results[c.party_code] = c.total
+    # Zero for parties without votes, same totals as the NEW_VOTES batches
+    results = vote_counts(db)
         
     print(f"[API] Returning vote counts: {results}")
     return results
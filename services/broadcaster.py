@@ -0,0 +1,122 @@
+import time
+import asyncio
+import collections
+
+# WebSocket fan-out: publish() serializes nothing and awaits nothing, it only
+# appends the (already encoded) frame to each client's bounded queue. Every
+# client has its own writer task, so a slow browser only delays itself. A
+# client whose queue is full or whose oldest frame has waited longer than
+# max_lag is disconnected (close code 1013, the pages reconnect and refetch).
+
+class Client:
+    def __init__(self, websocket):
+        self.websocket = websocket
+        peer = getattr(websocket, "client", None)
+        self.peer = f"{peer.host}:{peer.port}" if peer else "unknown"
+        self.pending = collections.deque() # (queued_at, frame)
+        self.wake = asyncio.Event()
+        self.writer = None
+        self.connected_at = time.time()
+        self.sent = 0
+        self.last_lag = 0.0 # queued -> sent of the last frame, seconds
+        self.max_lag = 0.0
+        self.dropped = None # Why the client was disconnected
+
+    def backlog_age(self, now):
+        return now - self.pending[0][0] if self.pending else 0.0
+
+
+class Broadcaster:
+    def __init__(self, name, queue_size=100, max_lag=5.0, close_timeout=1.0):
+        self.name = name
+        self.queue_size = queue_size # frames queued per client before it is dropped
+        self.max_lag = max_lag # seconds the oldest queued frame may wait
+        self.close_timeout = close_timeout
+        self.clients = {} # websocket -> Client
+
+        self.published = 0
+        self.slow_disconnects = 0
+        self.frames_discarded = 0 # queued for clients that were dropped
+
+    def publish(self, frame):
+        """Queue a text frame for every client. Event loop only, never blocks."""
+        self.published += 1
+        now = time.monotonic()
+        for client in list(self.clients.values()):
+            if len(client.pending) >= self.queue_size:
+                self._drop(client, f"{len(client.pending)} frames queued")
+            elif client.backlog_age(now) > self.max_lag:
+                self._drop(client, f"{client.backlog_age(now):.1f}s behind")
+            else:
+                client.pending.append((now, frame))
+                client.wake.set()
+
+    def _drop(self, client, reason):
+        client.dropped = reason
+        self.clients.pop(client.websocket, None)
+        self.slow_disconnects += 1
+        self.frames_discarded += len(client.pending)
+        client.pending.clear()
+        if client.writer:
+            client.writer.cancel()
+        print(f"[WS:{self.name}] Disconnecting slow client {client.peer}: {reason}")
+
+    async def _write(self, client):
+        while True:
+            if not client.pending:
+                client.wake.clear()
+                await client.wake.wait()
+                continue
+            queued_at, frame = client.pending[0]
+            await client.websocket.send_text(frame)
+            if client.pending and client.pending[0][1] is frame:
+                client.pending.popleft()
+            client.sent += 1
+            client.last_lag = time.monotonic() - queued_at
+            client.max_lag = max(client.max_lag, client.last_lag)
+
+    async def serve(self, websocket, initial=None):
+        """Run one accepted client until it disconnects or falls behind."""
+        client = Client(websocket)
+        if initial is not None:
+            client.pending.append((time.monotonic(), initial))
+        self.clients[websocket] = client
+        client.writer = asyncio.create_task(self._write(client))
+        try:
+            while not client.writer.done():
+                receive = asyncio.create_task(websocket.receive_text())
+                done, _ = await asyncio.wait({receive, client.writer}, return_when=asyncio.FIRST_COMPLETED)
+                if receive in done:
+                    receive.result() # raises on disconnect
+                else:
+                    receive.cancel()
+        except Exception:
+            pass # Disconnected
+        finally:
+            client.writer.cancel()
+            self.clients.pop(websocket, None)
+            if client.dropped:
+                try:
+                    await asyncio.wait_for(websocket.close(code=1013), self.close_timeout)
+                except Exception:
+                    pass
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "clients": len(self.clients),
+            "published": self.published,
+            "slow_disconnects": self.slow_disconnects,
+            "frames_discarded": self.frames_discarded,
+            "queue_size": self.queue_size,
+            "max_lag_ms": int(self.max_lag * 1000),
+            "per_client": [{
+                "peer": c.peer,
+                "connected_s": int(time.time() - c.connected_at),
+                "queued": len(c.pending),
+                "backlog_ms": int(c.backlog_age(now) * 1000),
+                "last_lag_ms": int(c.last_lag * 1000),
+                "max_lag_ms": int(c.max_lag * 1000),
+                "sent": c.sent
+            } for c in list(self.clients.values())]
+        }
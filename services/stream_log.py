@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import asyncio
+import datetime
+import threading
+import collections
+
+from services.broadcaster import Broadcaster
+
+# Stream log pipeline: lines from main.py go to a buffered, size-rotated file,
+# a ring of recent lines (replayed to new /ws/logs clients) and batched
+# WebSocket frames sent through a Broadcaster. Every buffer is bounded, a log
+# storm drops lines instead of growing memory or blocking the stdout reader.
+
+class StreamLog:
+    def __init__(self, path, max_bytes=5 * 1024 * 1024, backups=3, ring_size=500,
+                 flush_interval=1.0, batch_interval=0.25, max_pending=5000, client_frames=20, client_lag=10.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval # seconds between file writes
+        self.batch_interval = batch_interval # seconds between WebSocket frames
+        self.max_pending = max_pending # lines held for the file and for the next frame
+        self.clients = Broadcaster("logs", queue_size=client_frames, max_lag=client_lag)
+
+        self.lock = threading.Lock()
+        self.file_pending = collections.deque(maxlen=max_pending)
+        self.ws_pending = collections.deque(maxlen=max_pending)
+        self.recent = collections.deque(maxlen=ring_size)
+        self.file = None
+        self.file_size = 0
+
+        self.lines = 0
+        self.file_dropped = 0
+        self.ws_dropped = 0
+        self.rotations = 0
+
+        self.writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer.start()
+
+    # --- Producers (any thread) ---
+    def add(self, line):
+        """A stream log line: file, recent ring and live clients."""
+        with self.lock:
+            self.lines += 1
+            if len(self.ws_pending) == self.ws_pending.maxlen:
+                self.ws_dropped += 1
+            self.ws_pending.append(line)
+            self.recent.append(line)
+        self.write(line)
+
+    def write(self, message):
+        """File only (StreamManager events)."""
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock:
+            if len(self.file_pending) == self.file_pending.maxlen:
+                self.file_dropped += 1
+            self.file_pending.append(f"[{timestamp}] {message}\n")
+
+    # --- File writer ---
+    def _writer_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            with self.lock:
+                if not self.file_pending:
+                    continue
+                chunk = "".join(self.file_pending)
+                self.file_pending.clear()
+            try:
+                self._write_chunk(chunk.encode("utf-8"))
+            except Exception as e:
+                print(f"Failed to write to log file: {e}")
+                self.file = None
+
+    def _write_chunk(self, data):
+        if self.file is None:
+            self.file = open(self.path, "ab")
+            self.file_size = self.file.tell()
+        if self.file_size + len(data) > self.max_bytes and self.file_size > 0:
+            self._rotate()
+        self.file.write(data)
+        self.file.flush()
+        self.file_size += len(data)
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{i}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, "ab")
+        self.file_size = 0
+        self.rotations += 1
+
+    # --- WebSocket fan-out (event loop) ---
+    async def run(self):
+        """Background task: one frame per batch_interval with everything new."""
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            with self.lock:
+                if not self.ws_pending:
+                    continue
+                lines = list(self.ws_pending)
+                self.ws_pending.clear()
+            self.clients.publish(json.dumps({"logs": lines}))
+
+    async def serve(self, websocket):
+        """Run one /ws/logs client until it disconnects or falls behind."""
+        with self.lock:
+            history = list(self.recent)
+        initial = json.dumps({"logs": history, "history": True}) if history else None
+        await self.clients.serve(websocket, initial)
+
+    def stats(self):
+        return {
+            "lines": self.lines,
+            "clients": len(self.clients.clients),
+            "recent": len(self.recent),
+            "file_dropped": self.file_dropped,
+            "ws_dropped": self.ws_dropped,
+            "slow_disconnects": self.clients.slow_disconnects,
+            "rotations": self.rotations
+        }
@@ -0,0 +1,76 @@
+import time
+import asyncio
+import threading
+import collections
+
+# Bridge from the VoteCollector thread into the server's event loop. Votes
+# that arrive within one window go out as a single NEW_VOTES message carrying
+# the latest totals and at most max_display voters to animate, so a poll with
+# hundreds of votes costs one fan-out and a handful of overlay popups.
+
+class VoteBatcher:
+    def __init__(self, publish, window=2.0, max_display=3):
+        self.publish = publish # async publish(type, payload), runs on the loop
+        self.window = window # seconds votes are collected before a batch is sent
+        self.max_display = max_display # voters per batch shown as popups
+        self.loop = None
+
+        self.lock = threading.Lock()
+        self.display = collections.deque(maxlen=max_display) # newest voters only
+        self.pending = 0 # votes in the open window
+        self.counts = None # latest totals, party code -> votes
+        self.scheduled = False
+
+        self.votes = 0
+        self.batches = 0
+        self.displayed = 0
+        self.last_batch_at = None
+
+    def attach(self, loop):
+        """Called on startup with the server's running loop."""
+        self.loop = loop
+
+    def submit(self, votes, counts=None):
+        """New votes from any thread. Never blocks on the loop."""
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return False
+        with self.lock:
+            self.display.extend(votes)
+            self.pending += len(votes)
+            self.votes += len(votes)
+            if counts is not None:
+                self.counts = counts
+            if self.scheduled:
+                return True
+            self.scheduled = True
+        asyncio.run_coroutine_threadsafe(self._flush_later(), loop)
+        return True
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        with self.lock:
+            voters = list(self.display)
+            payload = {"voters": voters, "count": self.pending}
+            if self.counts is not None:
+                payload["counts"] = self.counts
+            self.display.clear()
+            self.pending = 0
+            self.scheduled = False
+        self.batches += 1
+        self.displayed += len(voters)
+        self.last_batch_at = time.time()
+        try:
+            await self.publish("NEW_VOTES", payload)
+        except Exception as e:
+            print(f"[VoteBatcher] Publish error: {e}")
+
+    def stats(self):
+        return {
+            "votes": self.votes,
+            "batches": self.batches,
+            "displayed": self.displayed,
+            "window_s": self.window,
+            "max_display": self.max_display,
+            "last_batch_at": self.last_batch_at
+        }
@@ -28,6 +28,13 @@ PARTIES = {
     }
 }
 
+def vote_counts(db: Session):
+    """Totals per party code, zero for parties without votes."""
+    results = {code: 0 for code in PARTIES.keys()}
+    for c in db.query(VoteCount).all():
+        results[c.party_code] = c.total
+    return results
+
 class VoteCollector:
     def __init__(self):
         self.api_key = None
@@ -41,7 +48,7 @@ class VoteCollector:
         self.last_chat_id = None
         self.cached_chat_id = None # Cache for Chat ID
         self.cached_video_id = None # For cache invalidation
-        self.on_new_vote = None
+        self.on_new_vote = None # on_new_vote(votes, counts), called from the collector thread
         self.status = {
             "is_running": False,
             "last_poll_at": None,
@@ -368,7 +375,7 @@ class VoteCollector:
 
                 # Broadcast new votes if any
                 if new_votes and self.on_new_vote:
-                    self.on_new_vote(new_votes)
+                    self.on_new_vote(new_votes, vote_counts(db))
 
             except Exception as e:
                 print(f"[VoteCollector] Loop Error: {e}")
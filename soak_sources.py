@@ -0,0 +1,245 @@
+"""
+Source lifecycle soak test.
+
+Runs thousands of program clip switches, TTS announcements and music bed
+playlist changes through the same ProgramBin / SourceManager / TTSPlayer /
+MusicBed code as main.py, against a fakesink copy of the selector and mixer
+topology:
+
+  program bins -> vsel / asel (input-selector) -> fakesink
+  music (appsrc) + TTS (appsrc) -> audiomixer -> asel.sink_0
+
+RTMP outputs are not covered: their reattachment needs the encoders and a
+reachable ingest server, which this harness does not build.
+
+Usage:
+  python soak_sources.py [--switches 2000] [--interval 200] [--tts-every 5]
+                         [--music-every 50] [--sample 100] [--clip media/clip.mp4]
+
+Without --clip a short test clip and a few TTS clips are rendered to a temp
+directory. Every --sample switches it reports RSS, elements in the pipeline,
+selector/mixer pad counts and bins removed but not yet freed. Exits non-zero
+if pads or bins were leaked or RSS kept growing. For a per-object list run it
+with GST_TRACERS=leaks GST_DEBUG=GST_TRACER:7.
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+
+from main import (Gst, GLib, ProgramBin, SourceManager, TTSPlayer, MusicBed, WIDTH, HEIGHT, PCM_CAPS,
+                  PCM_CHUNK_FRAMES, PCM_FRAME_BYTES, pipeline_elements)
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def render(description):
+    pipeline = Gst.parse_launch(description)
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    if msg and msg.type == Gst.MessageType.ERROR:
+        err, debug = msg.parse_error()
+        raise RuntimeError(f"{err} ({debug})")
+
+
+def make_media(directory):
+    clip = os.path.join(directory, "soak_clip.avi")
+    render(
+        f"videotestsrc num-buffers=45 ! video/x-raw,width=320,height=240,framerate=15/1 ! jpegenc ! "
+        f"avimux name=mux ! filesink location={clip} "
+        f"audiotestsrc num-buffers=130 samplesperbuffer=1024 ! "
+        f"audio/x-raw,format=S16LE,rate=44100,channels=2 ! mux."
+    )
+    tts_files = []
+    for i, freq in enumerate((440, 660, 880)):
+        path = os.path.join(directory, f"soak_tts_{i}.wav")
+        render(f"audiotestsrc num-buffers=40 freq={freq} ! audioconvert ! wavenc ! filesink location={path}")
+        tts_files.append(path)
+    return clip, tts_files
+
+
+class SoakApp:
+    # The parts of StreamOverlayApp that ProgramBin, TTSPlayer and MusicBed use
+
+    def __init__(self, args, clip, tts_files):
+        self.args = args
+        self.clip = clip
+        self.tts_files = tts_files
+        self.pipeline = Gst.parse_launch(
+            f'input-selector name=vsel ! videoconvert ! fakesink sync=true '
+            f'videotestsrc pattern=black ! video/x-raw,width={WIDTH},height={HEIGHT},framerate=15/1 ! '
+            f'videoconvert ! vsel.sink_0 '
+            f'input-selector name=asel ! fakesink sync=true '
+            f'audiomixer name=amix ! asel.sink_0 '
+            f'appsrc name=music_src format=time stream-type=stream block=false '
+            f'max-bytes={4 * PCM_CHUNK_FRAMES * PCM_FRAME_BYTES} caps="{PCM_CAPS}" ! amix.sink_0 '
+            f'appsrc name=tts_src format=time stream-type=stream block=false '
+            f'max-bytes={4 * PCM_CHUNK_FRAMES * PCM_FRAME_BYTES} caps="{PCM_CAPS}" ! amix.sink_1 '
+        )
+        self.vsel = self.pipeline.get_by_name('vsel')
+        self.asel = self.pipeline.get_by_name('asel')
+        self.amix = self.pipeline.get_by_name('amix')
+        self.sources = SourceManager(self.pipeline, (self.vsel, self.asel, self.amix))
+        self.tts = TTSPlayer(self.pipeline.get_by_name('tts_src'), lambda name: None, lambda: None)
+        self.music = MusicBed(self.pipeline.get_by_name('music_src'))
+        self.playlists = 0
+        self.loop = GLib.MainLoop()
+        self.program = None
+        self.cued = None
+        self.switches = 0
+        self.errors = 0
+        self.samples = []
+
+    def running_time(self):
+        clock = self.pipeline.get_clock()
+        if clock is None:
+            return 0
+        return clock.get_time() - self.pipeline.get_base_time()
+
+    def output_running_time(self):
+        return self.running_time() # Nothing downstream of the selectors to queue
+
+    def record_switch(self, program, latency_ms):
+        pass
+
+    def on_program_eos(self, program):
+        return False # The next switch replaces it
+
+    def on_program_error(self, program, reason):
+        self.errors += 1
+        print(f"Program error: {reason}")
+        return False # The next switch replaces it
+
+    def on_message(self, bus, message):
+        if message.type == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            self.errors += 1
+            print(f"Error: {err} ({debug})")
+
+    def tick(self):
+        # Same order as start_program: take the cued bin on air, drop the old
+        # one, cue the next
+        if self.cued:
+            self.cued.activate()
+            if self.program:
+                self.program.teardown()
+            self.program = self.cued
+            self.switches += 1
+            if self.switches % self.args.tts_every == 0:
+                self.tts.play(self.tts_files[self.switches % len(self.tts_files)])
+            if self.switches % self.args.music_every == 0:
+                # Rotate the playlist: one track is new, the rest are reused
+                self.playlists += 1
+                start = self.playlists % len(self.tts_files)
+                self.music.set_playlist((self.tts_files * 2)[start:start + 2])
+            if self.switches % self.args.sample == 0:
+                self.sample()
+        if self.switches >= self.args.switches:
+            self.finish()
+            return False
+        self.cued = ProgramBin(self, {"id": self.switches, "title": "soak", "clips": [self.clip]}, 0)
+        return True
+
+    def sample(self):
+        gc.collect()
+        stats = self.sources.stats()
+        pads = stats["selector_pads"]
+        sample = {
+            "switches": self.switches,
+            "rss_mb": rss_mb(),
+            "elements": len(pipeline_elements(self.pipeline)),
+            "vsel": pads["vsel"], "asel": pads["asel"], "amix": pads["amix"],
+            "pending": stats["pending"],
+            "finalized": stats["finalized"],
+            "tts": self.tts.stats()["played"]
+        }
+        self.samples.append(sample)
+        print(f"{sample['switches']:>8}{sample['rss_mb']:>10.1f}{sample['elements']:>10}"
+              f"{sample['vsel']:>6}{sample['asel']:>6}{sample['amix']:>6}"
+              f"{sample['pending']:>9}{sample['finalized']:>11}{sample['tts']:>6}")
+
+    def finish(self):
+        for program in (self.cued, self.program):
+            if program:
+                program.teardown()
+        self.cued = self.program = None
+        # Give the last bins a moment to be released before the final count
+        GLib.timeout_add(1000, self.loop.quit)
+
+    def run(self):
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message', self.on_message)
+        self.pipeline.set_state(Gst.State.PLAYING)
+        baseline = {element.get_name(): len(element.sinkpads) for element in (self.vsel, self.asel, self.amix)}
+
+        print(f"--- Source Soak ({self.args.switches} switches every {self.args.interval} ms, "
+              f"TTS every {self.args.tts_every}) ---")
+        print(f"{'switches':>8}{'rss MB':>10}{'elements':>10}{'vsel':>6}{'asel':>6}{'amix':>6}"
+              f"{'pending':>9}{'finalized':>11}{'tts':>6}")
+        GLib.timeout_add(self.args.interval, self.tick)
+        self.loop.run()
+        self.sample()
+        self.pipeline.set_state(Gst.State.NULL)
+        return self.verdict(baseline)
+
+    def verdict(self, baseline):
+        final = self.samples[-1]
+        stats = self.sources.stats()
+        failures = []
+        for name, count in baseline.items():
+            if final[name] != count:
+                failures.append(f"{name} has {final[name]} sink pads, started with {count}")
+        if stats["request_pads"]:
+            failures.append(f"{stats['request_pads']} selector pads still held")
+        if stats["pending"]:
+            failures.append(f"{stats['pending']} removed bins never freed")
+        if stats["stuck"]:
+            failures.append(f"{stats['stuck']} bins did not reach NULL")
+        # Compare the second half against the first: caches and allocator
+        # pools are warm by then, steady growth means a leak
+        if len(self.samples) >= 4:
+            middle = self.samples[len(self.samples) // 2]["rss_mb"]
+            growth = final["rss_mb"] - middle
+            if growth > self.args.max_growth_mb:
+                failures.append(f"RSS grew {growth:.1f} MB over the second half")
+        if self.errors:
+            failures.append(f"{self.errors} pipeline errors")
+
+        if failures:
+            print("FAIL: " + "; ".join(failures))
+            return 1
+        print(f"OK: {self.switches} switches, {stats['finalized']} bins freed, "
+              f"{final['tts']} announcements, {self.playlists} playlists, RSS {final['rss_mb']:.1f} MB")
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak program/TTS/music switching and check for leaks")
+    parser.add_argument("--switches", type=int, default=2000)
+    parser.add_argument("--interval", type=int, default=200, help="ms between switches")
+    parser.add_argument("--tts-every", type=int, default=5, help="queue an announcement every N switches")
+    parser.add_argument("--music-every", type=int, default=50, help="change the music playlist every N switches")
+    parser.add_argument("--sample", type=int, default=100, help="report every N switches")
+    parser.add_argument("--max-growth-mb", type=float, default=20.0)
+    parser.add_argument("--clip", help="program clip to switch between (default: generated)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        clip, tts_files = make_media(directory)
+        if args.clip:
+            clip = args.clip
+        sys.exit(SoakApp(args, clip, tts_files).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,7 @@ const pageTitle = document.getElementById('pageTitle');
 document.addEventListener('DOMContentLoaded', () => {
     fetchNews();
     fetchConfig();
+    fetchProfiles();
     connectWebSocket();
     document.getElementById('startTime').innerText = new Date().toLocaleTimeString();
 });
@@ -753,6 +754,21 @@ const btnStop = document.getElementById('btnStop');
 const inpStreamKey = document.getElementById('inpStreamKey');
 const previewBadge = document.getElementById('previewLiveBadge');
 
+async function fetchProfiles() {
+    const selProfile = document.getElementById('selProfile');
+    if (!selProfile) return;
+    try {
+        const res = await fetch(`${API_BASE}/config/profiles`);
+        const d = await res.json();
+        selProfile.innerHTML = Object.entries(d.profiles).map(([name, p]) =>
+            `<option value="${name}">${name} (${p.width}x${p.height}@${p.framerate}, ${p.video_bitrate} kbps)</option>`
+        ).join('');
+        selProfile.value = d.selected;
+    } catch (e) {
+        console.error("Failed to load output profiles", e);
+    }
+}
+
 async function startStream() {
     const streamKey = document.getElementById('inpStreamKey').value.trim();
     if (!streamKey) return alert("Please enter a Stream Key");
@@ -798,10 +814,12 @@ async function startStream() {
         }
     }
 
+    const selProfile = document.getElementById('selProfile');
     const payload = {
         rtmp_url: rtmpUrl,
         stream_key: streamKey,
-        backup_rtmp_url: backupUrl
+        backup_rtmp_url: backupUrl,
+        profile: selProfile && selProfile.value ? selProfile.value : null
     };
 
     // UI Loading state
@@ -904,9 +922,69 @@ setInterval(async () => {
         const res = await fetch(`${API_BASE}/stream/status`);
         const d = await res.json();
         setStreamState(d.running);
+        previewRunning = d.running;
     } catch (e) { }
 }, 2000);
 
+// On-air preview: a JPEG snapshot refreshed by main.py every couple of seconds.
+// Revalidated by ETag, so an unchanged frame costs a 304.
+const previewImage = document.getElementById('previewImage');
+let previewEtag = null;
+let previewRunning = false;
+async function fetchPreview() {
+    if (!previewRunning) {
+        previewImage.style.display = 'none';
+        previewEtag = null;
+        return;
+    }
+    try {
+        const res = await fetch(`${API_BASE}/stream/preview.jpg`, { cache: 'no-cache' });
+        if (!res.ok) return;
+        const etag = res.headers.get('ETag');
+        if (etag && etag === previewEtag) return;
+        const url = URL.createObjectURL(await res.blob());
+        previewImage.onload = () => URL.revokeObjectURL(url);
+        previewImage.src = url;
+        previewImage.style.display = 'block';
+        previewEtag = etag;
+    } catch (e) { }
+}
+setInterval(fetchPreview, 2000);
+
+// Pipeline Health (main.py reports every 5s)
+async function fetchPipelineMetrics() {
+    try {
+        const res = await fetch(`${API_BASE}/stream/metrics?history=0`);
+        const d = await res.json();
+        const m = d.latest;
+        if (!d.running || !m) {
+            document.getElementById('metricsUpdated').innerText = d.running ? 'Waiting for data' : 'Off air';
+            return;
+        }
+        const outputs = Object.entries(m.outputs || {});
+        const queues = Object.entries(m.queues || {});
+        const late = outputs.reduce((n, [, o]) => n + o.late, 0);
+        const dropped = queues.reduce((n, [, q]) => n + q.drops, 0)
+            + outputs.reduce((n, [, o]) => n + o.queue_drops, 0)
+            + Object.values(m.qos_dropped || {}).reduce((n, v) => n + v, 0);
+
+        document.getElementById('metricFps').innerText = m.output_fps;
+        document.getElementById('metricEncode').innerText = m.encode_ms ?? '-';
+        document.getElementById('metricLate').innerText = late;
+        document.getElementById('metricDropped').innerText = dropped;
+        document.getElementById('metricOutputs').innerHTML = outputs.map(([name, o]) =>
+            `<div class="truncate" title="${o.location}${o.last_error ? ' - ' + o.last_error : ''}">` +
+            `${name}: <span class="${o.state === 'live' ? 'text-green-600' : 'text-red-500'}">${o.state}</span>` +
+            ` &middot; ${o.kbps} kbps &middot; ${o.reconnects} reconnects</div>`).join('');
+        document.getElementById('metricQueues').innerHTML = queues.map(([name, q]) =>
+            `<div>${name}: ${q.buffers}/${q.max_buffers} (${q.time_ms} ms)${q.leaky ? ' leaky' : ''}</div>`).join('');
+        document.getElementById('metricsUpdated').innerText =
+            'Updated ' + new Date(m.at * 1000).toLocaleTimeString();
+    } catch (e) { }
+}
+fetchPipelineMetrics();
+setInterval(fetchPipelineMetrics, 5000);
+
 // Logs
 const logWindow = document.getElementById('logWindow');
 function clearLogs() {
@@ -917,17 +995,29 @@ function clearLogs() {
 // For now, we mix logs into same WS or assuming separate. 
 // Server has /ws/logs. Let's process it.
 
-const wsLogs = new WebSocket('ws://' + window.location.host + '/ws/logs');
-wsLogs.onmessage = (e) => {
+function connectLogSocket() {
+    const wsLogs = new WebSocket('ws://' + window.location.host + '/ws/logs');
+    wsLogs.onmessage = onLogMessage;
+    // The server drops viewers that fall too far behind; the history frame fills the gap
+    wsLogs.onclose = () => setTimeout(connectLogSocket, 3000);
+}
+connectLogSocket();
+
+function onLogMessage(e) {
     const d = JSON.parse(e.data);
-    if (d.log) {
+    // One frame per batch of lines (recent history first on connect)
+    const lines = d.logs || (d.log ? [d.log] : []);
+    if (!lines.length) return;
+    const fragment = document.createDocumentFragment();
+    for (const log of lines.slice(-50).reverse()) {
         const line = document.createElement('div');
-        line.innerText = `> ${d.log}`;
-        logWindow.prepend(line);
-        // prune
-        if (logWindow.children.length > 50) logWindow.lastChild.remove();
+        line.innerText = `> ${log}`;
+        fragment.appendChild(line);
     }
-};
+    logWindow.prepend(fragment);
+    // prune
+    while (logWindow.children.length > 50) logWindow.lastChild.remove();
+}
 
 // --- Utilities ---
 function toggleFullscreen(elemId) {
@@ -1192,9 +1282,16 @@ async function submitProgram() {
         videoPath = videoPath.substring(1); // Remove leading slash -> "media/foo.mp4"
     }
 
+    const extraClips = document.getElementById('progClips').value.split('\n')
+        .map(c => c.trim())
+        .filter(c => c)
+        .map(c => c.startsWith('/media/') ? c.substring(1) : c);
+
     const payload = {
         title: title,
         video_path: videoPath,
+        clips: [videoPath, ...extraClips],
+        loop: document.getElementById('progLoop').checked,
         start_time: new Date(start).toISOString(),
         end_time: new Date(end).toISOString(),
         is_active: true